@@ -0,0 +1,190 @@
+import threading
+from datetime import datetime, timedelta
+
+#stati di una condizione di allerta
+NORMAL = "normal"
+ALERTING = "alerting"
+
+#finestre dei digest per settings['email']['frequency']
+DIGEST_WINDOWS = {
+    'hourly': timedelta(hours=1),
+    'daily': timedelta(days=1)
+}
+
+DEFAULT_ALERT_SETTINGS = {
+    'hysteresis': 0.2,  #la condizione rientra solo sotto soglia - isteresi
+    'renotify_minutes': 30,  #promemoria se l'allerta resta attiva
+    'max_immediate_per_hour': 6  #oltre questo limite gli eventi finiscono nel digest
+}
+
+
+#riepilogo degli eventi accumulati per un digest
+class _DigestWindow:
+    def __init__(self, start):
+        self.start = start
+        self.exceedances = 0
+        self.episodes = 0
+        self.peak = None
+        self.peak_time = None
+        self.first = None
+        self.last = None
+
+    def add(self, value, now, new_episode):
+        self.exceedances += 1
+        self.episodes += int(new_episode)
+        if self.peak is None or value > self.peak:
+            self.peak, self.peak_time = value, now
+        self.first = self.first or now
+        self.last = now
+
+    def summary(self, condition, threshold, end):
+        return {
+            'condition': condition,
+            'window_start': self.start.isoformat(),
+            'window_end': end.isoformat(),
+            'exceedances': self.exceedances,
+            'episodes': self.episodes,
+            'peak_value': self.peak,
+            'peak_time': self.peak_time.isoformat() if self.peak_time else None,
+            'first_exceedance': self.first.isoformat() if self.first else None,
+            'last_exceedance': self.last.isoformat() if self.last else None,
+            'threshold': threshold
+        }
+
+
+class _ConditionState:
+    def __init__(self):
+        self.state = NORMAL
+        self.entered_at = None
+        self.last_notified = None
+        self.peak = None
+        self.digest = None
+
+
+#macchina a stati delle allerte: isteresi per condizione, promemoria a intervalli minimi e digest
+#orari/giornalieri. Le email in uscita sono limitate a prescindere dalla frequenza dei dati:
+#al più una per episodio più i promemoria, con un tetto orario, o un digest per finestra
+class AlertManager:
+    def __init__(self, notify_alert, notify_digest, settings_provider, tick_seconds=30):
+        self.notify_alert = notify_alert  #(condition, value, context) -> invio immediato
+        self.notify_digest = notify_digest  #(summary) -> invio del riepilogo
+        self.settings_provider = settings_provider  #restituisce le settings correnti del server
+        self._conditions = {}
+        self._immediate_sent = []
+        self._lock = threading.Lock()
+        self.suppressed_count = 0
+        self._stop = threading.Event()
+        self._ticker = threading.Thread(target=self._tick_loop, args=(tick_seconds,), daemon=True)
+        self._ticker.start()
+
+    def _settings(self):
+        settings = self.settings_provider()
+        alert_settings = dict(DEFAULT_ALERT_SETTINGS)
+        alert_settings.update(settings.get('alerts', {}))
+        return settings.get('email', {}).get('frequency', 'immediate'), alert_settings
+
+    #valuta un nuovo valore; le notifiche partono fuori dal lock
+    def observe(self, condition, value, threshold, context=None, now=None):
+        now = now or datetime.now()
+        frequency, alert_settings = self._settings()
+        notifications = []
+        with self._lock:
+            state = self._conditions.setdefault(condition, _ConditionState())
+            exceeded = value > threshold
+
+            if state.state == NORMAL and exceeded:
+                state.state = ALERTING
+                state.entered_at = now
+                state.peak = value
+                self._record(state, condition, value, threshold, context, now, frequency, alert_settings,
+                             notifications, new_episode=True)
+            elif state.state == ALERTING:
+                if value < threshold - alert_settings['hysteresis']:
+                    state.state = NORMAL
+                    state.entered_at = None
+                    state.peak = None
+                elif exceeded:
+                    state.peak = max(state.peak, value)
+                    self._record(state, condition, value, threshold, context, now, frequency, alert_settings,
+                                 notifications, new_episode=False)
+            current_state = state.state
+
+        for notification in notifications:
+            self._dispatch(notification)
+        return current_state
+
+    def _record(self, state, condition, value, threshold, context, now, frequency, alert_settings,
+                notifications, new_episode):
+        if frequency in DIGEST_WINDOWS:
+            if state.digest is None:
+                state.digest = _DigestWindow(now)
+            state.digest.add(value, now, new_episode)
+            return
+
+        renotify = timedelta(minutes=alert_settings['renotify_minutes'])
+        due = new_episode or state.last_notified is None or now - state.last_notified >= renotify
+        if not due:
+            return
+        #tetto orario: gli eventi in eccesso vengono riassunti nel digest successivo
+        self._immediate_sent = [t for t in self._immediate_sent if now - t < timedelta(hours=1)]
+        if len(self._immediate_sent) >= alert_settings['max_immediate_per_hour']:
+            self.suppressed_count += 1
+            if state.digest is None:
+                state.digest = _DigestWindow(now)
+            state.digest.add(value, now, new_episode)
+            return
+        self._immediate_sent.append(now)
+        state.last_notified = now
+        notifications.append(('alert', condition, value, dict(context or {}, threshold=threshold,
+                                                                  reminder=not new_episode)))
+
+    #chiude le finestre di digest scadute (anche in assenza di nuovi dati)
+    def flush_digests(self, now=None, force=False):
+        now = now or datetime.now()
+        frequency, _ = self._settings()
+        window = DIGEST_WINDOWS.get(frequency, timedelta(hours=1))
+        threshold = self.settings_provider().get('threshold')
+        notifications = []
+        with self._lock:
+            for condition, state in self._conditions.items():
+                if state.digest is None:
+                    continue
+                if force or now - state.digest.start >= window:
+                    notifications.append(('digest', state.digest.summary(condition, threshold, now)))
+                    state.digest = None
+        for notification in notifications:
+            self._dispatch(notification)
+        return len(notifications)
+
+    def _dispatch(self, notification):
+        try:
+            if notification[0] == 'alert':
+                _, condition, value, context = notification
+                self.notify_alert(condition, value, context)
+            else:
+                self.notify_digest(notification[1])
+        except Exception as e:
+            print(f"Errore invio notifica allerta: {e}")
+
+    def _tick_loop(self, tick_seconds):
+        while not self._stop.wait(tick_seconds):
+            self.flush_digests()
+
+    def stop(self):
+        self._stop.set()
+
+    def get_status(self):
+        with self._lock:
+            return {
+                'conditions': {
+                    condition: {
+                        'state': state.state,
+                        'since': state.entered_at.isoformat() if state.entered_at else None,
+                        'peak_value': state.peak,
+                        'last_notified': state.last_notified.isoformat() if state.last_notified else None,
+                        'pending_digest': state.digest.summary(condition, None, datetime.now()) if state.digest else None
+                    } for condition, state in self._conditions.items()
+                },
+                'immediate_sent_last_hour': len(self._immediate_sent),
+                'suppressed_count': self.suppressed_count
+            }
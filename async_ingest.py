@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import signal
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import paho.mqtt.client as mqtt
+
+from main import MiningServer, INGEST_MESSAGES, INGEST_ERRORS, INGEST_STAGE_SECONDS
+from latency_tracker import get_trace, mark
+
+try:
+    from google.cloud import firestore
+    HAS_FIRESTORE = True
+except ImportError:
+    HAS_FIRESTORE = False
+
+TOPIC = "mining/sensor_data"
+
+
+#client paho pilotato dal loop asyncio: letture e scritture sul socket sono callback del loop,
+#quindi nessun thread resta bloccato in loop_forever
+class AsyncMqttClient:
+    def __init__(self, loop, on_message, topic=TOPIC):
+        self.loop = loop
+        self.topic = topic
+        self.client = mqtt.Client()
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = lambda client, userdata, msg: on_message(msg)
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        self.connected = asyncio.Event()
+        self._misc_task = None
+        self._closing = False
+        self._loop_thread = threading.get_ident()
+        self._fd = None
+        self.paused = False
+
+    #la connect del socket è bloccante: viene eseguita fuori dal loop
+    async def connect(self, host, port, keepalive=60):
+        await self.loop.run_in_executor(None, self.client.connect, host, port, keepalive)
+
+    async def reconnect(self, delay=1, max_delay=60):
+        while not self._closing:
+            try:
+                await self.loop.run_in_executor(None, self.client.reconnect)
+                return
+            except OSError as e:
+                print(f"Riconnessione MQTT fallita: {e}, nuovo tentativo tra {delay} s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+    async def disconnect(self):
+        self._closing = True
+        if self.connected.is_set():
+            self.client.disconnect()
+            #attende che il DISCONNECT venga scritto e il socket chiuso
+            for _ in range(50):
+                if self.client.socket() is None:
+                    break
+                await asyncio.sleep(0.1)
+        if self._misc_task:
+            self._misc_task.cancel()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            print("Connesso al broker MQTT (asyncio)")
+            client.subscribe(self.topic)
+            self.connected.set()
+        else:
+            print(f"Errore connessione MQTT: {rc}")
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected.clear()
+        if not self._closing:
+            print(f"Disconnesso dal broker MQTT ({rc}), riconnessione")
+            self.loop.create_task(self.reconnect())
+
+    #i callback dei socket possono arrivare dal thread della connect: in quel caso passano dal loop.
+    #si registra il descrittore numerico, ancora valido quando il socket è già stato chiuso
+    def _in_loop(self, callback, *args):
+        if threading.get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        def register(fd):
+            self._fd = fd
+            if not self.paused:
+                self.loop.add_reader(fd, client.loop_read)
+            if self._misc_task is None or self._misc_task.done():
+                self._misc_task = self.loop.create_task(self._misc_loop())
+        self._in_loop(register, sock.fileno())
+
+    def _on_socket_close(self, client, userdata, sock):
+        def unregister(fd):
+            self._fd = None
+            self.loop.remove_reader(fd)
+        self._in_loop(unregister, sock.fileno())
+
+    #contropressione: senza letture dal socket il broker smette di inviare (finestra TCP piena).
+    #il keepalive continua, ma se la pausa supera il keepalive il PINGRESP non letto fa cadere
+    #la connessione, che viene poi ristabilita
+    def pause_reading(self):
+        if not self.paused:
+            self.paused = True
+            if self._fd is not None:
+                self.loop.remove_reader(self._fd)
+
+    def resume_reading(self):
+        if self.paused:
+            self.paused = False
+            if self._fd is not None:
+                self.loop.add_reader(self._fd, self.client.loop_read)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._in_loop(self.loop.add_writer, sock.fileno(), client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._in_loop(self.loop.remove_writer, sock.fileno())
+
+    #keepalive e ritrasmissioni
+    async def _misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
+
+
+#ingest su un unico event loop: le scritture su Firestore (client asincrono) restano in volo
+#in parallelo fino a max_in_flight, l'inferenza gira in un executor a un thread che mantiene
+#l'ordine dei campioni, le email partono dalla coda non bloccante dell'EmailNotifier.
+#oltre max_pending campioni accettati e non completati si smette di leggere dal broker
+class AsyncIngestService:
+    def __init__(self, server, max_in_flight=1000, drain_timeout=30, max_pending=5000):
+        self.server = server
+        self.max_in_flight = max_in_flight
+        self.max_pending = max(max_pending, 1)
+        self.drain_timeout = drain_timeout
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.db = None
+        self.loop = None
+        self.mqtt = None
+        self.tasks = set()
+        self.received = 0
+        self.processed = 0
+        self.persisted = 0
+        self.failed = 0
+        self.pauses = 0
+        self._slots = None
+        self._stopping = False
+
+    def _connect_firestore(self):
+        if not HAS_FIRESTORE or not os.path.exists('credentials.json'):
+            print("Firestore asincrono non disponibile: i campioni non verranno salvati")
+            return None
+        try:
+            return firestore.AsyncClient.from_service_account_json('credentials.json')
+        except Exception as e:
+            print(f"Errore connessione Firestore asincrono: {e}")
+            return None
+
+    def on_message(self, msg):
+        if self._stopping:
+            return
+        self.received += 1
+        INGEST_MESSAGES.inc()
+        received_at = time.time()
+        started = time.perf_counter()
+        try:
+            data = json.loads(msg.payload.decode())
+        except ValueError as e:
+            self.failed += 1
+            INGEST_ERRORS.inc(stage='decode')
+            print(f"Messaggio MQTT non valido: {e}")
+            return
+        INGEST_STAGE_SECONDS.observe(time.perf_counter() - started, stage='decode')
+        #dequeued viene marcato dall'executor quando inizia l'inferenza
+        mark(get_trace(data), 'received', received_at)
+        #l'inferenza viene accodata subito, nell'ordine di arrivo dei messaggi
+        inference = self.loop.run_in_executor(self.executor, self.server.process_sample, data)
+        task = self.loop.create_task(self.handle(data, inference))
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+        if len(self.tasks) >= self.max_pending and not self.mqtt.paused:
+            self.pauses += 1
+            print(f"Ingest saturo: {len(self.tasks)} campioni in elaborazione, lettura MQTT sospesa")
+            self.mqtt.pause_reading()
+
+    #si riprende a leggere solo sotto i tre quarti del limite, per non alternare pausa e lettura a ogni campione
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if self.mqtt.paused and len(self.tasks) <= self.max_pending * 3 // 4 and not self._stopping:
+            self.mqtt.resume_reading()
+
+    async def handle(self, data, inference):
+        try:
+            if self.db is not None:
+                async with self._slots:
+                    started = time.perf_counter()
+                    await self.persist(data)
+                    INGEST_STAGE_SECONDS.observe(time.perf_counter() - started, stage='persist')
+                mark(data['trace'], 'persisted')
+                self.persisted += 1
+        except Exception as e:
+            self.failed += 1
+            INGEST_ERRORS.inc(stage='persist')
+            print(f"Errore salvataggio Firestore: {e}")
+        try:
+            await inference
+            self.processed += 1
+            self.server.latency.record(data['trace'])
+        except Exception as e:
+            self.failed += 1
+            INGEST_ERRORS.inc(stage='process')
+            print(f"Errore elaborazione campione: {e}")
+
+    async def persist(self, data):
+        await self.db.collection('mining_data').document().set({
+            'timestamp': data['timestamp'],
+            'row_index': data['row_index'],
+            'sensor_data': data['data'],
+            'created_at': firestore.SERVER_TIMESTAMP
+        })
+
+    async def run(self, broker, port):
+        self.loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self.db = self._connect_firestore()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(sig, stop.set)
+
+        self.mqtt = AsyncMqttClient(self.loop, self.on_message)
+        try:
+            await self.mqtt.connect(broker, port)
+            print(f"Client MQTT asyncio configurato per {broker}:{port}")
+        except OSError as e:
+            print(f"Errore configurazione MQTT: {e}")
+            self.loop.create_task(self.mqtt.reconnect())
+
+        await stop.wait()
+        await self.shutdown()
+
+    #arresto ordinato: stop della sottoscrizione, poi si attende il lavoro già accettato
+    async def shutdown(self):
+        print(f"Arresto ingest asyncio: {len(self.tasks)} operazioni in corso")
+        self._stopping = True
+        await self.mqtt.disconnect()
+        pending = ()
+        if self.tasks:
+            _, pending = await asyncio.wait(list(self.tasks), timeout=self.drain_timeout)
+        if pending:
+            #oltre il timeout: le inferenze non iniziate vengono annullate; quella in corso
+            #non è interrompibile e termina prima dell'uscita dell'interprete
+            print(f"{len(pending)} operazioni non completate entro {self.drain_timeout} s, annullate")
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending)
+        else:
+            await self.loop.run_in_executor(None, self.executor.shutdown, True)
+        if self.db is not None:
+            self.db.close()
+
+        #email in coda, storico e contatori su disco prima di uscire
+        server = self.server
+        if server.email_notifier:
+            await self.loop.run_in_executor(None, server.email_notifier.flush, self.drain_timeout)
+        server.history.flush()
+        for counters in server.exceedance_counters.values():
+            if counters.snapshot_path:
+                counters.save()
+        if server.shared is not None:
+            server.publish_state()
+        print(f"Ingest asyncio arrestato: {self.get_statistics()}")
+
+    def get_statistics(self):
+        return {
+            'received': self.received,
+            'processed': self.processed,
+            'persisted': self.persisted,
+            'failed': self.failed,
+            'in_flight': len(self.tasks),
+            'max_pending': self.max_pending,
+            'pauses': self.pauses
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest asyncio per Mining Monitor')
+    parser.add_argument('--broker', default=os.getenv('MQTT_BROKER', 'localhost'), help='Broker MQTT')
+    parser.add_argument('--port', type=int, default=int(os.getenv('MQTT_PORT', '1883')), help='Porta MQTT')
+    parser.add_argument('--max-in-flight', type=int, default=1000, help='Scritture Firestore contemporanee')
+    parser.add_argument('--drain-timeout', type=float, default=30, help='Attesa massima in arresto (s)')
+    parser.add_argument('--max-pending', type=int, default=5000,
+                        help='Campioni accettati e non completati oltre i quali si sospende la lettura MQTT')
+    args = parser.parse_args()
+
+    #stesso ruolo del processo di ingest, ma senza il client MQTT a thread
+    server = MiningServer(role='ingest', start_mqtt=False)
+    service = AsyncIngestService(server, max_in_flight=args.max_in_flight, drain_timeout=args.drain_timeout,
+                                 max_pending=args.max_pending)
+    asyncio.run(service.run(args.broker, args.port))
@@ -0,0 +1,289 @@
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import itertools
+import statistics
+import contextlib
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+import synthetic_data
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+#oltre questo rapporto rispetto al baseline (mediana) il benchmark è segnalato come regressione
+DEFAULT_TOLERANCE = 0.25
+
+
+#i moduli stampano molto (ogni messaggio, ogni grafico): durante le misure l'output va scartato
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+#tempo per chiamata: warmup chiamate scartate, poi repeat misure da number chiamate ciascuna
+def measure(function, repeat=3, number=1, warmup=1):
+    for _ in range(warmup):
+        function()
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return {
+        'median_seconds': statistics.median(times),
+        'min_seconds': min(times),
+        'max_seconds': max(times),
+        'repeat': repeat,
+        'number': number
+    }
+
+
+class BenchmarkRunner:
+    def __init__(self, sizes=DEFAULT_SIZES, repeat=3, train_rows=2000, messages=2000, only=None):
+        self.sizes = list(sizes)
+        self.repeat = repeat
+        self.train_rows = train_rows
+        self.messages = messages
+        self.only = only
+        self.results = {}
+
+    def selected(self, name):
+        return not self.only or any(name.startswith(prefix) for prefix in self.only)
+
+    def run(self, name, function, repeat=None, number=1, warmup=1, **params):
+        if not self.selected(name):
+            return None
+        print(f"{name:<40}", end=' ', flush=True, file=sys.stderr)
+        with quiet():
+            result = measure(function, self.repeat if repeat is None else repeat, number, warmup)
+        result.update(params)
+        self.results[name] = result
+        print(f"{_format_seconds(result['median_seconds'])}", file=sys.stderr)
+        return result
+
+    #tutti i file (modelli, settings, storico) in una directory temporanea
+    def run_all(self):
+        workspace = tempfile.mkdtemp(prefix='mining_bench_')
+        cwd = os.getcwd()
+        logging.getLogger().setLevel(logging.WARNING)
+        try:
+            os.chdir(workspace)
+            os.makedirs('data')
+            os.makedirs('config')
+            synthetic_data.write_csv('data/mining_data.csv', self.train_rows)
+            #niente email reali e niente update incrementali in background durante le misure
+            with open('config/settings.json', 'w') as f:
+                json.dump({'email': {'enabled': False, 'recipients': [], 'frequency': 'immediate'},
+                           'model': {'incremental_learning': False}}, f)
+            frames = {n: synthetic_data.generate(n, seed=n) for n in self.sizes}
+
+            self.bench_firestore(frames)
+            predictor = self.bench_predictor(frames)
+            self.bench_charts(frames, predictor)
+            self.bench_email()
+            self.bench_ingest(frames[max(self.sizes)])
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workspace, ignore_errors=True)
+        return self.results
+
+    #query e costruzione del DataFrame da documenti nel formato salvato dall'ingest
+    def bench_firestore(self, frames):
+        import grafici_mining
+        for n, df in frames.items():
+            db = synthetic_data.SyntheticFirestore(df)
+            self.run(f'firestore_dataframe/{n}', lambda: grafici_mining.get_data_from_firestore(db, limit=n), rows=n)
+
+    #i builder leggono al più 10000 documenti da Firestore: qui ricevono direttamente un
+    #DataFrame di n righe, così si misura solo la costruzione dei grafici
+    def bench_charts(self, frames, predictor):
+        import grafici_mining
+        builders = {
+            'realtime': lambda: grafici_mining.create_realtime_charts(),
+            'historical': lambda: grafici_mining.create_historical_charts(),
+            'raw_data': lambda: grafici_mining.get_raw_data_for_charts(),
+            'prediction': lambda: grafici_mining.create_prediction_charts(predictor=predictor, hours_ahead=1)
+        }
+        loader = grafici_mining.get_data_from_firestore
+        try:
+            for n, df in frames.items():
+                with quiet():
+                    frame = loader(synthetic_data.SyntheticFirestore(df), limit=n)
+                grafici_mining.get_data_from_firestore = lambda db, collection_name='mining_data', limit=10000: frame.copy()
+                for name, builder in builders.items():
+                    if self.selected(f'chart_{name}/{n}'):
+                        with quiet():
+                            output = builder()
+                        if output.get('error'):
+                            print(f"chart_{name}/{n}: {output['error']}", file=sys.stderr)
+                            continue
+                    self.run(f'chart_{name}/{n}', builder, rows=n)
+        finally:
+            grafici_mining.get_data_from_firestore = loader
+
+    def bench_predictor(self, frames):
+        import ml_predictor
+        from feature_engineering import compute_feature_frame
+        if not any(self.selected(name) for name in ('predict_silica', 'train_model', 'chart_prediction')):
+            return None
+        print(f"Addestramento iniziale su {self.train_rows} righe sintetiche", file=sys.stderr)
+        with quiet():
+            predictor = ml_predictor.SilicaPredictor(auto_feature_importance=False)
+
+        #vettori con le feature ritardate, come in ingest
+        df = frames[min(self.sizes)]
+        with quiet():
+            samples = [predictor.update_streaming_features(row) for row in
+                       df.drop(columns=['date']).to_dict('records')]
+        rows = itertools.cycle(samples)
+        self.run('predict_silica/single', lambda: predictor.predict_silica(next(rows)), number=1000, warmup=100)
+
+        for n, df in frames.items():
+            X = df.drop(columns=['date'])
+            if predictor.feature_config:
+                X = pd.concat([X, compute_feature_frame(X, predictor.feature_config)], axis=1)
+            X = X[predictor.feature_columns].fillna(0.0)
+            self.run(f'predict_silica/batch/{n}', lambda: predictor.predict_batch(X), rows=n)
+
+        self.run('train_model', predictor.train_model, repeat=1, warmup=0, rows=self.train_rows)
+        return predictor
+
+    #solo composizione dei messaggi: senza destinatari nulla viene accodato all'invio
+    def bench_email(self):
+        import email_notifications
+        notifier = email_notifications.EmailNotifier()
+        notifier.logger.setLevel(logging.WARNING)
+        sensor_data = synthetic_data.generate(1).drop(columns=['date']).iloc[0].to_dict()
+        now = datetime.now()
+        summary = {'frequency': 'hourly', 'window_start': (now - timedelta(hours=1)).isoformat(),
+                   'window_end': now.isoformat(), 'exceedances': 42, 'episodes': 3, 'peak_value': 5.1,
+                   'peak_time': now.isoformat(), 'threshold': 4.0}
+        self.run('email_render/alert', lambda: notifier.send_alert_email([], 4.6, 4.0, sensor_data, 0.8), number=200)
+        self.run('email_render/digest', lambda: notifier.send_alert_digest([], summary), number=200)
+        self.run('email_render/mime', lambda: notifier._build_message(
+            'Benchmark', '<p>' + 'x' * 2000 + '</p>', 'x' * 2000).as_string(), number=200)
+
+    #percorso completo di un messaggio MQTT (senza Firestore: nessuna credenziale nel workspace)
+    def bench_ingest(self, df):
+        if not self.selected('on_mqtt_message'):
+            return
+        import main
+
+        class Message:
+            def __init__(self, payload):
+                self.payload = payload
+
+        with quiet():
+            server = main.MiningServer(role='all', start_mqtt=False)
+            server.init_thread.join()
+            if server.predictor is not None and server.predictor._importance_thread is not None:
+                server.predictor._importance_thread.join()
+        records = df.drop(columns=['date']).to_dict('records')
+        messages = itertools.cycle([Message(json.dumps({
+            'timestamp': ts, 'row_index': i, 'data': data, 'trace': {'published_at': time.time()}
+        }).encode()) for i, (ts, data) in enumerate(zip(df['date'], records[:self.messages]))])
+        result = self.run('on_mqtt_message', lambda: server.on_mqtt_message(None, None, next(messages)),
+                          number=max(self.messages // self.repeat, 1), warmup=50)
+        result['messages_per_second'] = round(1 / result['median_seconds'], 1)
+
+
+def _format_seconds(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.2f} s"
+
+
+#confronto delle mediane con il baseline; regressione se più lento oltre la tolleranza
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    comparison = {}
+    for name, result in sorted(current['results'].items()):
+        base = baseline['results'].get(name)
+        if base is None:
+            comparison[name] = {'status': 'new'}
+            continue
+        ratio = result['median_seconds'] / base['median_seconds'] if base['median_seconds'] else float('inf')
+        if ratio > 1 + tolerance:
+            status = 'regression'
+        elif ratio < 1 / (1 + tolerance):
+            status = 'improvement'
+        else:
+            status = 'unchanged'
+        comparison[name] = {'status': status, 'ratio': round(ratio, 3),
+                            'baseline_seconds': base['median_seconds'], 'current_seconds': result['median_seconds']}
+    for name in baseline['results']:
+        if name not in current['results']:
+            comparison[name] = {'status': 'missing'}
+    return comparison
+
+
+def print_comparison(comparison):
+    for name, entry in comparison.items():
+        if 'ratio' in entry:
+            print(f"{name:<40} {_format_seconds(entry['baseline_seconds']):>10} -> "
+                  f"{_format_seconds(entry['current_seconds']):>10}  x{entry['ratio']:<6} {entry['status'].upper()}")
+        else:
+            print(f"{name:<40} {entry['status'].upper()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dei percorsi critici di Mining Monitor')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='Righe dei dataset sintetici')
+    parser.add_argument('--repeat', type=int, default=3, help='Misure per benchmark (si riporta la mediana)')
+    parser.add_argument('--train-rows', type=int, default=2000, help='Righe del CSV di training')
+    parser.add_argument('--messages', type=int, default=2000, help='Messaggi MQTT per la misura di ingest')
+    parser.add_argument('--only', nargs='+', help='Solo i benchmark con questi prefissi (es. chart_ predict_silica)')
+    parser.add_argument('--output', default='benchmark_results.json', help='File JSON dei risultati')
+    parser.add_argument('--input', help='Non esegue i benchmark: confronta questo file di risultati')
+    parser.add_argument('--baseline', help='Risultati di riferimento da confrontare')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Rallentamento tollerato (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input) as f:
+            current = json.load(f)
+    else:
+        runner = BenchmarkRunner(args.sizes, args.repeat, args.train_rows, args.messages, args.only)
+        current = {
+            'created_at': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'parameters': {'sizes': args.sizes, 'repeat': args.repeat, 'train_rows': args.train_rows,
+                           'messages': args.messages},
+            'results': runner.run_all()
+        }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        current['comparison'] = compare(current, baseline, args.tolerance)
+        print_comparison(current['comparison'])
+        regressions = [name for name, entry in current['comparison'].items() if entry['status'] == 'regression']
+
+    if not args.input:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"Risultati salvati in {args.output}", file=sys.stderr)
+    if regressions:
+        print(f"{len(regressions)} regressioni oltre il {args.tolerance:.0%}: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+#colonne del CSV di flotazione (date + 22 misure), con media, deviazione e limiti del dataset reale
+COLUMNS = {
+    '% Iron Feed': (56.3, 5.2, 42.7, 65.8),
+    '% Silica Feed': (14.6, 6.8, 1.3, 33.4),
+    'Starch Flow': (2870, 1215, 0.0, 6300),
+    'Amina Flow': (488, 91, 241, 739),
+    'Ore Pulp Flow': (397.6, 9.7, 376, 418),
+    'Ore Pulp pH': (9.77, 0.39, 8.75, 10.8),
+    'Ore Pulp Density': (1.68, 0.069, 1.52, 1.85),
+    'Flotation Column 01 Air Flow': (280, 29.6, 175, 373),
+    'Flotation Column 02 Air Flow': (277, 30.1, 175, 375),
+    'Flotation Column 03 Air Flow': (281, 28.6, 176, 364),
+    'Flotation Column 04 Air Flow': (299.4, 2.6, 292, 305),
+    'Flotation Column 05 Air Flow': (299.9, 3.6, 286, 310),
+    'Flotation Column 06 Air Flow': (292, 30.2, 189, 371),
+    'Flotation Column 07 Air Flow': (290.8, 28.7, 185, 372),
+    'Flotation Column 01 Level': (520, 131, 149, 862),
+    'Flotation Column 02 Level': (522, 128, 210, 828),
+    'Flotation Column 03 Level': (531, 150, 126, 886),
+    'Flotation Column 04 Level': (420, 91, 162, 680),
+    'Flotation Column 05 Level': (425, 84, 166, 675),
+    'Flotation Column 06 Level': (429, 89, 155, 698),
+    'Flotation Column 07 Level': (420, 84, 175, 659),
+    '% Iron Concentrate': (65.05, 1.12, 62.05, 68.01),
+    '% Silica Concentrate': (2.33, 1.13, 0.6, 5.53)
+}
+#le analisi di laboratorio dell'alimentazione sono orarie: valore costante per 180 righe da 20 s
+HOURLY_COLUMNS = ('% Iron Feed', '% Silica Feed')
+SAMPLE_SECONDS = 20
+
+
+#rumore gaussiano correlato nel tempo (media mobile di rumore bianco), varianza unitaria
+def _smooth_noise(rng, n_rows, window):
+    noise = rng.standard_normal(n_rows + window - 1)
+    kernel = np.ones(window) / np.sqrt(window)
+    return np.convolve(noise, kernel, mode='valid')
+
+
+#DataFrame con lo schema del CSV: sensori a variazione lenta, alimentazione oraria e silica del
+#concentrato legata linearmente a alimentazione, reagenti e pH (così i modelli hanno qualcosa da imparare)
+def generate(n_rows, seed=42, start='2017-03-10 01:00:00'):
+    rng = np.random.default_rng(seed)
+    z = {}
+    for column in COLUMNS:
+        if column in HOURLY_COLUMNS:
+            hours = _smooth_noise(rng, n_rows // 180 + 1, 3)
+            z[column] = np.repeat(hours, 180)[:n_rows]
+        else:
+            z[column] = _smooth_noise(rng, n_rows, 30)
+    z['% Silica Concentrate'] = (0.5 * z['% Silica Feed'] - 0.4 * z['Amina Flow'] + 0.3 * z['Ore Pulp pH']
+                                 - 0.2 * z['Starch Flow'] + 0.5 * z['% Silica Concentrate'])
+    z['% Iron Concentrate'] = -0.8 * z['% Silica Concentrate'] + 0.4 * z['% Iron Concentrate']
+
+    data = {'date': pd.date_range(start, periods=n_rows, freq=f'{SAMPLE_SECONDS}s').strftime('%Y-%m-%d %H:%M:%S')}
+    for column, (mean, std, low, high) in COLUMNS.items():
+        data[column] = np.clip(mean + std * z[column], low, high)
+    return pd.DataFrame(data)
+
+
+def write_csv(path, n_rows, seed=42):
+    df = generate(n_rows, seed)
+    df.to_csv(path, index=False)
+    return df
+
+
+#documenti come li salva MiningServer.save_to_firestore
+def to_documents(df):
+    sensor_columns = [c for c in df.columns if c != 'date']
+    records = df[sensor_columns].to_dict('records')
+    return [{'timestamp': ts, 'row_index': i, 'sensor_data': sensor}
+            for i, (ts, sensor) in enumerate(zip(df['date'], records))]
+
+
+class _Document:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    #come Firestore, ogni lettura restituisce una copia nuova
+    def to_dict(self):
+        return dict(self._data, sensor_data=dict(self._data['sensor_data']))
+
+
+class _Query:
+    def __init__(self, documents, field=None, count=None):
+        self.documents = documents
+        self.field = field
+        self.count = count
+
+    def order_by(self, field):
+        return _Query(self.documents, field, self.count)
+
+    def limit(self, count):
+        return _Query(self.documents, self.field, count)
+
+    def get(self):
+        documents = self.documents
+        if self.field:
+            documents = sorted(documents, key=lambda d: d._data[self.field])
+        return documents[:self.count] if self.count is not None else list(documents)
+
+
+#collezione Firestore in memoria con la sola interfaccia di query usata da grafici_mining
+class SyntheticFirestore:
+    def __init__(self, df, collection_name='mining_data'):
+        self.collections = {collection_name: [_Document(f'doc{i:07d}', d) for i, d in enumerate(to_documents(df))]}
+
+    def collection(self, name):
+        return _Query(self.collections.get(name, []))
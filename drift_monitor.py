@@ -0,0 +1,101 @@
+import threading
+import numpy as np
+
+#intervalli per feature: bordi ai quantili del training, così ogni bin ha circa lo stesso peso
+DEFAULT_BINS = 10
+#finestre mobili in campioni da 20 secondi: 1 ora e 6 ore
+DEFAULT_WINDOWS = [180, 1080]
+#soglie PSI usuali: < 0.1 stabile, 0.1-0.25 deriva moderata, > 0.25 deriva significativa
+PSI_MODERATE = 0.1
+PSI_SIGNIFICANT = 0.25
+#evita log(0) per bin vuoti
+_EPSILON = 1e-4
+
+
+#riassunto compatto del training per ogni feature: bordi dei bin e proporzioni di riferimento
+def build_reference_sketches(df, columns, n_bins=DEFAULT_BINS):
+    values = df[list(columns)].to_numpy(dtype=np.float64)
+    edges = np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1], axis=0).T
+    bins = _bin_indices(values, edges)
+    proportions = np.stack([np.bincount(bins[:, i], minlength=n_bins) for i in range(len(columns))]) / len(values)
+    return {"drift_edges": np.ascontiguousarray(edges), "drift_reference": proportions}
+
+
+#indice del bin di ogni valore, per tutte le feature insieme
+def _bin_indices(values, edges):
+    return (values[..., None] > edges).sum(axis=-1)
+
+
+#population stability index e distanza di Kolmogorov-Smirnov sui bin
+def psi_ks(reference, current):
+    p = np.clip(current, _EPSILON, None)
+    q = np.clip(reference, _EPSILON, None)
+    psi = ((p - q) * np.log(p / q)).sum(axis=-1)
+    ks = np.abs(np.cumsum(current, axis=-1) - np.cumsum(reference, axis=-1)).max(axis=-1)
+    return psi, ks
+
+
+#confronta le finestre mobili dei dati in ingest con il training; ogni campione
+#costa O(feature x bin) e aggiorna i conteggi incrementando il nuovo bin e togliendo il più vecchio
+class DriftMonitor:
+    def __init__(self, columns, edges, reference, windows=None, min_samples=60):
+        self.columns = list(columns)
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.reference = np.asarray(reference, dtype=np.float64)
+        self.n_bins = self.reference.shape[1]
+        self.windows = sorted(windows or DEFAULT_WINDOWS)
+        self.min_samples = min_samples
+        self.size = self.windows[-1]
+        #storico dei bin in un buffer circolare; -1 = feature assente nel campione
+        self.history = np.full((self.size, len(self.columns)), -1, dtype=np.int16)
+        self.counts = {w: np.zeros((len(self.columns), self.n_bins), dtype=np.int64) for w in self.windows}
+        self.pos = 0
+        self.samples_seen = 0
+        self._lock = threading.Lock()
+        self._rows = np.arange(len(self.columns))
+
+    def update(self, sample: dict):
+        values = np.array([sample.get(col, np.nan) for col in self.columns], dtype=np.float64)
+        present = ~np.isnan(values)
+        bins = np.where(present, _bin_indices(np.nan_to_num(values), self.edges), -1).astype(np.int16)
+        with self._lock:
+            for w, counts in self.counts.items():
+                if self.samples_seen >= w:
+                    old = self.history[(self.pos - w) % self.size]
+                    valid = old >= 0
+                    counts[self._rows[valid], old[valid]] -= 1
+                counts[self._rows[present], bins[present]] += 1
+            self.history[self.pos] = bins
+            self.pos = (self.pos + 1) % self.size
+            self.samples_seen += 1
+
+    #punteggi per finestra; le feature con pochi campioni non vengono valutate
+    def scores(self):
+        with self._lock:
+            snapshot = {w: counts.copy() for w, counts in self.counts.items()}
+        report = {}
+        for w, counts in snapshot.items():
+            totals = counts.sum(axis=1)
+            ready = totals >= min(self.min_samples, w)
+            current = counts / np.maximum(totals, 1)[:, None]
+            psi, ks = psi_ks(self.reference, current)
+            features = {}
+            for i, col in enumerate(self.columns):
+                if not ready[i]:
+                    continue
+                features[col] = {
+                    "psi": float(psi[i]),
+                    "ks": float(ks[i]),
+                    "status": _status(psi[i]),
+                    "samples": int(totals[i])
+                }
+            report[w] = features
+        return report
+
+
+def _status(psi):
+    if psi >= PSI_SIGNIFICANT:
+        return "significant"
+    if psi >= PSI_MODERATE:
+        return "moderate"
+    return "stable"
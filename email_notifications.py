@@ -1,15 +1,23 @@
 import smtplib
 import ssl
+import time
+import queue
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
 import logging
 import os
+from metrics import REGISTRY
+
+SMTP_SEND_SECONDS = REGISTRY.histogram('mining_smtp_send_seconds', 'Durata dei tentativi di invio SMTP', ['status'])
+EMAIL_RECIPIENTS = REGISTRY.counter('mining_email_recipients_total', 'Destinatari per esito dell\'invio', ['status'])
 
 #cerea la classe per le email che verrà usato nel main.py
 class EmailNotifier:
     #inizializza le credenziali dell'account con cui inviamo le mail
-    def __init__(self, smtp_server="smtp.gmail.com", smtp_port=587): 
+    def __init__(self, smtp_server="smtp.gmail.com", smtp_port=587, max_queue_size=1000, max_retries=3,
+                 retry_backoff_seconds=2, idle_timeout_seconds=60): 
         self.smtp_server = smtp_server
         self.smtp_port = smtp_port
         
@@ -19,36 +27,181 @@ class EmailNotifier:
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
         
-        #contatori per statistiche
+        #contatori per statistiche (per destinatario, aggiornati solo dal worker a invio concluso)
         self.sent_count = 0
         self.failed_count = 0
+        self.retry_count = 0
+        self.dropped_count = 0
+        self._counter_lock = threading.Lock()
+        
+        #coda di invio: i chiamanti accodano e ritornano subito, un unico worker spedisce
+        self.max_retries = max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._server = None
+        #storico persistente degli invii (NotificationHistory), impostato dal server
+        self.history = None
+        self._worker = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._worker.start()
+        REGISTRY.gauge('mining_email_queue_depth', 'Email in coda di invio', function=self._queue.qsize)
     
-    #funzione per l'invio delle mail
+    #funzione per l'invio delle mail a un singolo destinatario
     def send_email(self, recipient_email, subject, message, is_html=False):
-        msg = MIMEMultipart()
+        if is_html:
+            return self.send_message(recipient_email, subject, html_message=message) > 0
+        return self.send_message(recipient_email, subject, text_message=message) > 0
+    
+    #accoda un unico messaggio multipart/alternative (testo + HTML) per tutti i destinatari,
+    #spedito in una sola transazione SMTP con i destinatari in copia nascosta.
+    #restituisce il numero di destinatari accodati; l'invio avviene nel worker
+    def send_message(self, recipients, subject, html_message=None, text_message=None, kind="email"):
+        recipients = self._normalize_recipients(recipients)
+        if not recipients:
+            return 0
+        job = {
+            "kind": kind,
+            "recipients": recipients,
+            "subject": subject,
+            "html_message": html_message,
+            "text_message": text_message
+        }
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._counter_lock:
+                self.dropped_count += len(recipients)
+                self.failed_count += len(recipients)
+            EMAIL_RECIPIENTS.inc(len(recipients), status='dropped')
+            self.logger.error(f"Coda email piena, messaggio '{subject}' scartato")
+            self._record_history(job, "dropped", 0, len(recipients))
+            return 0
+        return len(recipients)
+    
+    #accetta lista o stringa separata da virgole, senza duplicati
+    @staticmethod
+    def _normalize_recipients(recipients):
+        if isinstance(recipients, str):
+            recipients = recipients.split(',')
+        unique = []
+        for recipient in recipients or []:
+            recipient = (recipient or '').strip()
+            if recipient and recipient not in unique:
+                unique.append(recipient)
+        return unique
+    
+    #attende lo svuotamento della coda (es. prima dello spegnimento)
+    def flush(self, timeout=30):
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+        return self._queue.unfinished_tasks == 0
+    
+    #i destinatari non compaiono nelle intestazioni (BCC): sono solo nella busta SMTP
+    def _build_message(self, subject, html_message, text_message):
+        msg = MIMEMultipart("alternative")
         msg["Subject"] = subject
         msg["From"] = self.sender_email
-        msg["To"] = recipient_email
-
-        if is_html:
-            part = MIMEText(message, "html")
-        else:
-            part = MIMEText(message, "plain")
-            
-        msg.attach(part)
-            
-        server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-        server.starttls()  #avvia connessione sicura
+        msg["To"] = self.sender_email
+        #l'ultima parte è la preferita dai client: prima il testo, poi l'HTML
+        if text_message:
+            msg.attach(MIMEText(text_message, "plain", "utf-8"))
+        if html_message:
+            msg.attach(MIMEText(html_message, "html", "utf-8"))
+        return msg
+    
+    #sessione SMTP persistente, riaperta solo se assente o caduta
+    def _connection(self):
+        if self._server is not None:
+            try:
+                if self._server.noop()[0] == 250:
+                    return self._server
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._close()
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=30)
+        server.starttls(context=ssl.create_default_context())  #avvia connessione sicura
         server.login(self.sender_email, self.sender_password)  #login
-        server.sendmail(self.sender_email, [recipient_email], msg.as_string())  #invio
-        server.quit()
-            
-        self.sent_count += 1
-        self.logger.info(f"Email inviata con successo a {recipient_email}")
-        return True
+        self._server = server
+        return server
+    
+    def _close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+    
+    #tentativi limitati con attesa esponenziale; i destinatari rifiutati non vengono ritentati
+    def _deliver(self, job):
+        recipients = job["recipients"]
+        msg = self._build_message(job["subject"], job["html_message"], job["text_message"]).as_string()
+        
+        last_error = None
+        for attempt in range(self.max_retries):
+            if attempt:
+                with self._counter_lock:
+                    self.retry_count += 1
+                time.sleep(self.retry_backoff_seconds * 2 ** (attempt - 1))
+            started = time.perf_counter()
+            try:
+                refused = self._connection().sendmail(self.sender_email, recipients, msg)  #invio
+                SMTP_SEND_SECONDS.observe(time.perf_counter() - started, status='ok')
+                return len(recipients) - len(refused), len(refused)
+            except smtplib.SMTPRecipientsRefused as e:
+                SMTP_SEND_SECONDS.observe(time.perf_counter() - started, status='refused')
+                return 0, len(e.recipients)
+            except smtplib.SMTPAuthenticationError as e:
+                SMTP_SEND_SECONDS.observe(time.perf_counter() - started, status='error')
+                self._close()
+                last_error = e
+                break
+            except (smtplib.SMTPException, OSError) as e:
+                SMTP_SEND_SECONDS.observe(time.perf_counter() - started, status='error')
+                self._close()
+                last_error = e
+        self.logger.error(f"Invio email a {', '.join(recipients)} fallito: {last_error}")
+        return 0, len(recipients)
+    
+    def _dispatch_loop(self):
+        while True:
+            try:
+                job = self._queue.get(timeout=self.idle_timeout_seconds)
+            except queue.Empty:
+                #sessione inattiva: si chiude per non farla scadere lato server
+                self._close()
+                continue
+            try:
+                sent, failed = self._deliver(job)
+                with self._counter_lock:
+                    self.sent_count += sent
+                    self.failed_count += failed
+                EMAIL_RECIPIENTS.inc(sent, status='sent')
+                EMAIL_RECIPIENTS.inc(failed, status='failed')
+                if sent:
+                    self.logger.info(f"Email inviata con successo a {sent} destinatari: {job['subject']}")
+                self._record_history(job, "sent" if not failed else ("partial" if sent else "failed"), sent, failed)
+            except Exception as e:
+                with self._counter_lock:
+                    self.failed_count += len(job["recipients"])
+                EMAIL_RECIPIENTS.inc(len(job["recipients"]), status='failed')
+                self.logger.error(f"Errore inatteso nell'invio email: {e}")
+                self._record_history(job, "failed", 0, len(job["recipients"]), str(e))
+            finally:
+                self._queue.task_done()
 
-    def send_alert_email(self, recipients, prediction_value, threshold, sensor_data):
+    def send_alert_email(self, recipients, prediction_value, threshold, sensor_data, exceedance_probability=None):
         subject = f"🚨 ALLERTA MINING: Silica {prediction_value:.2f}% > {threshold}%"
+        #probabilità di superamento stimata dal modello (quota di alberi sopra soglia)
+        probability_html = ""
+        probability_text = ""
+        if exceedance_probability is not None:
+            probability_html = f"<p>Probabilità di superamento soglia: {exceedance_probability:.0%}</p>"
+            probability_text = f"Probabilità di superamento soglia: {exceedance_probability:.0%}"
         
         html_message = f"""
         <!DOCTYPE html>
@@ -68,6 +221,7 @@ class EmailNotifier:
                 <p><strong>Timestamp:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
                 <p class="critical">Predizione % Silica Concentrate: {prediction_value:.3f}%</p>
                 <p>Soglia configurata: {threshold}%</p>
+                {probability_html}
                 <p><strong>Azione richiesta:</strong> Verificare immediatamente il processo di flotazione</p>
                 
                 <h3>Dati Sensori Attuali:</h3>
@@ -91,6 +245,7 @@ class EmailNotifier:
         Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
         Predizione % Silica Concentrate: {prediction_value:.3f}%
         Soglia configurata: {threshold}%
+        {probability_text}
         
         AZIONE RICHIESTA: Verificare immediatamente il processo!
         
@@ -101,23 +256,88 @@ class EmailNotifier:
         - Starch Flow: {sensor_data.get('Starch Flow', 'N/A')}
         """
         
-        success_count = 0
-        if isinstance(recipients, str):
-            recipients = [recipients]
+        #un solo messaggio per tutti i destinatari
+        queued = self.send_message(recipients, subject, html_message, text_message, kind="alert")
+        self.logger.info(f"Email di allerta accodate: {queued} destinatari")
+        return queued
+
+    #riepilogo delle allerte di una finestra (modalità hourly/daily)
+    def send_alert_digest(self, recipients, summary):
+        period = self._digest_period(summary)
+        subject = f"📋 RIEPILOGO ALLERTE MINING: {summary['exceedances']} superamenti ({period})"
+        peak = f"{summary['peak_value']:.3f}%" if summary.get('peak_value') is not None else "N/A"
         
-        for recipient in recipients:
-            if self.send_email(recipient, subject, html_message, is_html=True):
-                success_count += 1
-            elif self.send_email(recipient, subject, text_message, is_html=False):
-                success_count += 1
+        html_message = f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; }}
+                .alert {{ background-color: #fff3cd; border: 1px solid #ffeaa7; 
+                          padding: 20px; border-radius: 5px; border-left: 4px solid #ffc107; }}
+                .header {{ color: #856404; font-size: 24px; font-weight: bold; }}
+            </style>
+        </head>
+        <body>
+            <div class="alert">
+                <div class="header">📋 RIEPILOGO ALLERTE PROCESSO MINERARIO</div>
+                <p><strong>Periodo:</strong> {summary['window_start'][:19]} - {summary['window_end'][:19]}</p>
+                <ul>
+                    <li>Superamenti soglia: <strong>{summary['exceedances']}</strong></li>
+                    <li>Episodi di allerta: {summary['episodes']}</li>
+                    <li>Picco predizione % Silica: {peak} ({(summary.get('peak_time') or 'N/A')[:19]})</li>
+                    <li>Soglia configurata: {summary.get('threshold')}%</li>
+                </ul>
+                <p><strong>Sistema di Monitoraggio Mining</strong></p>
+            </div>
+        </body>
+        </html>
+        """
+        
+        text_message = f"""
+        RIEPILOGO ALLERTE PROCESSO MINERARIO
+        ====================================
+        
+        Periodo: {summary['window_start'][:19]} - {summary['window_end'][:19]}
+        - Superamenti soglia: {summary['exceedances']}
+        - Episodi di allerta: {summary['episodes']}
+        - Picco predizione % Silica: {peak} ({(summary.get('peak_time') or 'N/A')[:19]})
+        - Soglia configurata: {summary.get('threshold')}%
+        """
         
-        self.logger.info(f"Email di allerta inviate: {success_count}/{len(recipients)}")
-        return success_count
+        #un solo messaggio per tutti i destinatari
+        queued = self.send_message(recipients, subject, html_message, text_message, kind="digest")
+        self.logger.info(f"Riepilogo allerte accodato: {queued} destinatari")
+        return queued
+
+    #etichetta del periodo dalla finestra effettiva (es. il digest orario di overflow in modalità immediate)
+    @staticmethod
+    def _digest_period(summary):
+        try:
+            hours = (datetime.fromisoformat(summary['window_end']) -
+                     datetime.fromisoformat(summary['window_start'])).total_seconds() / 3600
+        except (KeyError, TypeError, ValueError):
+            return "ultima ora" if summary.get('frequency') == 'hourly' else "ultime 24 ore"
+        if hours < 0.99:
+            return f"ultimi {max(round(hours * 60), 1)} minuti"
+        if hours < 1.5:
+            return "ultima ora"
+        return f"ultime {round(hours)} ore"
+
+    def _record_history(self, job, status, sent, failed, error=None):
+        if self.history is None:
+            return
+        details = {"kind": job["kind"], "sent": sent, "failed": failed}
+        if error:
+            details["error"] = error
+        self.history.record("email", status, job["subject"], job["recipients"], details)
 
     #invio dell'alert via mail
     def send_prediction_alert(self, recipients, prediction_period, alerts_count, threshold, 
-                             max_prediction=None, avg_prediction=None, prediction_horizon=None):
+                             max_prediction=None, avg_prediction=None, prediction_horizon=None, requested_by=None):
         subject = f"🔮 ALLERTA PREDIZIONI: {alerts_count} allerte nel {prediction_period}"
+        requested_html = f"Utente: <strong>{requested_by}</strong> | " if requested_by else ""
+        requested_text = f"Utente: {requested_by}" if requested_by else ""
         
         html_message = f"""
         <!DOCTYPE html>
@@ -164,7 +384,7 @@ class EmailNotifier:
                 
                 <div class="footer">
                     <p>Notifica generata automaticamente dal Sistema di Monitoraggio Mining<br>
-                    Sistema: <strong>Predizioni ML</strong></p>
+                    {requested_html}Sistema: <strong>Predizioni ML</strong></p>
                 </div>
             </div>
         </body>
@@ -199,21 +419,13 @@ class EmailNotifier:
         e verificare i parametri di flotazione se necessario.
         
         Sistema di Monitoraggio Mining - Predizioni ML
+        {requested_text}
         """
         
-        success_count = 0
-        if isinstance(recipients, str):
-            recipients = [r.strip() for r in recipients.split(',') if r.strip()]
-        
-        for recipient in recipients:
-            if recipient:
-                if self.send_email(recipient, subject, html_message, is_html=True):
-                    success_count += 1
-                elif self.send_email(recipient, subject, text_message, is_html=False):
-                    success_count += 1
-        
-        self.logger.info(f"Email predizioni inviate: {success_count}/{len(recipients)}")
-        return success_count
+        #un solo messaggio per tutti i destinatari
+        queued = self.send_message(recipients, subject, html_message, text_message, kind="prediction_alert")
+        self.logger.info(f"Email predizioni accodate: {queued} destinatari")
+        return queued
 
     #invia mail di test
     def send_test_email(self, recipients, user_name="Sistema"):
@@ -274,24 +486,18 @@ class EmailNotifier:
         Sistema di Monitoraggio Mining - Test Automatico
         """
         
-        success_count = 0
-        if isinstance(recipients, str):
-            recipients = [r.strip() for r in recipients.split(',') if r.strip()]
-        
-        for recipient in recipients:
-            if recipient:
-                if self.send_email(recipient, subject, html_message, is_html=True):
-                    success_count += 1
-                elif self.send_email(recipient, subject, text_message, is_html=False):
-                    success_count += 1
-        
-        self.logger.info(f"Email di test inviate: {success_count}/{len(recipients)}")
-        return success_count
+        #un solo messaggio per tutti i destinatari
+        queued = self.send_message(recipients, subject, html_message, text_message, kind="test")
+        self.logger.info(f"Email di test accodate: {queued} destinatari")
+        return queued
 
     #restituisce statistiche di invii delle mail
     def get_statistics(self):
         return {
             'sent_count': self.sent_count,
             'failed_count': self.failed_count,
+            'retry_count': self.retry_count,
+            'dropped_count': self.dropped_count,
+            'queue_depth': self._queue.qsize(),
             'success_rate': (self.sent_count / (self.sent_count + self.failed_count) * 100) if (self.sent_count + self.failed_count) > 0 else 0
         }
\ No newline at end of file
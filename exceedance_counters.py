@@ -0,0 +1,178 @@
+import os
+import json
+import math
+import threading
+from collections import deque
+
+#livelli di aggregazione: (nome, durata del bucket in secondi, bucket conservati)
+LEVELS = [
+    ('minute', 60, 24 * 60),
+    ('hour', 3600, 35 * 24),
+    ('day', 86400, 400)
+]
+
+
+#contatori di campioni e superamenti soglia per minuto, ora e giorno, aggiornati in ingest.
+#un conteggio su una finestra qualsiasi usa i bucket più grandi interamente contenuti
+#e quelli più fini solo ai bordi, senza rileggere i dati grezzi
+class ExceedanceCounters:
+    def __init__(self, snapshot_path=None):
+        self.snapshot_path = snapshot_path
+        self._levels = {name: {} for name, _, _ in LEVELS}
+        self._keys = {name: deque() for name, _, _ in LEVELS}
+        self._recent = deque(maxlen=100)
+        self.total_samples = 0
+        self.total_exceedances = 0
+        self.value_sum = 0.0
+        self._lock = threading.Lock()
+        self._last_minute = None
+        if snapshot_path and os.path.exists(snapshot_path):
+            self._restore()
+
+    def add(self, ts, value, threshold):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return
+        value = float(value)
+        exceeded = value > threshold
+        with self._lock:
+            for name, size, retention in LEVELS:
+                key = int(ts // size) * size
+                bucket = self._levels[name].get(key)
+                if bucket is None:
+                    bucket = self._levels[name][key] = [0, 0, 0.0]
+                    self._keys[name].append(key)
+                    #i bucket arrivano in ordine temporale: si scartano in testa i più vecchi
+                    while self._keys[name] and self._keys[name][0] <= key - size * retention:
+                        del self._levels[name][self._keys[name].popleft()]
+                bucket[0] += 1
+                bucket[1] += int(exceeded)
+                bucket[2] += value
+            self._recent.append(exceeded)
+            self.total_samples += 1
+            self.total_exceedances += int(exceeded)
+            self.value_sum += value
+            minute = int(ts // 60)
+            new_minute = self._last_minute is not None and minute != self._last_minute
+            self._last_minute = minute
+        #una fotografia al minuto basta per ripartire dopo un riavvio
+        if new_minute and self.snapshot_path:
+            self.save()
+
+    #(campioni, superamenti, somma valori) nella finestra [since, until), in O(bucket).
+    #risoluzione al minuto nelle ultime 24 ore, all'ora fino a 35 giorni, poi al giorno:
+    #un bordo più vecchio della conservazione dei minuti viene allargato all'ora intera che lo
+    #contiene (e oltre i 35 giorni al giorno), quindi il conteggio può includere campioni appena
+    #fuori dalla finestra richiesta; window() riporta gli estremi effettivi
+    def count(self, since, until):
+        with self._lock:
+            return self._count(*self._align(since, until)[:2])
+
+    #estremi allineati ai bucket disponibili e risoluzione dei bordi
+    def _align(self, since, until):
+        since = int(since // 60) * 60
+        until = int(math.ceil(until / 60)) * 60
+        resolution = LEVELS[0][0]
+        for (name, size, retention), (next_name, next_size, _) in zip(LEVELS, LEVELS[1:]):
+            if not self._keys[name]:
+                break
+            horizon = self._keys[name][-1] - size * (retention - 1)
+            if since >= horizon and until >= horizon:
+                break
+            if since < horizon:
+                since = since // next_size * next_size
+            if until < horizon:
+                until = -(-until // next_size) * next_size
+            resolution = next_name
+        return since, until, resolution
+
+    def _count(self, since, until):
+        sizes = [(name, size) for name, size, _ in reversed(LEVELS)]
+        t = since
+        samples = exceedances = 0
+        value_sum = 0.0
+        while t < until:
+            for name, size in sizes:
+                if t % size == 0 and t + size <= until:
+                    bucket = self._levels[name].get(t)
+                    if bucket:
+                        samples += bucket[0]
+                        exceedances += bucket[1]
+                        value_sum += bucket[2]
+                    t += size
+                    break
+        return samples, exceedances, value_sum
+
+    def window(self, since, until):
+        with self._lock:
+            effective_since, effective_until, resolution = self._align(since, until)
+            samples, exceedances, value_sum = self._count(effective_since, effective_until)
+        return {
+            'samples': samples,
+            'exceedances': exceedances,
+            'exceedance_percentage': round(exceedances / samples * 100, 1) if samples else 0,
+            'avg_value': round(value_sum / samples, 3) if samples else None,
+            'resolution': resolution,
+            'effective_since': effective_since,
+            'effective_until': effective_until
+        }
+
+    #superamenti negli ultimi 100 campioni
+    def recent_exceedances(self):
+        with self._lock:
+            return sum(self._recent), len(self._recent)
+
+    def reset(self):
+        with self._lock:
+            for name in self._levels:
+                self._levels[name].clear()
+                self._keys[name].clear()
+            self._recent.clear()
+            self.total_samples = self.total_exceedances = 0
+            self.value_sum = 0.0
+        if self.snapshot_path:
+            self.save()
+
+    #stato serializzabile, usato per la fotografia su disco e per lo stato condiviso tra processi
+    def get_state(self):
+        with self._lock:
+            return {
+                'levels': {name: list(bucket.items()) for name, bucket in self._levels.items()},
+                'recent': list(self._recent),
+                'totals': [self.total_samples, self.total_exceedances, self.value_sum]
+            }
+
+    @classmethod
+    def from_state(cls, state):
+        counters = cls()
+        counters.load_state(state)
+        return counters
+
+    def save(self):
+        state = self.get_state()
+        tmp_path = self.snapshot_path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"Errore salvataggio contatori allerte: {e}")
+
+    def _restore(self):
+        try:
+            with open(self.snapshot_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Contatori allerte non ripristinati: {e}")
+            return
+        self.load_state(state)
+
+    def load_state(self, state):
+        for name, items in state.get('levels', {}).items():
+            if name not in self._levels:
+                continue
+            for key, bucket in sorted(items, key=lambda item: int(item[0])):
+                self._levels[name][int(key)] = bucket
+                self._keys[name].append(int(key))
+        self._recent.extend(state.get('recent', []))
+        self.total_samples, self.total_exceedances, self.value_sum = state.get('totals', [0, 0, 0.0])
@@ -0,0 +1,168 @@
+import math
+import numpy as np
+import pandas as pd
+
+#definizione unica delle feature ritardate, usata sia in ingest (streaming) sia nel training (batch).
+#finestre e ritardi sono in campioni da 20 secondi: 15 = 5 minuti, 45 = 15 minuti, 180 = 1 ora
+DEFAULT_FEATURE_CONFIG = {
+    'columns': [
+        'Starch Flow', 'Amina Flow',
+        'Flotation Column 01 Air Flow', 'Flotation Column 02 Air Flow',
+        'Flotation Column 03 Air Flow', 'Flotation Column 04 Air Flow',
+        'Flotation Column 05 Air Flow', 'Flotation Column 06 Air Flow',
+        'Flotation Column 07 Air Flow'
+    ],
+    'windows': [15, 180],
+    'ewm_alphas': [0.05],
+    'lags': [45, 180]
+}
+
+
+#nomi delle feature calcolate, nello stesso ordine per streaming e batch
+def engineered_feature_names(config=None):
+    config = config or DEFAULT_FEATURE_CONFIG
+    names = []
+    for col in config['columns']:
+        for w in config['windows']:
+            names.append(f"{col} mean{w}")
+            names.append(f"{col} std{w}")
+        for alpha in config['ewm_alphas']:
+            names.append(f"{col} ewm{alpha}")
+        for lag in config['lags']:
+            names.append(f"{col} lag{lag}")
+    return names
+
+
+#versione batch per il training: stesse definizioni dello stato streaming
+def compute_feature_frame(df, config=None):
+    config = config or DEFAULT_FEATURE_CONFIG
+    features = {}
+    for col in config['columns']:
+        #i valori mancanti ripetono l'ultimo valore noto, come in ingest
+        series = df[col].astype(float).ffill()
+        valid = series.dropna()
+        first_value = valid.iloc[0] if len(valid) else np.nan
+        for w in config['windows']:
+            rolling = series.rolling(w, min_periods=1)
+            features[f"{col} mean{w}"] = rolling.mean()
+            features[f"{col} std{w}"] = rolling.std(ddof=0)
+        for alpha in config['ewm_alphas']:
+            features[f"{col} ewm{alpha}"] = series.ewm(alpha=alpha, adjust=False).mean()
+        #prima di avere abbastanza storico il ritardo usa il primo valore osservato
+        for lag in config['lags']:
+            features[f"{col} lag{lag}"] = series.shift(lag).fillna(first_value)
+    return pd.DataFrame(features, index=df.index)[engineered_feature_names(config)]
+
+
+#stato di una colonna: buffer circolare e somme mobili aggiornate in O(1)
+class _ColumnState:
+    def __init__(self, windows, alphas, lags):
+        self.windows = windows
+        self.alphas = alphas
+        self.lags = lags
+        self.size = max(max(windows), max(lags) + 1)
+        self.buffer = np.zeros(self.size)
+        self.pos = 0
+        self.count = 0
+        self.ref = 0.0  #valore di riferimento: le somme sono centrate per stabilità numerica
+        self.first = None
+        self.sums = {w: [0.0, 0.0] for w in windows}
+        self.ewm = {alpha: None for alpha in alphas}
+
+    def last(self):
+        return self.buffer[(self.pos - 1) % self.size] if self.count else None
+
+    #calcola le feature con il nuovo valore x; se commit=True aggiorna anche lo stato
+    def step(self, x, commit):
+        if x is None or (isinstance(x, float) and math.isnan(x)):
+            x = self.last()
+            if x is None:
+                return None
+        x = float(x)
+        first = self.first if self.count else x
+        ref = self.ref if self.count else x
+        centered = x - ref
+
+        features = []
+        new_sums = {}
+        for w in self.windows:
+            s, ss = self.sums[w] if self.count else (0.0, 0.0)
+            if self.count >= w:
+                old = self.buffer[(self.pos - w) % self.size] - ref
+                s -= old
+                ss -= old * old
+            s += centered
+            ss += centered * centered
+            new_sums[w] = [s, ss]
+            n = min(self.count + 1, w)
+            mean = s / n
+            features.append(ref + mean)
+            features.append(math.sqrt(max(ss / n - mean * mean, 0.0)))
+
+        new_ewm = {}
+        for alpha in self.alphas:
+            previous = self.ewm[alpha] if self.count else None
+            new_ewm[alpha] = x if previous is None else alpha * x + (1 - alpha) * previous
+            features.append(new_ewm[alpha])
+
+        lag_values = []
+        for lag in self.lags:
+            if lag == 0:
+                lag_values.append(x)
+            elif self.count + 1 <= lag:
+                lag_values.append(first)
+            else:
+                lag_values.append(self.buffer[(self.pos - lag) % self.size])
+        features.extend(lag_values)
+
+        if commit:
+            if not self.count:
+                self.first = x
+                self.ref = x
+            self.buffer[self.pos] = x
+            self.pos = (self.pos + 1) % self.size
+            self.count += 1
+            self.sums = new_sums
+            self.ewm = new_ewm
+            #ricalcolo periodico delle somme per non accumulare errori di arrotondamento (O(1) ammortizzato)
+            if self.count % self.size == 0:
+                self._resync()
+        return features
+
+    def _resync(self):
+        for w in self.windows:
+            n = min(self.count, w)
+            recent = self.buffer[(self.pos - 1 - np.arange(n)) % self.size] - self.ref
+            self.sums[w] = [float(recent.sum()), float((recent * recent).sum())]
+
+
+#feature ritardate mantenute in memoria durante l'ingest, senza rileggere lo storico
+class StreamingFeatureState:
+    def __init__(self, config=None):
+        self.config = config or DEFAULT_FEATURE_CONFIG
+        self.names = engineered_feature_names(self.config)
+        self.columns = {col: _ColumnState(self.config['windows'], self.config['ewm_alphas'], self.config['lags'])
+                        for col in self.config['columns']}
+        self.samples_seen = 0
+
+    def _compute(self, sample: dict, commit):
+        result = {}
+        names = iter(self.names)
+        per_column = len(self.names) // len(self.columns)
+        for col, state in self.columns.items():
+            values = state.step(sample.get(col), commit)
+            col_names = [next(names) for _ in range(per_column)]
+            if values is None:
+                continue
+            result.update(zip(col_names, values))
+        if commit:
+            self.samples_seen += 1
+        return result
+
+    #aggiunge il campione allo stato e restituisce le sue feature
+    def update(self, sample: dict):
+        return self._compute(sample, commit=True)
+
+    #feature che avrebbe il campione, senza modificare lo stato (per predizioni e what-if)
+    def preview(self, sample: dict):
+        return self._compute(sample, commit=False)
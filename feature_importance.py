@@ -0,0 +1,71 @@
+import time
+import multiprocessing
+import numpy as np
+from model_registry import ModelRegistry
+from flat_ensemble import FlatEnsemble
+
+#modello e dati di valutazione condivisi con i processi worker, caricati una volta all'avvio del pool
+_WORKER_DATA = {}
+
+
+#i worker leggono il modello dal registro: gli alberi sono array mappati e le pagine restano condivise
+def _init_worker(registry_root, version, X, y):
+    registry = ModelRegistry(registry_root)
+    manifest = registry.load_manifest(version)
+    if manifest.get("flat_model"):
+        arrays = registry.load_arrays(version)
+        model = FlatEnsemble({name: arrays[name] for name in FlatEnsemble.ARRAY_NAMES}, manifest["flat_model"])
+    else:
+        model = registry.load_artifact("model", version)
+    _WORKER_DATA.update(model=model, X=X, y=y)
+
+
+def _r2_rows(y, predictions):
+    sst = ((y - y.mean()) ** 2).sum()
+    sse = ((predictions - y) ** 2).sum(axis=-1)
+    return 1 - sse / sst if sst > 0 else np.zeros(len(predictions))
+
+
+#tutte le ripetizioni della permutazione di una colonna in un'unica predizione batch
+def _permute_feature(index, n_repeats, seed):
+    X, y, model = _WORKER_DATA["X"], _WORKER_DATA["y"], _WORKER_DATA["model"]
+    n = len(X)
+    rng = np.random.default_rng(seed)
+    X_perm = np.tile(X, (n_repeats, 1))
+    for r in range(n_repeats):
+        X_perm[r * n:(r + 1) * n, index] = X[rng.permutation(n), index]
+    scores = _r2_rows(y, np.asarray(model.predict(X_perm)).reshape(n_repeats, n))
+    return index, scores
+
+
+#importanza per permutazione: calo di R² quando si mescola una colonna, calcolato in parallelo per feature
+def permutation_importance(registry_root, version, X, y, feature_names, n_repeats=5,
+                           n_workers=None, random_state=42):
+    start = time.time()
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    _init_worker(registry_root, version, X, y)
+    baseline = float(_r2_rows(y, np.asarray(_WORKER_DATA["model"].predict(X)).reshape(1, -1))[0])
+    _WORKER_DATA.clear()
+
+    with multiprocessing.Pool(processes=n_workers or multiprocessing.cpu_count(), initializer=_init_worker,
+                              initargs=(registry_root, version, X, y)) as pool:
+        results = pool.starmap(_permute_feature, [(i, n_repeats, random_state + i) for i in range(len(feature_names))])
+
+    importances = []
+    for index, scores in results:
+        drop = baseline - scores
+        importances.append({
+            "feature": feature_names[index],
+            "importance_mean": float(drop.mean()),
+            "importance_std": float(drop.std())
+        })
+    importances.sort(key=lambda e: e["importance_mean"], reverse=True)
+    return {
+        "model_version": version,
+        "baseline_r2": baseline,
+        "n_samples": int(len(X)),
+        "n_repeats": n_repeats,
+        "importances": importances,
+        "elapsed_seconds": round(time.time() - start, 2)
+    }
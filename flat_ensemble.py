@@ -0,0 +1,109 @@
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+
+#tipi di ensemble: media degli alberi (foresta) o somma pesata (boosting)
+FOREST = "forest"
+BOOSTING = "boosting"
+
+
+#ensemble di alberi appiattito in array contigui: si salva in .npy, si mappa in sola
+#lettura e i processi worker condividono le stesse pagine di memoria
+class FlatEnsemble:
+    ARRAY_NAMES = ("scaler_mean", "scaler_scale", "roots", "children_left",
+                   "children_right", "feature", "threshold", "value")
+
+    def __init__(self, arrays: dict, meta: dict):
+        self.arrays = arrays
+        self.meta = meta
+        self.kind = meta["kind"]
+        self.n_outputs = meta["n_outputs"]
+        self.scaler_mean = arrays["scaler_mean"]
+        self.scaler_scale = arrays["scaler_scale"]
+        self.roots = arrays["roots"]
+        self.children_left = arrays["children_left"]
+        self.children_right = arrays["children_right"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.value = arrays["value"]
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    #converte una pipeline scaler + regressore ad alberi; None se il tipo non è supportato
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        if pipeline is None or not hasattr(pipeline, "named_steps"):
+            return None
+        scaler = pipeline.named_steps.get("scaler")
+        regressor = pipeline.named_steps.get("regressor")
+
+        if isinstance(regressor, RandomForestRegressor):
+            trees = [est.tree_ for est in regressor.estimators_]
+            meta = {"kind": FOREST}
+        elif isinstance(regressor, GradientBoostingRegressor):
+            if regressor.init_ == "zero":
+                init_value = 0.0
+            else:
+                init_value = float(np.ravel(regressor.init_.predict(np.zeros((1, regressor.n_features_in_))))[0])
+            trees = [est.tree_ for est in regressor.estimators_[:, 0]]
+            meta = {"kind": BOOSTING, "init_value": init_value, "learning_rate": float(regressor.learning_rate)}
+        else:
+            return None
+
+        n_features = regressor.n_features_in_
+        if scaler is not None:
+            scaler_mean = np.asarray(scaler.mean_, dtype=np.float64)
+            scaler_scale = np.asarray(scaler.scale_, dtype=np.float64)
+        else:
+            scaler_mean = np.zeros(n_features)
+            scaler_scale = np.ones(n_features)
+
+        #indici dei nodi resi globali tramite offset per albero; -1 resta la foglia
+        sizes = np.array([tree.node_count for tree in trees], dtype=np.int64)
+        roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+        left = np.concatenate([np.where(t.children_left == -1, -1, t.children_left + r)
+                               for t, r in zip(trees, roots)]).astype(np.int64)
+        right = np.concatenate([np.where(t.children_right == -1, -1, t.children_right + r)
+                                for t, r in zip(trees, roots)]).astype(np.int64)
+        feature = np.concatenate([t.feature for t in trees]).astype(np.int64)
+        threshold = np.concatenate([t.threshold for t in trees]).astype(np.float64)
+        value = np.concatenate([t.value[:, :, 0] for t in trees]).astype(np.float64)
+
+        meta["n_outputs"] = int(value.shape[1])
+        meta["n_features"] = int(n_features)
+        arrays = {
+            "scaler_mean": scaler_mean, "scaler_scale": scaler_scale, "roots": roots,
+            "children_left": left, "children_right": right, "feature": feature,
+            "threshold": threshold, "value": value
+        }
+        return cls(arrays, meta)
+
+    #scala le feature e percorre tutti gli alberi in parallelo, un livello per iterazione
+    def predict_per_tree(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        #stessa precisione usata da sklearn negli split degli alberi
+        X = ((X - self.scaler_mean) / self.scaler_scale).astype(np.float32)
+
+        n_samples = X.shape[0]
+        nodes = np.repeat(self.roots[:, None], n_samples, axis=1)
+        samples = np.broadcast_to(np.arange(n_samples), nodes.shape)
+        active = self.children_left[nodes] != -1
+        while active.any():
+            current = nodes[active]
+            go_left = X[samples[active], self.feature[current]] <= self.threshold[current]
+            nodes[active] = np.where(go_left, self.children_left[current], self.children_right[current])
+            active = self.children_left[nodes] != -1
+        #forma (n_alberi, n_campioni, n_output)
+        return self.value[nodes]
+
+    #predizione aggregata come nel modello sklearn di origine
+    def predict(self, X):
+        per_tree = self.predict_per_tree(X)
+        if self.kind == FOREST:
+            result = per_tree.mean(axis=0)
+        else:
+            result = self.meta["init_value"] + self.meta["learning_rate"] * per_tree.sum(axis=0)
+        return result[:, 0] if self.n_outputs == 1 else result
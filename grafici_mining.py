@@ -5,6 +5,16 @@ from plotly.subplots import make_subplots
 import json
 from datetime import datetime, timedelta
 import numpy as np
+import time
+from metrics import REGISTRY
+from feature_engineering import compute_feature_frame
+
+FIRESTORE_READ_SECONDS = REGISTRY.histogram('mining_firestore_read_seconds',
+                                            'Durata delle letture Firestore (query e costruzione DataFrame)', ['collection'])
+FIRESTORE_DOCUMENTS_READ = REGISTRY.counter('mining_firestore_documents_read_total',
+                                            'Documenti letti da Firestore', ['collection'])
+FIRESTORE_READ_ERRORS = REGISTRY.counter('mining_firestore_read_errors_total',
+                                         'Letture Firestore fallite', ['collection'])
 
 # Variabile globale soglia
 CURRENT_THRESHOLD = 4.0
@@ -25,9 +35,11 @@ def get_data_from_firestore(db, collection_name='mining_data', limit=10000):
         print("Errore: Database Firestore non configurato")
         return None
     
+    started = time.perf_counter()
     try:
         # recupera i documenti ordinati per timestamp in ordine crescente
         docs = db.collection(collection_name).order_by('row_index').limit(limit).get()
+        FIRESTORE_DOCUMENTS_READ.inc(len(docs), collection=collection_name)
         
         data = []
         for doc in docs:
@@ -54,8 +66,11 @@ def get_data_from_firestore(db, collection_name='mining_data', limit=10000):
         return df
     
     except Exception as e:
+        FIRESTORE_READ_ERRORS.inc(collection=collection_name)
         print(f"Errore recupero dati da Firestore: {e}")
         return None
+    finally:
+        FIRESTORE_READ_SECONDS.observe(time.perf_counter() - started, collection=collection_name)
 
 #grafico dashboard
 def create_realtime_charts(db=None):
@@ -330,6 +345,93 @@ def create_historical_charts(db=None):
         }
     }
 
+#ultimo campione con le feature ritardate calcolate sullo storico caricato, come nel training
+#(lo stato streaming del predictor esiste solo nel processo di ingest)
+def _model_input(df, predictor, last_data):
+    config = getattr(predictor, 'feature_config', None)
+    if not config:
+        return last_data
+    try:
+        features = compute_feature_frame(df, config).iloc[-1].to_dict()
+    except KeyError as e:
+        print(f"DEBUG PREDICTION: Feature ritardate non calcolabili, colonna mancante {e}")
+        return last_data
+    return dict(last_data, **features)
+
+#previsioni dirette: il modello multi-output restituisce tutti gli orizzonti in una chiamata
+def _direct_horizon_predictions(predictor, last_data, last_row_index, hours_ahead, threshold):
+    if predictor is None or getattr(predictor, 'horizon_model', None) is None:
+        return None
+    try:
+        horizons = predictor.predict_horizons(last_data, percentiles=(5, 50, 95), threshold=threshold)
+    except Exception as e:
+        print(f"DEBUG PREDICTION: Errore previsione multi-orizzonte: {e}")
+        return None
+    
+    #orizzonti entro la finestra richiesta (in minuti), almeno il primo
+    selected = [h for h in horizons if h['horizon_minutes'] <= hours_ahead] or horizons[:1]
+    print(f"DEBUG PREDICTION: {len(selected)} previsioni dirette multi-orizzonte")
+    
+    #banda dal 5°-95° percentile degli alberi; la confidenza è l'accordo degli alberi sul superamento soglia
+    return [{
+        'future_index': last_row_index + h['horizon_steps'],
+        'predicted_silica': max(0.1, h['predicted_silica']),
+        'lower': h['lower'],
+        'upper': h['upper'],
+        'exceedance_probability': h['exceedance_probability'],
+        'confidence': max(h['exceedance_probability'], 1 - h['exceedance_probability'])
+    } for h in selected]
+
+#simulazione passo-passo perturbando l'ultimo campione (modelli senza orizzonti diretti)
+def _simulated_predictions(df, predictor, last_data, last_row_index, hours_ahead):
+    #indici futuri da prevedere
+    num_predictions = max(3, hours_ahead * 3) 
+    future_indices = list(range(last_row_index + 1, last_row_index + 1 + num_predictions))
+    
+    print(f"DEBUG PREDICTION: Genero {len(future_indices)} predizioni future")
+    
+    predictions = []
+    for i, future_index in enumerate(future_indices):
+        #usa gli ultimi dati reali come base per la predizione
+        simulated_data = last_data.copy()
+        
+        variation_params = ['% Iron Feed', '% Silica Feed', 'Ore Pulp pH', 'Starch Flow']
+        for param in variation_params:
+            if param in simulated_data and pd.notna(simulated_data[param]):
+                base_value = simulated_data[param]
+                # Variazione del 2% con tendenza verso la media storica
+                if param in df.columns:
+                    historical_mean = df[param].mean()
+                    trend_factor = (historical_mean - base_value) * 0.1
+                    variation = np.random.normal(trend_factor, abs(base_value) * 0.02)
+                    simulated_data[param] = base_value + variation
+        
+        #predizione
+        pred = None
+        if predictor and hasattr(predictor, 'predict_silica'):
+            try:
+                pred = predictor.predict_silica(simulated_data)
+                print(f"DEBUG PREDICTION: Predizione ML per indice {future_index}: {pred}")
+            except Exception as e:
+                print(f"DEBUG PREDICTION: Errore predizione ML: {e}")
+                pred = None
+        
+        #modello semplificato
+        if pred is None:
+            base_silica = last_data.get('% Silica Concentrate', df['% Silica Concentrate'].mean())
+            ph_effect = (simulated_data.get('Ore Pulp pH', 10) - 10) * 0.1
+            iron_effect = (simulated_data.get('% Iron Feed', 60) - 60) * 0.02
+            pred = base_silica + ph_effect + iron_effect + np.random.normal(0, 0.2)
+            print(f"DEBUG PREDICTION: Predizione fallback per indice {future_index}: {pred}")
+        
+        predictions.append({
+            'future_index': future_index,
+            'predicted_silica': max(0.1, pred),
+            'confidence': max(0.3, 1.0 - (i * 0.1))
+        })
+    
+    return predictions
+
 #grafici predizioni
 def create_prediction_charts(db=None, predictor=None, hours_ahead=1):
     print(f"DEBUG PREDICTION: Avvio creazione grafici predizioni per {hours_ahead} ore")
@@ -384,51 +486,11 @@ def create_prediction_charts(db=None, predictor=None, hours_ahead=1):
     
     print(f"DEBUG PREDICTION: Ultimo row_index: {last_row_index}, Soglia: {threshold}")
     
-    #indici futuri da prevedere
-    num_predictions = max(3, hours_ahead * 3) 
-    future_indices = list(range(last_row_index + 1, last_row_index + 1 + num_predictions))
-    
-    print(f"DEBUG PREDICTION: Genero {len(future_indices)} predizioni future")
-    
-    predictions = []
-    for i, future_index in enumerate(future_indices):
-        #usa gli ultimi dati reali come base per la predizione
-        simulated_data = last_data.copy()
-        
-        variation_params = ['% Iron Feed', '% Silica Feed', 'Ore Pulp pH', 'Starch Flow']
-        for param in variation_params:
-            if param in simulated_data and pd.notna(simulated_data[param]):
-                base_value = simulated_data[param]
-                # Variazione del 2% con tendenza verso la media storica
-                if param in df.columns:
-                    historical_mean = df[param].mean()
-                    trend_factor = (historical_mean - base_value) * 0.1
-                    variation = np.random.normal(trend_factor, abs(base_value) * 0.02)
-                    simulated_data[param] = base_value + variation
-        
-        #predizione
-        pred = None
-        if predictor and hasattr(predictor, 'predict_silica'):
-            try:
-                pred = predictor.predict_silica(simulated_data)
-                print(f"DEBUG PREDICTION: Predizione ML per indice {future_index}: {pred}")
-            except Exception as e:
-                print(f"DEBUG PREDICTION: Errore predizione ML: {e}")
-                pred = None
-        
-        #modello semplificato
-        if pred is None:
-            base_silica = last_data.get('% Silica Concentrate', df['% Silica Concentrate'].mean())
-            ph_effect = (simulated_data.get('Ore Pulp pH', 10) - 10) * 0.1
-            iron_effect = (simulated_data.get('% Iron Feed', 60) - 60) * 0.02
-            pred = base_silica + ph_effect + iron_effect + np.random.normal(0, 0.2)
-            print(f"DEBUG PREDICTION: Predizione fallback per indice {future_index}: {pred}")
-        
-        predictions.append({
-            'future_index': future_index,
-            'predicted_silica': max(0.1, pred),
-            'confidence': max(0.3, 1.0 - (i * 0.1))
-        })
+    #previsioni dirette multi-orizzonte in un'unica inferenza, se il modello le supporta
+    model_input = _model_input(df, predictor, last_data) if predictor is not None else last_data
+    predictions = _direct_horizon_predictions(predictor, model_input, last_row_index, hours_ahead, threshold)
+    if predictions is None:
+        predictions = _simulated_predictions(df, predictor, model_input, last_row_index, hours_ahead)
     
     pred_df = pd.DataFrame(predictions)
     print(f"DEBUG PREDICTION: Creato DataFrame predizioni con {len(pred_df)} righe")
@@ -463,9 +525,13 @@ def create_prediction_charts(db=None, predictor=None, hours_ahead=1):
         marker=dict(size=6)
     ))
     
-    #banda di confidenza
-    upper_bound = pred_df['predicted_silica'] + (1 - pred_df['confidence'])
-    lower_bound = pred_df['predicted_silica'] - (1 - pred_df['confidence'])
+    #banda di confidenza: intervallo reale se disponibile, altrimenti stima dalla confidenza
+    if 'upper' in pred_df:
+        upper_bound = pred_df['upper']
+        lower_bound = pred_df['lower']
+    else:
+        upper_bound = pred_df['predicted_silica'] + (1 - pred_df['confidence'])
+        lower_bound = pred_df['predicted_silica'] - (1 - pred_df['confidence'])
     
     fig1.add_trace(go.Scatter(
         x=pred_df['future_index'].tolist(),
@@ -506,6 +572,7 @@ def create_prediction_charts(db=None, predictor=None, hours_ahead=1):
         'min_prediction': float(pred_df['predicted_silica'].min()),
         'alerts_predicted': alerts_predicted,  # Ora conta correttamente con soglia dinamica
         'avg_confidence': float(pred_df['confidence'].mean() * 100),
+        'max_exceedance_probability': float(pred_df['exceedance_probability'].max() * 100) if 'exceedance_probability' in pred_df else None,
         'prediction_horizon': f"{len(pred_df)} righe future",
         'based_on_cloud_data': True,
         'last_real_value': float(last_data.get('% Silica Concentrate', 0)),
@@ -0,0 +1,17 @@
+import os
+import multiprocessing
+
+#worker HTTP per la dashboard: MQTT, inferenza in ingest e allerte girano nel processo separato
+#avviato con "python main.py --role ingest"; lo stato condiviso passa da data/shared_state.db
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+#thread per worker: le richieste che aspettano Firestore non bloccano il worker
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '4'))
+#grafici e backtest possono richiedere decine di secondi
+timeout = 120
+#ogni worker carica il proprio predictor in sola lettura: gli alberi sono array mappati dal registro
+#e le pagine restano condivise tra i processi
+preload_app = False
+accesslog = '-'
+errorlog = '-'
@@ -0,0 +1,111 @@
+import time
+import threading
+from collections import deque
+from metrics import REGISTRY
+
+#fasi tracciate per ogni campione, nell'ordine del percorso; il contesto di traccia viaggia nel
+#messaggio MQTT ('trace': {'published_at': ...}) e il server aggiunge '<fase>_at' (epoch, secondi).
+#received = callback MQTT dell'ingest (il broker non marca l'orario di ricezione), dequeued = inizio
+#elaborazione, alerted = notifica immediata accodata (solo con frequenza email 'immediate': con i
+#digest non esiste), visible = campione leggibile dalla dashboard (stato pubblicato ai worker web
+#o, in processo unico, fine elaborazione)
+TRACE_STAGES = ('received', 'dequeued', 'persisted', 'predicted', 'alerted', 'visible')
+PERCENTILES = (50, 90, 95, 99)
+#obiettivo di default: predizione (da cui partono allerte e digest) entro 2 s dalla misura;
+#valorizzata per ogni campione qualunque sia la frequenza delle email
+DEFAULT_LATENCY_SLO = {'stage': 'predicted', 'seconds': 2.0}
+
+SAMPLE_LATENCY_SECONDS = REGISTRY.histogram('mining_sample_latency_seconds',
+                                            'Latenza dalla pubblicazione del campione a ciascuna fase', ['stage'])
+
+
+#contesto di traccia di un messaggio (creato se il client non lo invia)
+def get_trace(data):
+    trace = data.get('trace')
+    if not isinstance(trace, dict):
+        trace = data['trace'] = {}
+    return trace
+
+
+def mark(trace, stage, ts=None):
+    trace[f'{stage}_at'] = ts or time.time()
+
+
+#ultimi max_samples valori per fase, misurati dalla pubblicazione del client (include rete, broker
+#e differenza tra gli orologi) e dalla ricezione nell'ingest (solo orologio del server)
+class LatencyTracker:
+    def __init__(self, max_samples=5000):
+        self._since_publish = {stage: deque(maxlen=max_samples) for stage in TRACE_STAGES}
+        self._since_receive = {stage: deque(maxlen=max_samples) for stage in TRACE_STAGES}
+        #campioni completati non ancora pubblicati nello stato condiviso
+        self._pending_visible = deque(maxlen=max_samples)
+        self.traced_count = 0
+        self.untraced_count = 0
+        self._lock = threading.Lock()
+
+    #campione elaborato completamente (persistito e predetto); visible se la dashboard legge
+    #direttamente lo stato di questo processo, altrimenti lo diventa con mark_visible
+    def record(self, trace, visible=False):
+        published = trace.get('published_at')
+        received = trace.get('received_at')
+        if visible:
+            mark(trace, 'visible')
+        with self._lock:
+            for stage in TRACE_STAGES:
+                ts = trace.get(f'{stage}_at')
+                if ts is not None:
+                    self._add(stage, ts, published, received)
+            if not visible:
+                self._pending_visible.append((published, received))
+            if published is not None:
+                self.traced_count += 1
+            else:
+                self.untraced_count += 1
+
+    def _add(self, stage, ts, published, received):
+        if published is not None:
+            self._since_publish[stage].append(ts - published)
+            SAMPLE_LATENCY_SECONDS.observe(ts - published, stage=stage)
+        if received is not None:
+            self._since_receive[stage].append(ts - received)
+
+    #i campioni completati diventano visibili ai worker web con la pubblicazione dello stato
+    def mark_visible(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            while self._pending_visible:
+                published, received = self._pending_visible.popleft()
+                self._add('visible', now, published, received)
+
+    def summary(self, slo=None):
+        slo = dict(DEFAULT_LATENCY_SLO, **(slo or {}))
+        with self._lock:
+            since_publish = {stage: sorted(values) for stage, values in self._since_publish.items()}
+            since_receive = {stage: sorted(values) for stage, values in self._since_receive.items()}
+            traced, untraced = self.traced_count, self.untraced_count
+        slo_values = since_publish.get(slo['stage']) or []
+        within = sum(1 for value in slo_values if value <= slo['seconds'])
+        if not slo_values and slo['stage'] == 'alerted':
+            slo['note'] = "la fase alerted esiste solo con notifiche email immediate"
+        return {
+            'stages': {
+                stage: {
+                    'since_publish': _stats(since_publish[stage]),
+                    'since_receive': _stats(since_receive[stage])
+                } for stage in TRACE_STAGES
+            },
+            'traced_samples': traced,
+            'untraced_samples': untraced,
+            'slo': dict(slo, samples=len(slo_values),
+                        compliance=round(within / len(slo_values), 4) if slo_values else None)
+        }
+
+
+#percentili (nearest rank) su valori già ordinati
+def _stats(values):
+    if not values:
+        return {'count': 0}
+    stats = {'count': len(values), 'min': round(values[0], 4), 'max': round(values[-1], 4)}
+    for p in PERCENTILES:
+        stats[f'p{p}'] = round(values[min(len(values) - 1, max(0, -(-p * len(values) // 100) - 1))], 4)
+    return stats
@@ -1,28 +1,54 @@
-from flask import Flask, redirect, url_for, request, render_template, jsonify, flash
+from flask import Flask, redirect, url_for, request, render_template, jsonify, flash, g, Response, send_file
 from flask_login import LoginManager, current_user, login_user, logout_user, login_required, UserMixin
 import paho.mqtt.client as mqtt
 import json
 import threading
 import time
+import argparse
 from datetime import datetime, timedelta
 import os
 
-#import moduli personalizzati
+#import moduli personalizzati; grafici_mining (plotly, pandas), ml_predictor (sklearn) e
+#Firestore vengono importati al primo uso o dall'avvio in background dei sottosistemi
 try:
-    import grafici_mining
-    import ml_predictor
     import email_notifications
+    from alert_manager import AlertManager, DEFAULT_ALERT_SETTINGS
+    from notification_history import NotificationHistory
+    from exceedance_counters import ExceedanceCounters
+    from value_index import ValueIndex
+    from shared_state import SharedState
+    from metrics import REGISTRY, merge_snapshots, render, without_gauges
+    from request_profiler import RequestProfiler, DEFAULT_PROFILING_SETTINGS
+    from latency_tracker import LatencyTracker, DEFAULT_LATENCY_SLO, get_trace, mark
 except ImportError as e:
     print(f"Errore import moduli: {e}")
 
-#setup Firestore
-try:
-    from google.cloud import firestore
-    from google.cloud.firestore_v1 import FieldFilter
-    HAS_FIRESTORE = True
-except ImportError:
-    HAS_FIRESTORE = False
-    print("Google Cloud Firestore non disponibile")
+#campioni storici caricati all'avvio nell'indice dei valori per l'anteprima soglia
+VALUE_HISTORY_LIMIT = 50000
+
+#ruoli del processo: 'all' tutto in un processo (sviluppo), 'ingest' MQTT, persistenza, inferenza
+#e allerte, 'web' solo HTTP (più worker gunicorn che leggono lo stato pubblicato dall'ingest)
+ROLES = ('all', 'ingest', 'web')
+#intervallo del ciclo comandi dell'ingest e pubblicazione periodica dello stato anche senza dati
+COMMAND_POLL_INTERVAL = 1
+STATE_PUBLISH_INTERVAL = 30
+#stati dei sottosistemi avviati in background; /readyz risponde 200 quando quelli richiesti sono pronti
+SUBSYSTEM_STATES = ('pending', 'starting', 'ready', 'failed', 'disabled')
+REQUIRED_SUBSYSTEMS = ('predictor',)
+#ogni worker web pubblica le proprie metriche ogni METRICS_PUBLISH_INTERVAL secondi e /metrics le somma
+#a quelle dell'ingest; le istantanee non aggiornate da METRICS_STALE_SECONDS sono di processi terminati
+#(ne restano contatori e istogrammi, non i gauge) e dopo METRICS_RETIRE_SECONDS l'ingest le accorpa
+#in 'metrics:retired', così i contatori sommati non tornano indietro
+METRICS_PUBLISH_INTERVAL = 5
+METRICS_STALE_SECONDS = 2 * STATE_PUBLISH_INTERVAL
+METRICS_RETIRE_SECONDS = 600
+
+INGEST_MESSAGES = REGISTRY.counter('mining_ingest_messages_total', 'Messaggi MQTT ricevuti')
+INGEST_ERRORS = REGISTRY.counter('mining_ingest_errors_total', 'Errori di ingest per fase', ['stage'])
+INGEST_STAGE_SECONDS = REGISTRY.histogram('mining_ingest_stage_seconds',
+                                          'Durata delle fasi di ingest per messaggio (decode, persist, predict, alert)', ['stage'])
+HTTP_REQUESTS = REGISTRY.counter('mining_http_requests_total', 'Richieste alle API', ['route', 'method', 'status'])
+HTTP_REQUEST_SECONDS = REGISTRY.histogram('mining_http_request_seconds', 'Durata delle richieste alle API', ['route', 'method'])
 
 class User(UserMixin):
     def __init__(self, username, email=None):
@@ -32,7 +58,10 @@ class User(UserMixin):
         self.email = email
 
 class MiningServer:
-    def __init__(self):
+    def __init__(self, role='all', start_mqtt=True):
+        if role not in ROLES:
+            raise ValueError(f"Ruolo non valido: {role}")
+        self.role = role
         self.app = Flask(__name__, template_folder="templates", static_folder="static")
         self.app.config['SECRET_KEY'] = 'mining_secret_key_2024'
         
@@ -56,64 +85,397 @@ class MiningServer:
                 'recipients': [],
                 'frequency': 'immediate'
             },
+            'model': {
+                'incremental_learning': True,
+                'update_interval_seconds': 600,
+                'drift_auto_retrain': False,
+                'drift_psi_threshold': 0.25,
+                'drift_min_features': 3,
+                'drift_check_interval_samples': 180,
+                'drift_retrain_cooldown_seconds': 21600,
+                'prediction_cache_size': 4096,
+                'prediction_cache_ttl_seconds': 300
+            },
+            'alerts': dict(DEFAULT_ALERT_SETTINGS),
+            'profiling': dict(DEFAULT_PROFILING_SETTINGS),
+            'latency_slo': dict(DEFAULT_LATENCY_SLO),
             'last_update': None
         }
+        self.settings_mtime = None
         self.load_settings()
         
-        #setup Firestore
-        if HAS_FIRESTORE:
-            try:
-                self.db = firestore.Client.from_service_account_json('credentials.json')
-                print("Connesso a Firestore")
-                
-                self.clear_old_data()
-                
-            except Exception as e:
-                print(f"Errore connessione Firestore: {e}")
-                self.db = None
+        #stato condiviso tra processo di ingest e worker web
+        self.shared = SharedState() if role != 'all' else None
+        self.state_dirty = True
+        self.last_state_publish = 0
+        
+        #sottosistemi pesanti (Firestore, MQTT, modello) avviati in background: l'app risponde
+        #subito e /readyz indica quando ciascuno è pronto
+        self.started_at = time.time()
+        self.subsystems = {}
+        self.db = None
+        self.predictor = None
+        self.prediction_threshold = self.settings['threshold']
+        self.mqtt_client = None
+        for name in ('firestore', 'predictor'):
+            self.set_subsystem(name, 'pending')
+        if role != 'web':
+            self.set_subsystem('mqtt', 'pending' if start_mqtt else 'disabled')
+        
+        #setup Email Notifications
+        try:
+            self.email_notifier = email_notifications.EmailNotifier()
+        except:
+            self.email_notifier = None
+            print("Email Notifier non disponibile")
+        
+        #storico persistente di allerte e invii email
+        self.history = NotificationHistory()
+        if self.email_notifier:
+            self.email_notifier.history = self.history
+        
+        #contatori a bucket (minuto/ora/giorno) dei superamenti soglia: silica misurata e predetta.
+        #nei worker web sono copie in sola lettura dello stato pubblicato dall'ingest
+        if role == 'web':
+            self.exceedance_counters = {'silica': ExceedanceCounters(), 'prediction': ExceedanceCounters()}
         else:
-            self.db = None
+            self.exceedance_counters = {
+                'silica': ExceedanceCounters('data/counters/silica.json'),
+                'prediction': ExceedanceCounters('data/counters/prediction.json')
+            }
+        
+        #istogrammi incrementali dei valori per l'anteprima soglia su tutto lo storico
+        self.value_indexes = {
+            'silica': ValueIndex(),
+            'prediction': ValueIndex()
+        }
+        
+        #allerte con isteresi, promemoria e digest secondo settings['email']['frequency']
+        self.alert_manager = None
+        if role != 'web':
+            self.alert_manager = AlertManager(self.notify_alert, self.notify_alert_digest, lambda: self.settings)
+            REGISTRY.gauge('mining_alerts_active', 'Condizioni in stato di allerta', function=lambda: sum(
+                1 for c in self.alert_manager.get_status()['conditions'].values() if c['state'] == 'alerting'))
+        
+        #ricerca iperparametri in background
+        self.search_thread = None
+        self.search_error = None
+        
+        #riaddestramento automatico su deriva dei dati
+        self.drift_retrain_thread = None
+        self.last_drift_retrain = None
+        self.drift_samples_since_check = 0
+        
+        #ultimo campione ricevuto, stato di partenza delle simulazioni what-if
+        self.last_sensor_data = None
         
-        #setup MQTT
-        self.mqtt_client = mqtt.Client()
-        self.mqtt_client.on_connect = self.on_mqtt_connect
-        self.mqtt_client.on_message = self.on_mqtt_message
-        self.setup_mqtt()
+        #latenze per fase dei campioni, dalla pubblicazione del client alla dashboard
+        self.latency = LatencyTracker()
         
-        #setup ML Predictor 
+        #setup routes
+        self.metrics_thread = None
+        self.metrics_lock = threading.Lock()
+        self._metrics_key = None
+        self.last_metrics_retire = 0
+        self.profiler = None
+        if role != 'ingest':
+            #profili delle richieste lente o richieste dall'admin, in data/profiles
+            self.profiler = RequestProfiler(lambda: self.settings.get('profiling'))
+            self.app.before_request(self.start_request_timer)
+            self.app.before_request(self.start_profiling)
+            self.app.after_request(self.record_request_metrics)
+            self.app.after_request(self.stop_profiling)
+            self.app.teardown_request(self.discard_profiling)
+            self.setup_routes()
+        if role == 'web':
+            self.app.before_request(self.sync_shared_state)
+        
+        self.mqtt_thread = None
+        self.start_mqtt = start_mqtt and role != 'web'
+        self.init_thread = threading.Thread(target=self.init_subsystems, daemon=True)
+        self.init_thread.start()
+        
+        #comandi dai worker web e pubblicazione dello stato condiviso
+        if role == 'ingest':
+            self.command_thread = threading.Thread(target=self.command_loop, daemon=True)
+            self.command_thread.start()
+    
+    def set_subsystem(self, name, state, error=None):
+        entry = self.subsystems.setdefault(name, {})
+        if state == 'starting':
+            entry['started_at'] = time.time()
+        elif state in ('ready', 'failed') and 'started_at' in entry:
+            entry['startup_seconds'] = round(time.time() - entry['started_at'], 3)
+        entry.update(state=state, error=error, since=datetime.now().isoformat())
+    
+    #avvio in background: Firestore, poi MQTT (i campioni vanno salvati da subito), poi il modello
+    def init_subsystems(self):
+        self.init_firestore()
+        if self.db and self.role != 'web':
+            #pulizia dei dati vecchi e storico per l'indice dei valori senza bloccare il resto
+            threading.Thread(target=self.clear_old_data, daemon=True).start()
+            threading.Thread(target=self.load_value_history, daemon=True).start()
+        if self.start_mqtt:
+            self.set_subsystem('mqtt', 'starting')
+            self.mqtt_client = mqtt.Client()
+            self.mqtt_client.on_connect = self.on_mqtt_connect
+            self.mqtt_client.on_message = self.on_mqtt_message
+            self.setup_mqtt()
+            self.mqtt_thread = threading.Thread(target=self.start_mqtt_loop, daemon=True)
+            self.mqtt_thread.start()
+        self.init_predictor()
+        #i grafici importano plotly e pandas: meglio qui che alla prima richiesta
+        if self.role != 'ingest':
+            try:
+                import grafici_mining
+            except ImportError as e:
+                print(f"Errore import grafici: {e}")
+        print(f"Sottosistemi avviati in {time.time() - self.started_at:.1f} s")
+    
+    def init_firestore(self):
+        self.set_subsystem('firestore', 'starting')
         try:
-            self.predictor = ml_predictor.SilicaPredictor(db=self.db)
+            from google.cloud import firestore
+        except ImportError:
+            print("Google Cloud Firestore non disponibile")
+            self.set_subsystem('firestore', 'disabled', 'google-cloud-firestore non installato')
+            return
+        try:
+            self.db = firestore.Client.from_service_account_json('credentials.json')
+            print("Connesso a Firestore")
+            self.set_subsystem('firestore', 'ready')
+        except Exception as e:
+            print(f"Errore connessione Firestore: {e}")
+            self.db = None
+            self.set_subsystem('firestore', 'failed', str(e))
+    
+    def init_predictor(self):
+        self.set_subsystem('predictor', 'starting')
+        try:
+            import ml_predictor
+            model_settings = self.settings.get('model', {})
+            predictor = ml_predictor.SilicaPredictor(
+                db=self.db,
+                prediction_cache_size=model_settings.get('prediction_cache_size', 4096),
+                prediction_cache_ttl=model_settings.get('prediction_cache_ttl_seconds', 300),
+                prediction_cache_resolution=model_settings.get('prediction_cache_resolution'),
+                read_only=self.role == 'web')
             
-            #soglia dalle settings
-            self.prediction_threshold = self.settings['threshold']
+            #update incrementali dai campioni etichettati che arrivano via MQTT
+            if model_settings.get('incremental_learning', True) and self.role != 'web':
+                predictor.start_incremental_updates(model_settings.get('update_interval_seconds', 600))
             
             #stampa info sul modello
-            model_info = self.predictor.get_model_info()
+            model_info = predictor.get_model_info()
             print(f"ML Predictor Status: {model_info['status']}")
             if model_info['status'] == 'READY':
                 print(f"Modello: {model_info['model_name']}")
-                print(f"R² Score: {model_info['metrics'].get('r2_score', 'N/A')}")
+                print(f"R² Score: {model_info['metrics'].get('r2', 'N/A')}")
                 print(f"Dati training: {model_info['metrics'].get('training_samples', 'N/A')} campioni")
                 print(f"Fonte dati: {model_info['metrics'].get('data_source', 'N/A')}")
             
+            self.predictor = predictor
+            #un worker web senza modello nel registro resta in attesa della prima versione
+            self.set_subsystem('predictor', 'ready' if predictor.is_ready() else 'starting')
+            self.state_dirty = True
         except Exception as e:
             self.predictor = None
-            self.prediction_threshold = self.settings['threshold']
             print(f"ML Predictor non disponibile: {e}")
-        
-        #setup Email Notifications
+            self.set_subsystem('predictor', 'failed', str(e))
+    
+    #worker web: settings, contatori, indici e ultimo campione dallo stato pubblicato dall'ingest;
+    #gli oggetti vengono ricostruiti solo quando l'ingest li aggiorna
+    def sync_shared_state(self):
+        self.refresh_settings()
+        if not request.path.startswith('/api/'):
+            return
+        for series in ('silica', 'prediction'):
+            self.exceedance_counters[series] = self.shared.get_object(
+                f'counters:{series}', ExceedanceCounters.from_state, self.exceedance_counters[series])
+            self.value_indexes[series] = self.shared.get_object(
+                f'value_index:{series}', ValueIndex.from_state, self.value_indexes[series])
+        self.last_sensor_data = self.shared.get('last_sensor_data', self.last_sensor_data)
+        #nuova versione del modello pubblicata dall'ingest o rollback da un altro worker
+        if self.predictor and self.predictor.refresh_model():
+            self.set_subsystem('predictor', 'ready')
+    
+    #durata e esito delle chiamate /api, etichettate con la regola della route (non il path)
+    def start_request_timer(self):
+        g.request_started = time.perf_counter()
+    
+    def record_request_metrics(self, response):
+        started = g.pop('request_started', None)
+        if started is not None and request.url_rule is not None and request.path.startswith('/api/'):
+            route = request.url_rule.rule
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method)
+            HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+        if self.role == 'web' and (self.metrics_thread is None or not self.metrics_thread.is_alive()):
+            self.start_metrics_publisher()
+        return response
+    
+    #profilazione delle richieste /api: cProfile se l'admin lo chiede (header X-Profile: 1 o ?profile=1)
+    #o per campionamento, altrimenti stack campionati salvati solo se la richiesta supera la soglia
+    def start_profiling(self):
+        if not request.path.startswith('/api/') or request.path.startswith('/api/admin/profil'):
+            return
+        requested = False
+        if request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1':
+            requested = current_user.is_authenticated and current_user.username == 'admin'
+        g.profile = self.profiler.start({
+            'method': request.method,
+            'path': request.path,
+            'route': request.url_rule.rule if request.url_rule is not None else None,
+            'args': request.args.to_dict(flat=False),
+            'user': current_user.username if current_user.is_authenticated else None,
+            'pid': os.getpid()
+        }, requested=requested)
+    
+    def stop_profiling(self, response):
+        token = g.pop('profile', None)
+        if token is not None:
+            profile_id = self.profiler.stop(token, response.status_code)
+            if profile_id:
+                response.headers['X-Profile-Id'] = profile_id
+        return response
+    
+    #richiesta interrotta da un'eccezione prima di after_request
+    def discard_profiling(self, error=None):
+        token = g.pop('profile', None)
+        if token is not None:
+            self.profiler.stop(token, 500)
+    
+    #chiave del worker: pid e istante di avvio, così un pid riusato non sovrascrive l'istantanea
+    #di un worker terminato (ricalcolata dopo un fork)
+    def metrics_key(self):
+        if self._metrics_key is None or self._metrics_key[0] != os.getpid():
+            self._metrics_key = (os.getpid(), f'metrics:web:{os.getpid()}-{int(time.time() * 1000)}')
+        return self._metrics_key[1]
+    
+    #avviato alla prima richiesta del worker (dopo il fork di gunicorn); pubblica anche da fermo,
+    #così un'istantanea non aggiornata indica davvero un worker terminato
+    def start_metrics_publisher(self):
+        with self.metrics_lock:
+            if self.metrics_thread is not None and self.metrics_thread.is_alive():
+                return
+            self.metrics_thread = threading.Thread(target=self.metrics_publish_loop, daemon=True)
+            self.metrics_thread.start()
+    
+    def metrics_publish_loop(self):
+        while True:
+            try:
+                self.shared.publish({self.metrics_key(): REGISTRY.snapshot()})
+            except Exception as e:
+                print(f"Errore pubblicazione metriche: {e}")
+            time.sleep(METRICS_PUBLISH_INTERVAL)
+    
+    #ingest: accorpa i contatori dei worker terminati da tempo e ne elimina le chiavi
+    def retire_metrics(self):
+        self.last_metrics_retire = time.time()
+        stale = {key: snapshot for key, (updated_at, snapshot) in self.shared.items('metrics:web:', with_time=True).items()
+                 if self.last_metrics_retire - updated_at > METRICS_RETIRE_SECONDS}
+        if stale:
+            retired = merge_snapshots([self.shared.get('metrics:retired', {})] +
+                                      [without_gauges(snapshot) for snapshot in stale.values()])
+            self.shared.publish({'metrics:retired': retired}, delete=stale)
+            print(f"Metriche di {len(stale)} worker terminati accorpate")
+    
+    #metriche di questo processo più, con più processi, quelle pubblicate da ingest e altri worker
+    def get_metrics(self):
+        snapshots = [REGISTRY.snapshot()]
+        if self.shared is not None:
+            own_key = self.metrics_key() if self.role == 'web' else 'metrics:ingest'
+            now = time.time()
+            for key, (updated_at, snapshot) in self.shared.items('metrics:', with_time=True).items():
+                if key == own_key:
+                    continue
+                snapshots.append(snapshot if now - updated_at <= METRICS_STALE_SECONDS else without_gauges(snapshot))
+        return merge_snapshots(snapshots)
+    
+    #ingest: esegue i comandi dei worker web e pubblica lo stato quando cambia
+    def command_loop(self):
+        while True:
+            try:
+                for command in self.shared.take_commands():
+                    self.run_command(command)
+                self.refresh_settings()
+                if self.predictor and self.predictor.refresh_model():
+                    self.state_dirty = True
+                if self.state_dirty or time.time() - self.last_state_publish >= STATE_PUBLISH_INTERVAL:
+                    self.publish_state()
+                if time.time() - self.last_metrics_retire >= METRICS_RETIRE_SECONDS / 10:
+                    self.retire_metrics()
+            except Exception as e:
+                print(f"Errore ciclo comandi ingest: {e}")
+            time.sleep(COMMAND_POLL_INTERVAL)
+    
+    def run_command(self, command):
+        name, args = command['name'], command['args']
+        print(f"Comando {name} da {command.get('requested_by') or 'web'}")
+        result, status = None, 'done'
         try:
-            self.email_notifier = email_notifications.EmailNotifier()
-        except:
-            self.email_notifier = None
-            print("Email Notifier non disponibile")
-        
-        #setup routes
-        self.setup_routes()
-        
-        #avvia MQTT in thread separato
-        self.mqtt_thread = threading.Thread(target=self.start_mqtt_loop, daemon=True)
-        self.mqtt_thread.start()
+            if name == 'reset_counters':
+                self.reset_counters()
+            elif name == 'flush_digests':
+                result = self.alert_manager.flush_digests(force=True)
+            elif name == 'retrain':
+                #l'addestramento non blocca il ciclo comandi: l'esito arriva a fine training
+                def run_retrain():
+                    try:
+                        success = self.predictor.train_model()
+                        self.shared.complete_command(command['id'], 'done' if success else 'failed',
+                                                     self.predictor.get_model_info() if success else None)
+                    except Exception as e:
+                        self.shared.complete_command(command['id'], 'failed', str(e))
+                    self.state_dirty = True
+                threading.Thread(target=run_retrain, daemon=True).start()
+                return
+            elif name == 'search':
+                if not self.start_hyperparameter_search(args):
+                    status, result = 'failed', 'Ricerca iperparametri già in corso'
+            elif name == 'importance':
+                if not self.predictor.start_feature_importance(args.get('source', 'recent'),
+                                                               n_repeats=int(args.get('n_repeats', 5)),
+                                                               max_samples=int(args.get('max_samples', 5000))):
+                    status, result = 'failed', 'Calcolo importanza già in corso'
+            else:
+                status, result = 'failed', f'Comando sconosciuto: {name}'
+        except Exception as e:
+            status, result = 'failed', str(e)
+        self.shared.complete_command(command['id'], status, result)
+        self.state_dirty = True
+    
+    def publish_state(self):
+        now = time.time()
+        self.state_dirty = False
+        self.last_state_publish = now
+        state = {
+            'last_sensor_data': self.last_sensor_data,
+            'alerts_status': self.alert_manager.get_status(),
+            'model_info': self.predictor.get_model_info() if self.predictor else {'status': 'NOT_AVAILABLE'},
+            'drift_snapshot': self.predictor.get_drift_snapshot() if self.predictor else None,
+            'jobs': self.get_jobs(),
+            'readiness': self.get_readiness(),
+            'latency': self.latency.summary(self.settings.get('latency_slo')),
+            'metrics:ingest': REGISTRY.snapshot()
+        }
+        for series in ('silica', 'prediction'):
+            state[f'counters:{series}'] = self.exceedance_counters[series].get_state()
+            state[f'value_index:{series}'] = self.value_indexes[series].get_state(now)
+        self.shared.publish(state)
+        self.latency.mark_visible()
+    
+    def load_value_history(self):
+        try:
+            import grafici_mining
+            df = grafici_mining.get_data_from_firestore(self.db, limit=VALUE_HISTORY_LIMIT)
+            if df is None or '% Silica Concentrate' not in df.columns:
+                return
+            samples = [(ts.to_pydatetime().timestamp(), value)
+                       for ts, value in zip(df['timestamp'], df['% Silica Concentrate']) if ts is not None and ts == ts]
+            loaded = self.value_indexes['silica'].load_history(samples)
+            print(f"Indice valori silica: caricati {loaded} campioni storici")
+        except Exception as e:
+            print(f"Errore caricamento storico indice valori: {e}")
     
     def load_user(self, username):
         if username in self.users_db:
@@ -124,6 +486,7 @@ class MiningServer:
     def load_settings(self):
         try:
             if os.path.exists(self.settings_file):
+                self.settings_mtime = os.path.getmtime(self.settings_file)
                 with open(self.settings_file, 'r') as f:
                     loaded_settings = json.load(f)
                     self.settings.update(loaded_settings)
@@ -131,11 +494,26 @@ class MiningServer:
         except Exception as e:
             print(f"Errore caricamento settings: {e}")
     
+    #ricarica le settings se un altro processo le ha modificate
+    def refresh_settings(self):
+        try:
+            mtime = os.path.getmtime(self.settings_file)
+        except OSError:
+            return
+        if mtime != self.settings_mtime:
+            self.load_settings()
+            self.prediction_threshold = self.settings['threshold']
+            self.state_dirty = True
+    
     def save_settings(self):
         try:
             os.makedirs(os.path.dirname(self.settings_file), exist_ok=True)
-            with open(self.settings_file, 'w') as f:
+            #scrittura atomica: gli altri processi non leggono mai un file a metà
+            tmp_file = self.settings_file + '.tmp'
+            with open(tmp_file, 'w') as f:
                 json.dump(self.settings, f, indent=2, default=str)
+            os.replace(tmp_file, self.settings_file)
+            self.settings_mtime = os.path.getmtime(self.settings_file)
             print(f"Settings salvati: soglia={self.settings['threshold']}")
         except Exception as e:
             print(f"Errore salvataggio settings: {e}")
@@ -166,7 +544,18 @@ class MiningServer:
         except Exception as e:
             print(f"Errore durante la pulizia automatica: {e}")
     
+    def reset_counters(self):
+        for counters in self.exceedance_counters.values():
+            counters.reset()
+        for index in self.value_indexes.values():
+            index.reset()
+    
     def clear_all_data(self):
+        #contatori e indici appartengono al processo di ingest
+        if self.role == 'web':
+            self.shared.send_command('reset_counters')
+        else:
+            self.reset_counters()
         if not self.db:
             return
         
@@ -187,45 +576,138 @@ class MiningServer:
         try:
             mqtt_broker = os.getenv('MQTT_BROKER', 'localhost')
             mqtt_port = int(os.getenv('MQTT_PORT', '1883'))
-            self.mqtt_client.connect(mqtt_broker, mqtt_port, 60)
+            #la connessione avviene nel loop MQTT, che ritenta finché il broker non risponde
+            self.mqtt_client.connect_async(mqtt_broker, mqtt_port, 60)
             print(f"Client MQTT configurato per {mqtt_broker}:{mqtt_port}")
         except Exception as e:
             print(f"Errore configurazione MQTT: {e}")
+            self.set_subsystem('mqtt', 'failed', str(e))
     
     def start_mqtt_loop(self):
-        self.mqtt_client.loop_forever()
+        self.mqtt_client.loop_forever(retry_first_connection=True)
     
     def on_mqtt_connect(self, client, userdata, flags, rc):
         if rc == 0:
             print("Connesso al broker MQTT")
             client.subscribe("mining/sensor_data")
+            self.set_subsystem('mqtt', 'ready')
         else:
             print(f"Errore connessione MQTT: {rc}")
+            self.set_subsystem('mqtt', 'failed', f'codice {rc}')
     
     def on_mqtt_message(self, client, userdata, msg):
+        INGEST_MESSAGES.inc()
+        received_at = time.time()
+        started = time.perf_counter()
         try:
             data = json.loads(msg.payload.decode())
+        except ValueError as e:
+            INGEST_ERRORS.inc(stage='decode')
+            print(f"Messaggio MQTT non valido: {e}")
+            return
+        INGEST_STAGE_SECONDS.observe(time.perf_counter() - started, stage='decode')
+        try:
             print(f"Ricevuti dati: riga {data.get('row_index', 'N/A')}")
+            trace = get_trace(data)
+            mark(trace, 'received', received_at)
+            mark(trace, 'dequeued')
             
             #salva nel database
             if self.db:
-                self.save_to_firestore(data)
+                with INGEST_STAGE_SECONDS.time(stage='persist'):
+                    if self.save_to_firestore(data):
+                        mark(trace, 'persisted')
             
-            if self.predictor:
-                sensor_data = data['data']
-                prediction = self.predictor.predict_silica(sensor_data)
-                
-                current_threshold = self.settings['threshold']
-                if prediction and prediction > current_threshold:
-                    print(f"ALLERTA: Predizione Silica = {prediction:.2f}% (soglia:{current_threshold}%)")
-                    if self.email_notifier and self.settings['email']['enabled']:
-                        self.send_alert_email(prediction, sensor_data)
+            self.process_sample(data)
+            #in processo unico la dashboard legge subito lo stato aggiornato
+            self.latency.record(trace, visible=self.shared is None)
             
         except Exception as e:
+            INGEST_ERRORS.inc(stage='process')
             print(f"Errore elaborazione messaggio MQTT: {e}")
     
+    #contatori, inferenza e allerte per un campione già decodificato; i campioni vanno
+    #elaborati in ordine di arrivo perché le feature ritardate dipendono dai precedenti
+    def process_sample(self, data):
+        trace = get_trace(data)
+        trace.setdefault('dequeued_at', time.time())
+        self.last_sensor_data = data['data']
+        now = time.time()
+        self.exceedance_counters['silica'].add(now, data['data'].get('% Silica Concentrate'), self.settings['threshold'])
+        self.value_indexes['silica'].add(now, data['data'].get('% Silica Concentrate'))
+        
+        if self.predictor:
+            started = time.perf_counter()
+            #feature ritardate aggiornate in memoria, senza rileggere lo storico
+            sensor_data = self.predictor.update_streaming_features(data['data'])
+            #si pubblica il campione arricchito: i worker web non hanno lo stato streaming
+            self.last_sensor_data = sensor_data
+            self.predictor.update_drift(sensor_data)
+            self.check_drift_retrain()
+            current_threshold = self.settings['threshold']
+            #stima puntuale e probabilità di superamento soglia nello stesso passaggio sugli alberi
+            interval = self.predictor.predict_interval(sensor_data, threshold=current_threshold)
+            prediction = interval['prediction']
+            exceedance_probability = interval.get('exceedance_probability')
+            
+            #il campione etichettato alimenta il prossimo update incrementale
+            self.predictor.add_training_sample(sensor_data)
+            INGEST_STAGE_SECONDS.observe(time.perf_counter() - started, stage='predict')
+            mark(trace, 'predicted')
+            
+            if prediction and prediction > current_threshold:
+                print(f"ALLERTA: Predizione Silica = {prediction:.2f}% (soglia:{current_threshold}%, "
+                      f"probabilità superamento {exceedance_probability:.0%})")
+            #la macchina a stati decide se e quando notificare
+            if prediction is not None:
+                self.exceedance_counters['prediction'].add(now, prediction, current_threshold)
+                self.value_indexes['prediction'].add(now, prediction)
+                with INGEST_STAGE_SECONDS.time(stage='alert'):
+                    self.alert_manager.observe('silica_prediction', prediction, current_threshold, {
+                        'sensor_data': sensor_data,
+                        'exceedance_probability': exceedance_probability,
+                        'trace': trace
+                    })
+        self.state_dirty = True
+    
+    #controlla periodicamente la deriva e, se abilitato, riaddestra il modello in background
+    def check_drift_retrain(self):
+        model_settings = self.settings.get('model', {})
+        if not model_settings.get('drift_auto_retrain', False):
+            return
+        self.drift_samples_since_check += 1
+        if self.drift_samples_since_check < model_settings.get('drift_check_interval_samples', 180):
+            return
+        self.drift_samples_since_check = 0
+        
+        if self.drift_retrain_thread is not None and self.drift_retrain_thread.is_alive():
+            return
+        cooldown = model_settings.get('drift_retrain_cooldown_seconds', 21600)
+        if self.last_drift_retrain and (datetime.now() - self.last_drift_retrain).total_seconds() < cooldown:
+            return
+        
+        report = self.predictor.get_drift_report(model_settings.get('drift_psi_threshold', 0.25),
+                                                 model_settings.get('drift_min_features', 3))
+        if not report['retrain_recommended']:
+            return
+        
+        longest = report['windows'][max(report['windows'], key=int)]
+        print(f"DERIVA DATI: {len(longest['drifted_features'])} feature oltre soglia PSI, avvio riaddestramento")
+        self.last_drift_retrain = datetime.now()
+        
+        #lo storico CSV non contiene la deriva: si addestra anche sui campioni etichettati recenti
+        def run_retrain():
+            try:
+                self.predictor.train_model(include_recent=True)
+            except Exception as e:
+                print(f"Errore riaddestramento per deriva: {e}")
+        
+        self.drift_retrain_thread = threading.Thread(target=run_retrain, daemon=True)
+        self.drift_retrain_thread.start()
+    
     def save_to_firestore(self, data):
         try:
+            from google.cloud import firestore
             doc_ref = self.db.collection('mining_data').document()
             doc_data = {
                 'timestamp': data['timestamp'],
@@ -234,25 +716,130 @@ class MiningServer:
                 'created_at': firestore.SERVER_TIMESTAMP
             }
             doc_ref.set(doc_data)
+            return True
         except Exception as e:
+            INGEST_ERRORS.inc(stage='persist')
             print(f"Errore salvataggio Firestore: {e}")
+            return False
     
-    def send_alert_email(self, prediction, sensor_data):
-        if not self.email_notifier:
+    #notifica immediata decisa dall'alert manager
+    def notify_alert(self, condition, value, context):
+        email_enabled = bool(self.email_notifier and self.settings['email']['enabled'])
+        self.history.record('alert', 'notified' if email_enabled else 'email_disabled',
+                            f"Silica {value:.2f}% > {context.get('threshold')}%",
+                            self.get_alert_recipients() if email_enabled else (), {
+                                'condition': condition,
+                                'value': value,
+                                'threshold': context.get('threshold'),
+                                'reminder': context.get('reminder', False),
+                                'exceedance_probability': context.get('exceedance_probability')
+                            })
+        if email_enabled:
+            self.send_alert_email(value, context.get('sensor_data', {}), context.get('exceedance_probability'))
+        if context.get('trace') is not None:
+            mark(context['trace'], 'alerted')
+    
+    #riepilogo di fine finestra (frequenza hourly/daily)
+    def notify_alert_digest(self, summary):
+        email_enabled = bool(self.email_notifier and self.settings['email']['enabled'])
+        self.history.record('digest', 'notified' if email_enabled else 'email_disabled',
+                            f"{summary['exceedances']} superamenti", 
+                            self.get_alert_recipients() if email_enabled else (), dict(summary))
+        if not email_enabled:
             return
-        
-        #destinatari 
+        summary = dict(summary, frequency=self.settings['email'].get('frequency'))
+        print(f"Riepilogo allerte: {summary['exceedances']} superamenti, {summary['episodes']} episodi")
+        self.email_notifier.send_alert_digest(self.get_alert_recipients(), summary)
+    
+    #destinatari configurati, altrimenti le email degli utenti
+    def get_alert_recipients(self):
         email_recipients = self.settings['email'].get('recipients', [])
         if not email_recipients:
             email_recipients = [user_data.get('email') for user_data in self.users_db.values() if user_data.get('email')]
+        return email_recipients
+    
+    def send_alert_email(self, prediction, sensor_data, exceedance_probability=None):
+        if not self.email_notifier:
+            return
+        
+        #destinatari 
+        email_recipients = self.get_alert_recipients()
         
         current_threshold = self.settings['threshold']
         subject = f"ALLERTA MINING: Silica sopra soglia ({prediction:.2f}%)"
         
-        self.email_notifier.send_alert_email(email_recipients, prediction, current_threshold, sensor_data)
+        self.email_notifier.send_alert_email(email_recipients, prediction, current_threshold, sensor_data,
+                                             exceedance_probability=exceedance_probability)
+    
+    #ricerca iperparametri in un thread; False se è già in corso
+    def start_hyperparameter_search(self, search_args):
+        if self.search_thread is not None and self.search_thread.is_alive():
+            return False
+        
+        def run_search():
+            self.search_error = None
+            try:
+                self.predictor.search_hyperparameters(**search_args)
+            except Exception as e:
+                self.search_error = str(e)
+                print(f"Errore ricerca iperparametri: {e}")
+            self.state_dirty = True
+        
+        self.search_thread = threading.Thread(target=run_search, daemon=True)
+        self.search_thread.start()
+        self.state_dirty = True
+        return True
+    
+    #stato dei lavori in background: locale o pubblicato dall'ingest
+    def get_jobs(self):
+        if self.role == 'web':
+            return self.shared.get('jobs') or {'search_running': False, 'search_error': None,
+                                               'drift_retraining': False, 'last_drift_retrain': None}
+        return {
+            'search_running': self.search_thread is not None and self.search_thread.is_alive(),
+            'search_error': self.search_error,
+            'drift_retraining': self.drift_retrain_thread is not None and self.drift_retrain_thread.is_alive(),
+            'last_drift_retrain': self.last_drift_retrain.isoformat() if self.last_drift_retrain else None
+        }
+    
+    def get_drift_snapshot(self):
+        if self.role == 'web':
+            return self.shared.get('drift_snapshot')
+        return self.predictor.get_drift_snapshot()
+    
+    #liveness e readiness: pronto quando i sottosistemi richiesti sono avviati
+    def get_readiness(self):
+        subsystems = {name: dict(entry) for name, entry in self.subsystems.items()}
+        for entry in subsystems.values():
+            entry.pop('started_at', None)
+        ready = all(subsystems.get(name, {}).get('state') == 'ready' for name in REQUIRED_SUBSYSTEMS)
+        return {
+            'status': 'ready' if ready else 'starting',
+            'role': self.role,
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'subsystems': subsystems
+        }
     
     def setup_routes(self):
         
+        @self.app.route('/healthz')
+        def healthz():
+            return jsonify({'status': 'ok', 'role': self.role, 'uptime_seconds': round(time.time() - self.started_at, 1)})
+        
+        @self.app.route('/readyz')
+        def readyz():
+            readiness = self.get_readiness()
+            if self.shared is not None:
+                #stato del processo di ingest, dall'ultima pubblicazione
+                readiness['ingest'] = self.shared.get('readiness')
+                readiness['ingest_updated_at'] = self.shared.updated_at('readiness')
+            return jsonify(readiness), 200 if readiness['status'] == 'ready' else 503
+        
+        #formato di esposizione Prometheus, senza login come /healthz
+        @self.app.route('/metrics')
+        def metrics():
+            return Response(render(self.get_metrics()), mimetype='text/plain; version=0.0.4')
+        
         @self.app.route('/')
         def home():
             return render_template('base.html')
@@ -304,6 +891,7 @@ class MiningServer:
         def realtime_chart():
             #grafici in tempo reale
             try:
+                import grafici_mining
                 chart_data = grafici_mining.create_realtime_charts(self.db)
                 return jsonify(chart_data)
             except Exception as e:
@@ -315,6 +903,7 @@ class MiningServer:
         def historical_chart():
             #grafici storici
             try:
+                import grafici_mining
                 chart_data = grafici_mining.create_historical_charts(self.db)
                 return jsonify(chart_data)
             except Exception as e:
@@ -326,6 +915,7 @@ class MiningServer:
         def prediction_chart():
             #grafici predizioni
             try:
+                import grafici_mining
                 hours_ahead = request.args.get('hours', 1, type=int)
                 chart_data = grafici_mining.create_prediction_charts(self.db, self.predictor, hours_ahead)
                 return jsonify(chart_data)
@@ -337,6 +927,7 @@ class MiningServer:
         @login_required
         def raw_chart_data():
             try:
+                import grafici_mining
                 chart_data = grafici_mining.get_raw_data_for_charts(self.db)
                 return jsonify(chart_data)
             except Exception as e:
@@ -361,6 +952,9 @@ class MiningServer:
         @login_required
         def model_info():
             try:
+                if self.role == 'web':
+                    #info dal processo di ingest (update incrementali, campioni in attesa)
+                    return jsonify(self.shared.get('model_info') or {'status': 'NOT_AVAILABLE'})
                 if self.predictor:
                     info = self.predictor.get_model_info()
                     return jsonify(info)
@@ -369,6 +963,50 @@ class MiningServer:
             except Exception as e:
                 return jsonify({'error': str(e)}), 500
         
+        @self.app.route('/api/model/drift')
+        @login_required
+        def model_drift():
+            try:
+                if self.predictor:
+                    model_settings = self.settings.get('model', {})
+                    psi_threshold = float(request.args.get('psi_threshold', model_settings.get('drift_psi_threshold', 0.25)))
+                    min_features = int(request.args.get('min_features', model_settings.get('drift_min_features', 3)))
+                    from ml_predictor import drift_report
+                    report = drift_report(self.get_drift_snapshot(), psi_threshold, min_features)
+                    jobs = self.get_jobs()
+                    report['auto_retrain'] = model_settings.get('drift_auto_retrain', False)
+                    report['last_retrain'] = jobs['last_drift_retrain']
+                    report['retraining'] = jobs['drift_retraining']
+                    return jsonify(report)
+                else:
+                    return jsonify({'status': 'NOT_AVAILABLE'}), 500
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
+        
+        @self.app.route('/api/model/whatif', methods=['POST'])
+        @login_required
+        def model_whatif():
+            #simulazione dei setpoint partendo dallo stato attuale dell'impianto (o da quello passato)
+            if not self.predictor:
+                return jsonify({'error': 'Predictor non disponibile'}), 500
+            
+            data = request.get_json(silent=True) or {}
+            state = dict(self.last_sensor_data or {})
+            state.update(data.get('state', {}))
+            if not state:
+                return jsonify({'error': 'Nessuno stato corrente disponibile: indicare state'}), 400
+            
+            try:
+                result = self.predictor.sweep_setpoints(state, data.get('parameters', []),
+                                                        top_k=int(data.get('top_k', 5)),
+                                                        steady_state=bool(data.get('steady_state', True)))
+                result['threshold'] = self.settings['threshold']
+                return jsonify(result)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
+        
         @self.app.route('/api/settings/threshold', methods=['GET', 'POST'])
         @login_required
         def threshold_settings():
@@ -419,6 +1057,15 @@ class MiningServer:
                     'recipients': [r.strip() for r in data.get('recipients', '').split(',') if r.strip()],
                     'frequency': data.get('frequency', 'immediate')
                 }
+                if email_config['frequency'] not in ('immediate', 'hourly', 'daily'):
+                    return jsonify({'success': False, 'error': 'Frequenza non valida'}), 400
+                
+                #cambiando frequenza si invia subito quanto accumulato finora
+                if email_config['frequency'] != self.settings['email'].get('frequency'):
+                    if self.alert_manager:
+                        self.alert_manager.flush_digests(force=True)
+                    else:
+                        self.shared.send_command('flush_digests', requested_by=current_user.username)
                 
                 self.settings['email'] = email_config
                 self.settings['last_update'] = datetime.now().isoformat()
@@ -433,6 +1080,28 @@ class MiningServer:
             except Exception as e:
                 return jsonify({'success': False, 'error': str(e)})
         
+        @self.app.route('/api/alerts/status', methods=['GET'])
+        @login_required
+        def alert_status():
+            if self.alert_manager:
+                status = self.alert_manager.get_status()
+            else:
+                status = self.shared.get('alerts_status') or {'conditions': {}}
+            status['frequency'] = self.settings['email'].get('frequency', 'immediate')
+            status['settings'] = dict(DEFAULT_ALERT_SETTINGS, **self.settings.get('alerts', {}))
+            return jsonify(status)
+        
+        @self.app.route('/api/ingest/latency', methods=['GET'])
+        @login_required
+        def ingest_latency():
+            #percentili di latenza per fase e rispetto dell'obiettivo (settings['latency_slo'])
+            if self.role == 'web':
+                summary = self.shared.get('latency') or LatencyTracker().summary(self.settings.get('latency_slo'))
+                summary['updated_at'] = self.shared.updated_at('latency')
+            else:
+                summary = self.latency.summary(self.settings.get('latency_slo'))
+            return jsonify(summary)
+        
         @self.app.route('/api/settings/current', methods=['GET'])
         @login_required
         def get_current_settings():
@@ -451,52 +1120,42 @@ class MiningServer:
         def threshold_preview():
             try:
                 threshold = float(request.args.get('threshold', 4.0))
+                series = request.args.get('series', 'silica')
+                window = request.args.get('window')
+                if series not in self.value_indexes:
+                    return jsonify({'success': False, 'error': f'Serie non valida: {series}'}), 400
+                index = self.value_indexes[series]
+                if window and window not in index.windows:
+                    return jsonify({'success': False, 'error': f'Finestra non valida: {window}'}), 400
                 
-                # Ottieni dati recenti per calcolare impatto
-                if not self.db:
-                    return jsonify({
-                        'threshold': threshold,
-                        'affected_samples': 0,
-                        'total_samples': 0,
-                        'percentage': 0,
-                        'success': True,
-                        'warning': 'Database non disponibile'
-                    })
+                #conteggi dall'istogramma incrementale: nessuna lettura da Firestore
+                now = time.time()
+                affected_samples, total_samples = index.count_above(threshold, window or None, now=now)
+                windows = {}
+                for name in index.windows:
+                    above, total = index.count_above(threshold, name, now=now)
+                    windows[name] = {
+                        'affected_samples': above,
+                        'total_samples': total,
+                        'percentage': round(above / total * 100, 1) if total else 0
+                    }
                 
-                try:
-                    import grafici_mining
-                    df = grafici_mining.get_data_from_firestore(self.db, limit=100)
-                    
-                    if df is not None and '% Silica Concentrate' in df.columns:
-                        affected_samples = int((df['% Silica Concentrate'] > threshold).sum())
-                        total_samples = len(df)
-                        percentage = (affected_samples / total_samples * 100) if total_samples > 0 else 0
-                        
-                        return jsonify({
-                            'threshold': threshold,
-                            'affected_samples': affected_samples,
-                            'total_samples': total_samples,
-                            'percentage': round(percentage, 1),
-                            'success': True
-                        })
-                    else:
-                        return jsonify({
-                            'threshold': threshold,
-                            'affected_samples': 0,
-                            'total_samples': 0,
-                            'percentage': 0,
-                            'success': True,
-                            'warning': 'Nessun dato disponibile per preview'
-                        })
-                except Exception as e:
-                    return jsonify({
-                        'threshold': threshold,
-                        'affected_samples': 0,
-                        'total_samples': 0,
-                        'percentage': 0,
-                        'success': True,
-                        'warning': f'Errore nel calcolo preview: {str(e)}'
-                    })
+                result = {
+                    'threshold': threshold,
+                    'series': series,
+                    'window': window,
+                    'affected_samples': affected_samples,
+                    'total_samples': total_samples,
+                    'percentage': round(affected_samples / total_samples * 100, 1) if total_samples else 0,
+                    'windows': windows,
+                    'success': True
+                }
+                if not window:
+                    #lo storico completo parte dal campione più vecchio caricato o ricevuto
+                    result['since'] = index.all_since
+                if not total_samples:
+                    result['warning'] = 'Nessun dato disponibile per preview'
+                return jsonify(result)
                     
             except Exception as e:
                 return jsonify({'success': False, 'error': str(e)})
@@ -504,74 +1163,46 @@ class MiningServer:
         @self.app.route('/api/settings/statistics', methods=['GET'])
         @login_required
         def get_alert_statistics():
-            #statistiche allerte
+            #statistiche allerte dai contatori aggiornati in ingest (nessuna lettura da Firestore)
             try:
-                if not self.db:
-                    return jsonify({
-                        'recent_alerts': 0,
-                        'alerts_today': 0,
-                        'alerts_week': 0,
-                        'avg_silica': 0,
-                        'total_samples': 0,
-                        'alert_percentage': 0,
-                        'success': True,
-                        'warning': 'Database non disponibile'
-                    })
+                counters = self.exceedance_counters[request.args.get('series', 'silica')]
+                now = datetime.now()
+                midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+                end = now.timestamp()
                 
-                try:
-                    import grafici_mining
-                    df = grafici_mining.get_data_from_firestore(self.db, limit=1000)
-                    
-                    if df is None or df.empty:
-                        return jsonify({
-                            'recent_alerts': 0,
-                            'alerts_today': 0,
-                            'alerts_week': 0,
-                            'avg_silica': 0,
-                            'total_samples': 0,
-                            'alert_percentage': 0,
-                            'success': True,
-                            'warning': 'Nessun dato disponibile'
-                        })
-                    
-                    current_threshold = self.settings.get('threshold', 4.0)
-                    
-                    #calcolo statistiche
-                    total_samples = len(df)
-                    total_alerts = int((df['% Silica Concentrate'] > current_threshold).sum())
-                    alert_percentage = (total_alerts / total_samples * 100) if total_samples > 0 else 0
-                    avg_silica = float(df['% Silica Concentrate'].mean())
-                    
-                    alerts_today = min(total_alerts, max(0, int(total_alerts * 0.1)))  
-                    alerts_week = min(total_alerts, max(alerts_today, int(total_alerts * 0.3)))  
-                    
-                    #allerte recenti (ultimi 100 campioni)
-                    recent_df = df.tail(100)
-                    recent_alerts = int((recent_df['% Silica Concentrate'] > current_threshold).sum())
-                    
-                    return jsonify({
-                        'recent_alerts': recent_alerts,
-                        'alerts_today': alerts_today,
-                        'alerts_week': alerts_week,
-                        'avg_silica': round(avg_silica, 2),
-                        'total_samples': total_samples,
-                        'alert_percentage': round(alert_percentage, 1),
-                        'current_threshold': current_threshold,
-                        'success': True
-                    })
-                    
-                except Exception as e:
-                    return jsonify({
-                        'recent_alerts': 0,
-                        'alerts_today': 0,
-                        'alerts_week': 0,
-                        'avg_silica': 0,
-                        'total_samples': 0,
-                        'alert_percentage': 0,
-                        'success': True,
-                        'error': f'Errore nel calcolo statistiche: {str(e)}'
-                    })
-                    
+                today = counters.window(midnight.timestamp(), end)
+                #settimana corrente, da lunedì a mezzanotte
+                week = counters.window((midnight - timedelta(days=now.weekday())).timestamp(), end)
+                recent_alerts, recent_samples = counters.recent_exceedances()
+                
+                result = {
+                    'recent_alerts': recent_alerts,
+                    'recent_samples': recent_samples,
+                    'alerts_today': today['exceedances'],
+                    'alerts_week': week['exceedances'],
+                    'samples_today': today['samples'],
+                    'samples_week': week['samples'],
+                    'avg_silica': round(counters.value_sum / counters.total_samples, 2) if counters.total_samples else 0,
+                    'total_samples': counters.total_samples,
+                    'alert_percentage': round(counters.total_exceedances / counters.total_samples * 100, 1) if counters.total_samples else 0,
+                    'current_threshold': self.settings.get('threshold', 4.0),
+                    'success': True
+                }
+                
+                #finestra arbitraria (timestamp unix o ISO)
+                if request.args.get('since'):
+                    since = request.args['since']
+                    until = request.args.get('until')
+                    since_ts = float(since) if since.replace('.', '', 1).isdigit() else datetime.fromisoformat(since).timestamp()
+                    until_ts = end if not until else (float(until) if until.replace('.', '', 1).isdigit() else datetime.fromisoformat(until).timestamp())
+                    result['window'] = dict(counters.window(since_ts, until_ts), since=since_ts, until=until_ts)
+                
+                if not counters.total_samples:
+                    result['warning'] = 'Nessun dato ricevuto'
+                return jsonify(result)
+                
+            except KeyError:
+                return jsonify({'success': False, 'error': 'Serie sconosciuta'}), 400
             except Exception as e:
                 return jsonify({'success': False, 'error': str(e)})
         
@@ -593,6 +1224,15 @@ class MiningServer:
             if current_user.username != 'admin':
                 return jsonify({'error': 'Accesso negato'}), 403
             
+            if self.role == 'web':
+                #l'addestramento gira nel processo di ingest, non in un worker HTTP
+                command_id = self.shared.send_command('retrain', requested_by=current_user.username)
+                return jsonify({
+                    'success': True,
+                    'message': 'Riaddestramento avviato',
+                    'command_id': command_id
+                }), 202
+            
             try:
                 if self.predictor:
                     success = self.predictor.train_model()
@@ -610,6 +1250,125 @@ class MiningServer:
             except Exception as e:
                 return jsonify({'error': str(e)}), 500
 
+        @self.app.route('/api/admin/model/versions', methods=['GET'])
+        @login_required
+        def model_versions():
+            if current_user.username != 'admin':
+                return jsonify({'error': 'Accesso negato'}), 403
+
+            if not self.predictor:
+                return jsonify({'error': 'Predictor non disponibile'}), 500
+            registry = self.predictor.registry
+            return jsonify({
+                'success': True,
+                'current_version': registry.current_version(),
+                'versions': [registry.load_manifest(v) for v in registry.list_versions()]
+            })
+
+        @self.app.route('/api/admin/model/rollback', methods=['POST'])
+        @login_required
+        def rollback_model():
+            if current_user.username != 'admin':
+                return jsonify({'error': 'Accesso negato'}), 403
+
+            try:
+                if self.predictor:
+                    version = self.predictor.rollback_model()
+                    return jsonify({
+                        'success': True,
+                        'message': f'Modello riportato alla versione {version}',
+                        'model_info': self.predictor.get_model_info()
+                    })
+                else:
+                    return jsonify({'error': 'Predictor non disponibile'}), 500
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
+
+        @self.app.route('/api/admin/model/search', methods=['GET', 'POST'])
+        @login_required
+        def model_search():
+            if current_user.username != 'admin':
+                return jsonify({'error': 'Accesso negato'}), 403
+
+            if not self.predictor:
+                return jsonify({'error': 'Predictor non disponibile'}), 500
+
+            if request.method == 'GET':
+                jobs = self.get_jobs()
+                return jsonify({
+                    'success': True,
+                    'running': jobs['search_running'],
+                    'last_error': jobs['search_error'],
+                    'leaderboard': self.predictor.get_search_leaderboard()
+                })
+
+            if self.get_jobs()['search_running']:
+                return jsonify({'success': False, 'error': 'Ricerca iperparametri già in corso'}), 409
+
+            data = request.get_json(silent=True) or {}
+            model_settings = self.settings.get('model', {})
+            search_args = {
+                'search_space': data.get('search_space', model_settings.get('search_space')),
+                'time_budget': float(data.get('time_budget', model_settings.get('search_time_budget', 600))),
+                'n_configs': int(data.get('n_configs', 27))
+            }
+
+            if self.role == 'web':
+                command_id = self.shared.send_command('search', search_args, requested_by=current_user.username)
+                return jsonify({
+                    'success': True,
+                    'message': f"Ricerca iperparametri avviata (budget {search_args['time_budget']:.0f} s)",
+                    'command_id': command_id
+                }), 202
+
+            self.start_hyperparameter_search(search_args)
+            return jsonify({
+                'success': True,
+                'message': f"Ricerca iperparametri avviata (budget {search_args['time_budget']:.0f} s)"
+            })
+
+        @self.app.route('/api/admin/model/importance', methods=['POST'])
+        @login_required
+        def model_importance():
+            #ricalcolo dell'importanza delle feature, sul test set del training o sui dati recenti
+            if current_user.username != 'admin':
+                return jsonify({'error': 'Accesso negato'}), 403
+
+            if not self.predictor:
+                return jsonify({'error': 'Predictor non disponibile'}), 500
+
+            data = request.get_json(silent=True) or {}
+            source = data.get('source', 'recent')
+            if source not in ('training', 'recent'):
+                return jsonify({'error': f'Sorgente sconosciuta: {source}'}), 400
+            if self.role == 'web':
+                #i campioni recenti sono nel processo di ingest
+                command_id = self.shared.send_command('importance', {
+                    'source': source,
+                    'n_repeats': int(data.get('n_repeats', 5)),
+                    'max_samples': int(data.get('max_samples', 5000))
+                }, requested_by=current_user.username)
+                return jsonify({'success': True, 'message': f'Calcolo importanza feature ({source}) avviato',
+                                'command_id': command_id}), 202
+            started = self.predictor.start_feature_importance(source, n_repeats=int(data.get('n_repeats', 5)),
+                                                              max_samples=int(data.get('max_samples', 5000)))
+            if not started:
+                return jsonify({'success': False, 'error': 'Calcolo importanza già in corso'}), 409
+            return jsonify({'success': True, 'message': f'Calcolo importanza feature ({source}) avviato'})
+
+        @self.app.route('/api/admin/commands/<int:command_id>', methods=['GET'])
+        @login_required
+        def command_status(command_id):
+            #esito delle operazioni inoltrate al processo di ingest
+            if current_user.username != 'admin':
+                return jsonify({'error': 'Accesso negato'}), 403
+            if self.shared is None:
+                return jsonify({'error': 'Comandi disponibili solo con ingest separato'}), 404
+            command = self.shared.get_command(command_id)
+            if command is None:
+                return jsonify({'error': 'Comando inesistente'}), 404
+            return jsonify(dict(command, success=True))
+
         @self.app.route('/api/settings/test-email', methods=['POST'])
         @login_required
         def test_email():
@@ -624,28 +1383,17 @@ class MiningServer:
                 if not self.email_notifier:
                     return jsonify({'success': False, 'error': 'Servizio email non configurato'})
                 
-                # Invia email di test
-                subject = "Test Email - Sistema Mining"
-                message = f"""
-                <h2>Email di Test - Sistema Mining</h2>
-                <p>Questo è un messaggio di test per verificare che le notifiche email funzionino correttamente.</p>
-                <p><strong>Timestamp:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                <p><strong>Utente:</strong> {current_user.username}</p>
-                <p>Se ricevi questo messaggio, la configurazione email è corretta.</p>
-                <hr>
-                <small>Sistema di Monitoraggio Mining - Test Automatico</small>
-                """
-                
-                sent_count = 0
-                for recipient in recipients:
-                    if self.email_notifier.send_email(recipient, subject, message, is_html=True):
-                        sent_count += 1
+                if isinstance(recipients, str):
+                    recipients = [r.strip() for r in recipients.split(',') if r.strip()]
+                
+                #un solo messaggio per tutti i destinatari, con il template del notifier
+                sent_count = self.email_notifier.send_test_email(recipients, current_user.username)
                 
                 return jsonify({
                     'success': True,
                     'sent_count': sent_count,
                     'total_recipients': len(recipients),
-                    'message': f'Email di test inviata a {sent_count}/{len(recipients)} destinatari'
+                    'message': f'Email di test accodata per {sent_count}/{len(recipients)} destinatari'
                 })
                 
             except Exception as e:
@@ -677,94 +1425,20 @@ class MiningServer:
                 if not self.settings['email'].get('enabled', False):
                     return jsonify({'success': False, 'error': 'Notifiche email disabilitate'})
                 
-                #messaggio email
-                subject = f"🚨 ALLERTA PREDIZIONI: {alerts_count} allerte nel {prediction_period}"
-                
-                html_message = f"""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <style>
-                        body {{ font-family: Arial, sans-serif; }}
-                        .alert {{ background-color: #fff3cd; border: 1px solid #ffeaa7; 
-                                  padding: 20px; border-radius: 5px; border-left: 4px solid #ffc107; }}
-                        .header {{ color: #856404; font-size: 24px; font-weight: bold; }}
-                        .critical {{ color: #dc3545; font-weight: bold; }}
-                        .stats {{ background-color: #f8f9fa; padding: 15px; border-radius: 3px; margin: 10px 0; }}
-                        .footer {{ margin-top: 20px; padding-top: 15px; border-top: 1px solid #ddd; 
-                                   font-size: 12px; color: #666; }}
-                    </style>
-                </head>
-                <body>
-                    <div class="alert">
-                        <div class="header">⚠️ ALLERTA PREDIZIONI MINING</div>
-                        <p><strong>Timestamp:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                        <p class="critical">Nel {prediction_period} sono previste <strong>{alerts_count} allerte</strong> per percentuale silica superiore alla soglia di <strong>{threshold}%</strong></p>
-                        
-                        <div class="stats">
-                            <h4>Dettagli Predizioni:</h4>
-                            <ul>
-                                <li><strong>Massimo predetto:</strong> {max_prediction:.2f}% Silica</li>
-                                <li><strong>Media predetta:</strong> {avg_prediction:.2f}% Silica</li>
-                                <li><strong>Orizzonte temporale:</strong> {prediction_horizon}</li>
-                                <li><strong>Soglia configurata:</strong> {threshold}%</li>
-                                <li><strong>Allerte previste:</strong> {alerts_count}</li>
-                            </ul>
-                        </div>
-                        
-                        <p><strong>🎯 Azione raccomandata:</strong> Monitorare attentamente il processo nelle prossime ore e verificare i parametri di flotazione se necessario.</p>
-                        
-                        <div class="footer">
-                            <p>Notifica generata automaticamente dal Sistema di Monitoraggio Mining<br>
-                            Utente: <strong>{current_user.username}</strong> | 
-                            Sistema: <strong>Predizioni ML</strong></p>
-                        </div>
-                    </div>
-                </body>
-                </html>
-                """
-                
-                text_message = f"""
-                ALLERTA PREDIZIONI MINING
-                ========================
-                
-                Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-                
-                Nel {prediction_period} sono previste {alerts_count} allerte
-                per percentuale silica superiore alla soglia di {threshold}%
-                
-                DETTAGLI PREDIZIONI:
-                - Massimo predetto: {max_prediction:.2f}% Silica
-                - Media predetta: {avg_prediction:.2f}% Silica
-                - Orizzonte temporale: {prediction_horizon}
-                - Soglia configurata: {threshold}%
-                - Allerte previste: {alerts_count}
-                
-                AZIONE RACCOMANDATA: 
-                Monitorare attentamente il processo nelle prossime ore
-                e verificare i parametri di flotazione se necessario.
-                
-                Sistema di Monitoraggio Mining
-                Utente: {current_user.username}
-                """
-                
-                #invia email
-                sent_count = 0
                 if isinstance(email_recipients, str):
                     email_recipients = [r.strip() for r in email_recipients.split(',') if r.strip()]
                 
-                for recipient in email_recipients:
-                    if recipient:
-                        if self.email_notifier.send_email(recipient, subject, html_message, is_html=True):
-                            sent_count += 1
-                        elif self.email_notifier.send_email(recipient, subject, text_message, is_html=False):
-                            sent_count += 1
+                #un solo messaggio multipart per tutti i destinatari
+                sent_count = self.email_notifier.send_prediction_alert(
+                    email_recipients, prediction_period, alerts_count, threshold,
+                    max_prediction=max_prediction, avg_prediction=avg_prediction,
+                    prediction_horizon=prediction_horizon, requested_by=current_user.username)
                 
                 return jsonify({
                     'success': True,
                     'recipients_count': sent_count,
                     'total_recipients': len(email_recipients),
-                    'message': f'Notifica allerta inviata a {sent_count} destinatari',
+                    'message': f'Notifica allerta accodata per {sent_count} destinatari',
                     'alerts_count': alerts_count,
                     'prediction_period': prediction_period
                 })
@@ -790,6 +1464,57 @@ class MiningServer:
             except Exception as e:
                 return jsonify({'success': False, 'error': str(e)})
 
+        @self.app.route('/api/admin/profiling', methods=['GET', 'POST'])
+        @login_required
+        def profiling_settings():
+            if current_user.username != 'admin':
+                return jsonify({'error': 'Accesso negato'}), 403
+            
+            if request.method == 'POST':
+                try:
+                    data = request.get_json() or {}
+                    profiling = dict(DEFAULT_PROFILING_SETTINGS, **self.settings.get('profiling', {}))
+                    if 'sample_rate' in data:
+                        profiling['sample_rate'] = float(data['sample_rate'])
+                    if 'slow_request_seconds' in data:
+                        profiling['slow_request_seconds'] = float(data['slow_request_seconds'])
+                    if not 0 <= profiling['sample_rate'] <= 1:
+                        return jsonify({'success': False, 'error': 'sample_rate deve essere tra 0 e 1'}), 400
+                    if profiling['slow_request_seconds'] < 0:
+                        return jsonify({'success': False, 'error': 'slow_request_seconds non può essere negativo'}), 400
+                    self.settings['profiling'] = profiling
+                    self.save_settings()
+                except (TypeError, ValueError) as e:
+                    return jsonify({'success': False, 'error': str(e)}), 400
+            
+            return jsonify({'success': True, 'profiling': dict(DEFAULT_PROFILING_SETTINGS, **self.settings.get('profiling', {}))})
+        
+        @self.app.route('/api/admin/profiles', methods=['GET'])
+        @login_required
+        def list_profiles():
+            if current_user.username != 'admin':
+                return jsonify({'error': 'Accesso negato'}), 403
+            try:
+                limit = int(request.args.get('limit', 50))
+            except ValueError:
+                return jsonify({'success': False, 'error': 'limit non valido'}), 400
+            return jsonify({'success': True, 'profiles': self.profiler.list_profiles(limit, request.args.get('path'))})
+        
+        @self.app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+        @login_required
+        def download_profile(profile_id):
+            #.prof (pstats, apribile con snakeviz) o stack "collapsed" per flamegraph;
+            #?format=text restituisce il report cProfile leggibile
+            if current_user.username != 'admin':
+                return jsonify({'error': 'Accesso negato'}), 403
+            profile = self.profiler.get_profile(profile_id)
+            if profile is None:
+                return jsonify({'error': 'Profilo inesistente'}), 404
+            file_path, metadata = profile
+            if request.args.get('format') == 'text' and metadata['kind'] == 'cprofile':
+                return Response(self.profiler.text_report(file_path), mimetype='text/plain')
+            return send_file(os.path.abspath(file_path), as_attachment=True, download_name=os.path.basename(file_path))
+        
         @self.app.route('/api/admin/email-history', methods=['GET'])
         @login_required
         def get_email_history():
@@ -797,19 +1522,18 @@ class MiningServer:
                 return jsonify({'error': 'Accesso negato'}), 403
             
             try:
-                
-                return jsonify({
-                    'success': True,
-                    'history': [
-                        {
-                            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                            'type': 'prediction_alert',
-                            'recipients': len(self.settings['email'].get('recipients', [])),
-                            'status': 'example_data'
-                        }
-                    ],
-                    'message': 'Funzionalità storico email da implementare con database persistente'
-                })
+                #filtri opzionali e paginazione con cursore (id dell'ultimo elemento della pagina)
+                result = self.history.query(
+                    event_type=request.args.get('type'),
+                    status=request.args.get('status'),
+                    recipient=request.args.get('recipient'),
+                    since=request.args.get('since'),
+                    until=request.args.get('until'),
+                    before_id=request.args.get('cursor'),
+                    limit=request.args.get('limit', 50))
+                result['success'] = True
+                result['writer'] = self.history.get_statistics()
+                return jsonify(result)
                 
             except Exception as e:
                 return jsonify({'success': False, 'error': str(e)})
@@ -821,6 +1545,30 @@ class MiningServer:
         print(f"Email notifiche: {'abilitato' if self.settings['email']['enabled'] else 'disabilitato'}")
         self.app.run(host=host, port=port, debug=debug, use_reloader=False)
 
+    #processo di ingest: nessun server HTTP, resta attivo finché gira il loop MQTT
+    def run_ingest(self):
+        print("Processo di ingest avviato: MQTT, persistenza, inferenza e allerte")
+        print(f"Soglia allerta attuale: {self.settings['threshold']}%")
+        try:
+            self.init_thread.join()
+            while self.mqtt_thread is not None and self.mqtt_thread.is_alive():
+                self.mqtt_thread.join(1)
+        except KeyboardInterrupt:
+            pass
+
+#app factory per gunicorn: i worker servono solo HTTP, l'ingest gira in un processo separato
+#   gunicorn -c gunicorn.conf.py "main:create_app()"
+def create_app(role='web'):
+    return MiningServer(role=role).app
+
 if __name__ == '__main__':
-    server = MiningServer()
-    server.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Mining Monitor server')
+    parser.add_argument('--role', choices=ROLES, default=os.getenv('MINING_ROLE', 'all'),
+                        help="all: tutto in un processo; ingest: MQTT, inferenza e allerte senza HTTP")
+    args = parser.parse_args()
+    
+    server = MiningServer(role=args.role)
+    if args.role == 'ingest':
+        server.run_ingest()
+    else:
+        server.run()
\ No newline at end of file
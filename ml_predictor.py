@@ -1,20 +1,75 @@
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
-from sklearn.model_selection import train_test_split, cross_val_score
+from sklearn.model_selection import TimeSeriesSplit, cross_val_score
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
 from sklearn.preprocessing import StandardScaler
 from sklearn.pipeline import Pipeline
 import pickle
 import os
+import copy
+import time
+import threading
+from collections import deque
+from statistics import NormalDist
+from datetime import datetime
+from model_registry import ModelRegistry, compute_file_hash
+from flat_ensemble import FlatEnsemble, FOREST
+from training_cache import TrainingDataCache
+from model_search import DEFAULT_SEARCH_SPACE, build_pipeline, successive_halving
+from feature_engineering import (DEFAULT_FEATURE_CONFIG, StreamingFeatureState,
+                                 compute_feature_frame, engineered_feature_names)
+from drift_monitor import DriftMonitor, PSI_SIGNIFICANT, build_reference_sketches
+from prediction_cache import PredictionCache, DEFAULT_RESOLUTION
+from feature_importance import permutation_importance
+
+#intervallo tra due campioni del dataset (una riga ogni 20 secondi)
+SAMPLE_INTERVAL_SECONDS = 20
+#distanze di predizione valutate nel backtest, in passi: da 20 secondi a 4 ore
+PERFORMANCE_GAPS = [1, 3, 15, 45, 90, 180, 360, 540, 720]
+#orizzonti delle previsioni dirette, in passi: 1, 5, 10, 20, 30 minuti, 1, 2 e 4 ore
+FORECAST_HORIZONS = [3, 15, 30, 60, 90, 180, 360, 720]
+#quota finale dello storico (in ordine temporale) esclusa dal training e usata per test e backtest
+HOLDOUT_FRACTION = 0.2
+#percentili di default per gli intervalli di predizione
+DEFAULT_PERCENTILES = (5, 50, 95)
+#parametri di processo regolabili dagli operatori, usabili nelle simulazioni what-if
+SETPOINT_COLUMNS = [
+    'Starch Flow', 'Amina Flow', 'Ore Pulp Flow', 'Ore Pulp pH', 'Ore Pulp Density',
+    'Flotation Column 01 Air Flow', 'Flotation Column 02 Air Flow',
+    'Flotation Column 03 Air Flow', 'Flotation Column 04 Air Flow',
+    'Flotation Column 05 Air Flow', 'Flotation Column 06 Air Flow',
+    'Flotation Column 07 Air Flow'
+]
+#limite di punti della griglia what-if (una sola inferenza batch)
+MAX_SWEEP_POINTS = 40000
 
 class SilicaPredictor:
     #inizializza silica predictor
-    def __init__(self, data_path="data/mining_data.csv", model_path="models/silica_model.pkl"):
+    def __init__(self, data_path="data/mining_data.csv", model_path="models/silica_model.pkl", db=None,
+                 incremental_batch_size=50, incremental_trees=10, max_estimators=300, max_pending_samples=5000,
+                 registry_path=None, keep_versions=5, use_engineered_features=True, feature_config=None,
+                 cache_dir=None, forecast_horizons=None, drift_windows=None, prediction_cache_size=0,
+                 prediction_cache_ttl=300, prediction_cache_resolution=None, auto_feature_importance=True,
+                 read_only=False):
         self.data_path = data_path
-        self.model_path = model_path
-        self.model = None
-        self.feature_columns = [
+        self.model_path = model_path  #pickle legacy, importato nel registro al primo avvio
+        self.db = db
+        self._model = None
+        self.flat_model = None  #alberi in array mappati, usati per l'inferenza
+        #modello multi-output per le previsioni dirette a più orizzonti
+        self.forecast_horizons = list(forecast_horizons or FORECAST_HORIZONS)
+        self.horizon_model = None
+        self.horizon_metrics = []
+        self.model_name = None
+        self.metrics = {}
+        self.model_version = None
+        self.training_data_hash = None
+        self.training_cache = TrainingDataCache(cache_dir or os.path.join(os.path.dirname(data_path) or ".", "cache"))
+        self.registry = ModelRegistry(registry_path or os.path.join(os.path.dirname(model_path) or ".", "registry"),
+                                      keep_versions=keep_versions)
+        #valori istantanei dei sensori
+        self.base_feature_columns = [
             '% Iron Feed', '% Silica Feed', 'Starch Flow', 'Amina Flow',
             'Ore Pulp Flow', 'Ore Pulp pH', 'Ore Pulp Density',
             'Flotation Column 01 Air Flow', 'Flotation Column 02 Air Flow',
@@ -23,31 +78,157 @@ class SilicaPredictor:
             'Flotation Column 07 Air Flow'
         ]
         self.target_column = '% Silica Concentrate'
+        #cache opzionale delle predizioni (dimensione 0 = disattivata); risoluzione scalare o per colonna
+        self.prediction_cache_resolution = prediction_cache_resolution or DEFAULT_RESOLUTION
+        self.prediction_cache = PredictionCache(prediction_cache_size, prediction_cache_ttl) if prediction_cache_size else None
+        #medie/deviazioni mobili, EWMA e ritardi su flussi d'aria e reagenti
+        self._configure_features(self.base_feature_columns,
+                                 (feature_config or DEFAULT_FEATURE_CONFIG) if use_engineered_features else None)
+
+        #apprendimento incrementale: campioni etichettati arrivati via MQTT in attesa di update
+        self.pending_samples = deque(maxlen=max_pending_samples)
+        #ultimi campioni etichettati, conservati anche dopo l'update (es. per l'importanza sui dati recenti)
+        self.recent_samples = deque(maxlen=max_pending_samples)
+        self.incremental_batch_size = incremental_batch_size
+        self.incremental_trees = incremental_trees
+        self.max_estimators = max_estimators
+        self.incremental_updates = 0
+        self.incremental_samples = 0
+        self.last_incremental_update = None
+        self._update_lock = threading.Lock()
+        self._update_thread = None
+        self._stop_updates = threading.Event()
+
+        #cache dei backtest per versione modello e versione dati
+        self._backtest_cache = {}
+        self._backtest_lock = threading.Lock()
+        self._data_version = None
+
+        #distribuzione di training per feature (bordi dei bin e proporzioni) e monitor di deriva in ingest
+        self.drift_reference = None
+        self.drift_monitor = None
+        self.drift_windows = drift_windows
+
+        #importanza delle feature calcolata in background una volta per versione
+        self.auto_feature_importance = auto_feature_importance
+        self._importance_thread = None
+        self._importance_cache = {}
+        self.importance_error = None
+        
+        #in sola lettura (worker web) si usa la versione attiva senza mai addestrare:
+        #le nuove versioni arrivano dal processo di ingest tramite il registro
+        self.read_only = read_only
         
         #carica o allena modello
-        if os.path.exists(self.model_path):
+        if self.registry.current_version():
             self.load_model()
+        elif read_only:
+            print("Nessun modello nel registro: in attesa della prima versione")
+        elif os.path.exists(self.model_path):
+            self.load_legacy_model()
+            self.save_model()
         else:
             self.train_model()
+        if self.auto_feature_importance and not read_only and self.get_feature_importance() is None:
+            self.start_feature_importance()
+
+    #pipeline sklearn completa: caricata dal registro solo quando serve (update, retrain)
+    @property
+    def model(self):
+        if self._model is None and self.model_version is not None:
+            self._model = self.registry.load_artifact("model", self.model_version)
+        return self._model
+
+    #imposta la pipeline e ricompila la versione appiattita per l'inferenza
+    def _set_model(self, model):
+        self._model = model
+        self.flat_model = FlatEnsemble.from_pipeline(model)
+        self._invalidate_prediction_cache()
 
-    #carica i dati
+    def _invalidate_prediction_cache(self):
+        if self.prediction_cache is not None:
+            self.prediction_cache.clear()
+
+    #colonne usate dal modello: valori istantanei più eventuali feature ritardate
+    def _configure_features(self, base_columns, feature_config):
+        self.base_feature_columns = list(base_columns)
+        self.feature_config = feature_config
+        if feature_config:
+            self.feature_columns = self.base_feature_columns + engineered_feature_names(feature_config)
+            self.feature_state = StreamingFeatureState(feature_config)
+        else:
+            self.feature_columns = list(self.base_feature_columns)
+            self.feature_state = None
+        if self.prediction_cache is not None:
+            self.prediction_cache.set_resolution(self._feature_resolution())
+
+    #risoluzione di ogni colonna del modello; le feature derivate usano quella della colonna di origine
+    def _feature_resolution(self):
+        resolution = self.prediction_cache_resolution
+        if not isinstance(resolution, dict):
+            return float(resolution)
+        values = []
+        for col in self.feature_columns:
+            base = next((b for b in self.base_feature_columns if col == b or col.startswith(b + " ")), col)
+            values.append(resolution.get(col, resolution.get(base, DEFAULT_RESOLUTION)))
+        return np.array(values, dtype=np.float64)
+
+    #chiave di cache: l'intero vettore quantizzato (feature ritardate comprese) e la versione del modello,
+    #così una predizione in cache corrisponde sempre all'input che il modello vedrebbe
+    def _cache_key(self, vector, *extra):
+        return self.prediction_cache.key(vector, self.model_version, *extra)
+
+    def is_ready(self):
+        return self.flat_model is not None or self._model is not None or self.model_version is not None
+
+    #carica i dati: dalla cache preprocessata se valida, altrimenti dal CSV (e aggiorna la cache)
     def load_training_data(self):
         if not os.path.exists(self.data_path):
             raise FileNotFoundError(f"File dati non trovato: {self.data_path}")
-        df = pd.read_csv(self.data_path)
+        columns = self.feature_columns + [self.target_column]
+        df = self.training_cache.load(self.data_path, columns)
+        if df is not None:
+            return df
+
+        df = self._read_training_csv()
+        try:
+            self.training_cache.store(self.data_path, columns, df)
+        except OSError as e:
+            print(f"Impossibile salvare la cache training: {e}")
+        return df[columns].astype(np.float32)
+
+    #lettura completa del CSV, limitata alle sole colonne necessarie
+    def _read_training_csv(self):
+        needed = set(self.base_feature_columns + [self.target_column])
+        df = pd.read_csv(self.data_path, usecols=lambda col: col in needed)
         #controllo delle colonne
-        missing = set(self.feature_columns + [self.target_column]) - set(df.columns)
+        missing = needed - set(df.columns)
         if missing:
             raise ValueError(f"Colonne mancanti nel dataset: {missing}")
+        #feature ritardate calcolate sulla sequenza completa, prima di scartare le righe incomplete
+        if self.feature_config:
+            df = pd.concat([df, compute_feature_frame(df, self.feature_config)], axis=1)
         df = df.dropna(subset=self.feature_columns + [self.target_column])
         return df
 
     #allena i modelli scelti
-    def train_model(self):
+    #con include_recent i campioni etichettati ricevuti in ingest vengono accodati allo storico
+    #(sono i più recenti, quindi finiscono nel tratto di test), es. per il retrain su deriva
+    def train_model(self, include_recent=False):
         df = self.load_training_data()
+        data_hash = self.get_data_version()
+        recent = list(self.recent_samples) if include_recent else []
+        if recent:
+            recent_df = pd.DataFrame([s[0] for s in recent], columns=self.feature_columns, dtype=np.float32)
+            recent_df[self.target_column] = np.array([s[1] for s in recent], dtype=np.float32)
+            df = pd.concat([df, recent_df], ignore_index=True)
+            print(f"Training con {len(recent)} campioni recenti dall'ingest")
         X = df[self.feature_columns]
         y = df[self.target_column]
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        #split temporale: il test set è il tratto finale, mai visto in training
+        holdout_start = self._holdout_start(len(df))
+        X_train, X_test = X.iloc[:holdout_start], X.iloc[holdout_start:]
+        y_train, y_test = y.iloc[:holdout_start], y.iloc[holdout_start:]
 
         models = {
             'RandomForest': Pipeline([
@@ -62,7 +243,7 @@ class SilicaPredictor:
         best_model, best_name, best_score = None, None, float("-inf")
 
         for name, pipeline in models.items():
-            scores = cross_val_score(pipeline, X_train, y_train, cv=5, scoring="r2", n_jobs=-1)
+            scores = cross_val_score(pipeline, X_train, y_train, cv=TimeSeriesSplit(n_splits=5), scoring="r2", n_jobs=-1)
             mean_score = scores.mean()
             print(f"{name} - CV R²: {mean_score:.4f} ± {scores.std():.4f}")
             if mean_score > best_score:
@@ -71,60 +252,874 @@ class SilicaPredictor:
 
         #fit sul train set
         best_model.fit(X_train, y_train)
-        y_pred = best_model.predict(X_test)
+        metrics = self._test_metrics(best_model, X_test, y_test, holdout_start)
+        metrics["recent_samples"] = len(recent)
+        #stampa modello migliore
+        print(f"\nMiglior modello: {best_name}")
+        print(f"Metriche: {metrics}")
 
-        #calcolo delle metriche
-        metrics = {
+        #sotto lock come gli update incrementali: nessun mini-batch applicato al modello sostituito
+        with self._update_lock:
+            self._set_model(best_model)
+            self.model_name = best_name
+            self.metrics = metrics
+            self.training_data_hash = data_hash
+            self.incremental_updates = 0
+            self.incremental_samples = 0
+            if recent:
+                #già nel training set
+                self.pending_samples.clear()
+            self.train_horizon_model(df)
+            self._build_drift_reference(df)
+            self.save_model()
+        if self.auto_feature_importance:
+            self.start_feature_importance()
+        return True
+
+    #prima riga del tratto finale escluso dal training
+    @staticmethod
+    def _holdout_start(n_samples):
+        return int(n_samples * (1 - HOLDOUT_FRACTION))
+
+    #calcolo delle metriche sul test set (le righe da holdout_start in poi dello storico)
+    def _test_metrics(self, model, X_test, y_test, holdout_start):
+        y_pred = model.predict(X_test)
+        regressor = model.named_steps["regressor"]
+        return {
             "r2": r2_score(y_test, y_pred),
             "mse": mean_squared_error(y_test, y_pred),
             "mae": mean_absolute_error(y_test, y_pred),
-            "rmse": np.sqrt(mean_squared_error(y_test, y_pred))
+            "rmse": np.sqrt(mean_squared_error(y_test, y_pred)),
+            "training_samples": holdout_start,
+            "test_split": "chronological",
+            "holdout_start": holdout_start,
+            "holdout_samples": len(y_test),
+            #alberi/stadi del training completo, mai scartati dagli update incrementali
+            "base_estimators": len(getattr(regressor, "estimators_", [])),
+            "data_source": self.data_path
         }
-        #stampa modello migliore
-        print(f"\nMiglior modello: {best_name}")
-        print(f"Metriche: {metrics}")
 
-        self.model = best_model
-        self.model_name = best_name
-        self.metrics = metrics
-        self.save_model()
-
-    #salva il modello migliore
-    def save_model(self):
-        os.makedirs(os.path.dirname(self.model_path) or ".", exist_ok=True)
-        with open(self.model_path, "wb") as f:
-            pickle.dump({
-                "model": self.model,
-                "model_name": self.model_name,
-                "metrics": self.metrics,
-                "features": self.feature_columns,
-                "target": self.target_column
-            }, f)
+    #ricerca iperparametri con successive halving in un pool di processi, entro un budget di tempo;
+    #il vincitore viene riallenato sul train set completo e pubblicato con la classifica.
+    #il riallenamento è fuori dal budget: la sua durata è riportata in refit_seconds
+    def search_hyperparameters(self, search_space=None, time_budget=600, n_configs=27, eta=3,
+                               min_samples=1000, n_workers=None):
+        df = self.load_training_data()
+        self.training_data_hash = self.get_data_version()
+        X = df[self.feature_columns].to_numpy()
+        y = df[self.target_column].to_numpy()
+        holdout_start = self._holdout_start(len(y))
+        X_train, X_test, y_train, y_test = X[:holdout_start], X[holdout_start:], y[:holdout_start], y[holdout_start:]
+        #validazione interna sul tratto finale del train set, separata dal test set delle metriche finali
+        val_start = self._holdout_start(holdout_start)
+        X_fit, X_val, y_fit, y_val = X_train[:val_start], X_train[val_start:], y_train[:val_start], y_train[val_start:]
+
+        result = successive_halving(X_fit, y_fit, X_val, y_val, search_space=search_space or DEFAULT_SEARCH_SPACE,
+                                    n_configs=n_configs, eta=eta, min_samples=min_samples,
+                                    time_budget=time_budget, n_workers=n_workers)
+        winner = next((e for e in result['leaderboard'] if e['status'] == 'winner'), None)
+        if winner is None:
+            print("Ricerca iperparametri senza risultati entro il budget")
+            return result
+
+        refit_start = time.time()
+        best_model = build_pipeline(winner['candidate'], winner['params'])
+        best_model.fit(X_train, y_train)
+        result['refit_seconds'] = round(time.time() - refit_start, 2)
+        result['total_seconds'] = round(result['elapsed_seconds'] + result['refit_seconds'], 2)
+        metrics = self._test_metrics(best_model, X_test, y_test, holdout_start)
+        metrics["search_params"] = winner['params']
+        print(f"Ricerca iperparametri: vince {winner['candidate']} {winner['params']} - R² test {metrics['r2']:.4f}")
+
+        with self._update_lock:
+            self._set_model(best_model)
+            self.model_name = winner['candidate']
+            self.metrics = metrics
+            if self.horizon_model is None:
+                self.train_horizon_model(df)
+            self._build_drift_reference(df)
+            self.save_model()
+            result['model_version'] = self.model_version
+            self.registry.write_json(self.model_version, "leaderboard.json", result)
+        if self.auto_feature_importance:
+            self.start_feature_importance()
+        return result
+
+    #ultima classifica di ricerca salvata nel registro, se presente
+    def get_search_leaderboard(self):
+        for version in reversed(self.registry.list_versions()):
+            leaderboard = self.registry.read_json(version, "leaderboard.json")
+            if leaderboard is not None:
+                return leaderboard
+        return None
+
+    #previsioni dirette: un'unica foresta multi-output che impara tutti gli orizzonti insieme,
+    #condividendo la costruzione degli alberi (X al tempo t -> silica a t+h per ogni h)
+    def train_horizon_model(self, df=None):
+        df = self.load_training_data() if df is None else df
+        X = df[self.feature_columns].to_numpy(dtype=np.float64)
+        y = df[self.target_column].to_numpy(dtype=np.float64)
+        n = len(y) - max(self.forecast_horizons)
+        if n < 100:
+            print("Dati insufficienti per il modello multi-orizzonte")
+            return False
+        Y = np.column_stack([y[h:h + n] for h in self.forecast_horizons])
+        X = X[:n]
+
+        #split temporale: anche i target del training precedono il tratto escluso dal modello puntuale
+        split = self._holdout_start(len(y)) - max(self.forecast_horizons)
+        if split < 100:
+            print("Dati insufficienti per il modello multi-orizzonte")
+            return False
+        pipeline = Pipeline([
+            ("scaler", StandardScaler()),
+            ("regressor", RandomForestRegressor(n_estimators=100, min_samples_leaf=5, n_jobs=-1, random_state=42))
+        ])
+        pipeline.fit(X[:split], Y[:split])
+        Y_pred = pipeline.predict(X[split:])
+
+        self.horizon_metrics = []
+        for i, h in enumerate(self.forecast_horizons):
+            metrics = self._regression_metrics(Y[split:, i], Y_pred[:, i])
+            metrics.update(horizon_steps=h, horizon_minutes=h * SAMPLE_INTERVAL_SECONDS / 60)
+            self.horizon_metrics.append(metrics)
+        self.horizon_model = FlatEnsemble.from_pipeline(pipeline)
+        print(f"Modello multi-orizzonte allenato su {split} campioni per {len(self.forecast_horizons)} orizzonti")
+        return True
+
+    #tutti gli orizzonti in una sola inferenza batch; con percentiles/threshold aggiunge
+    #intervalli e probabilità di superamento dagli output dei singoli alberi
+    def predict_horizons(self, sensor_data: dict, percentiles=None, threshold=None):
+        if self.horizon_model is None:
+            raise RuntimeError("Modello multi-orizzonte non disponibile")
+        X = np.array([self._feature_vector(sensor_data)])
+        if percentiles is None and threshold is None:
+            values = self.horizon_model.predict(X).reshape(1, -1)[0]
+            return [{
+                "horizon_steps": h,
+                "horizon_minutes": h * SAMPLE_INTERVAL_SECONDS / 60,
+                "predicted_silica": float(value)
+            } for h, value in zip(self.forecast_horizons, values)]
+
+        #forma (n_alberi, n_orizzonti)
+        per_tree = self.horizon_model.predict_per_tree(X)[:, 0, :]
+        summary = self._summarize_tree_outputs(per_tree, self._check_percentiles(percentiles or DEFAULT_PERCENTILES), threshold)
+        return [dict(self._interval_entry(summary, i), horizon_steps=h,
+                     horizon_minutes=h * SAMPLE_INTERVAL_SECONDS / 60,
+                     predicted_silica=float(summary["prediction"][i]))
+                for i, h in enumerate(self.forecast_horizons)]
+
+    #pubblica il modello come nuova versione nel registro (kind "incremental" per gli update sui mini-batch)
+    def save_model(self, kind="full"):
+        #modelli importati senza riferimento (pickle legacy): lo si ricava dai dati di training
+        if self.drift_reference is None and os.path.exists(self.data_path):
+            try:
+                self._build_drift_reference(self.load_training_data())
+            except (OSError, ValueError) as e:
+                print(f"Riferimento per la deriva non disponibile: {e}")
+        arrays = dict(self.flat_model.arrays) if self.flat_model else {}
+        if self.horizon_model is not None:
+            arrays.update({f"horizon_{name}": array for name, array in self.horizon_model.arrays.items()})
+        if self.drift_reference is not None:
+            arrays.update(self.drift_reference)
+        self.model_version = self.registry.publish({"model": self.model}, {
+            "model_name": self.model_name,
+            "kind": kind,
+            "metrics": self.metrics,
+            "features": self.feature_columns,
+            "base_features": self.base_feature_columns,
+            "feature_config": self.feature_config,
+            "target": self.target_column,
+            "training_data_hash": self.training_data_hash,
+            "training_data_path": self.data_path,
+            "flat_model": self.flat_model.meta if self.flat_model else None,
+            "horizon_model": self.horizon_model.meta if self.horizon_model else None,
+            "forecast_horizons": self.forecast_horizons,
+            "horizon_metrics": self.horizon_metrics,
+            "drift_features": self.feature_columns if self.drift_reference is not None else None
+        }, arrays=arrays or None)
         #stampa il modello migliore
-        print(f"Modello salvato in {self.model_path}")
+        print(f"Modello salvato nel registro come {self.model_version}")
+
+    #carica dal registro la versione attiva (o quella richiesta): gli alberi sono array mappati
+    #in sola lettura, la pipeline sklearn completa viene caricata solo se serve
+    def load_model(self, version=None):
+        manifest = self.registry.load_manifest(version)
+        arrays = self.registry.load_arrays(manifest["version"])
+        if manifest.get("flat_model"):
+            self._model = None
+            self.flat_model = FlatEnsemble({name: arrays[name] for name in FlatEnsemble.ARRAY_NAMES},
+                                           manifest["flat_model"])
+            self._invalidate_prediction_cache()
+        else:
+            self._set_model(self.registry.load_artifact("model", manifest["version"]))
+        if manifest.get("horizon_model"):
+            self.horizon_model = FlatEnsemble({k[len("horizon_"):]: v for k, v in arrays.items() if k.startswith("horizon_")},
+                                              manifest["horizon_model"])
+            self.forecast_horizons = manifest["forecast_horizons"]
+            self.horizon_metrics = manifest.get("horizon_metrics", [])
+        else:
+            self.horizon_model = None
+        self.model_name = manifest["model_name"]
+        self.metrics = manifest["metrics"]
+        self._configure_features(manifest.get("base_features", manifest["features"]), manifest.get("feature_config"))
+        self.target_column = manifest["target"]
+        self.training_data_hash = manifest.get("training_data_hash")
+        self.model_version = manifest["version"]
+        self.incremental_updates = self.metrics.get("incremental_updates", 0)
+        self.incremental_samples = self.metrics.get("incremental_samples", 0)
+        if manifest.get("drift_features") and "drift_edges" in arrays:
+            self.drift_reference = {"drift_edges": arrays["drift_edges"], "drift_reference": arrays["drift_reference"]}
+        else:
+            self.drift_reference = None
+        self._reset_drift_monitor()
+        #stampa il modello caricato
+        print(f"Modello caricato: {self.model_name} ({self.model_version})")
 
-    #carica il modello tramite Pickle
-    def load_model(self):
+    #carica il vecchio pickle singolo, per migrarlo nel registro
+    def load_legacy_model(self):
         with open(self.model_path, "rb") as f:
             data = pickle.load(f)
-        self.model = data["model"]
+        self._set_model(data["model"])
         self.model_name = data["model_name"]
         self.metrics = data["metrics"]
-        self.feature_columns = data["features"]
+        self._configure_features(data["features"], None)
         self.target_column = data["target"]
-        #stampa il modello caricato
-        print(f"Modello caricato: {self.model_name}")
+        print(f"Modello legacy caricato da {self.model_path}")
 
-    #avvia il modello selezionato come migliore
-    def predict_silica(self, sensor_data: dict):
-        if self.model is None:
-            raise RuntimeError("Il modello non è caricato o allenato")
+    #ricarica la versione attiva se un altro processo ne ha pubblicata una nuova (o ha fatto rollback)
+    def refresh_model(self):
+        version = self.registry.current_version()
+        if version is None or version == self.model_version:
+            return False
+        with self._update_lock:
+            if version == self.model_version:
+                return False
+            self.load_model(version)
+        return True
+
+    #ripristina istantaneamente la versione precedente del modello
+    def rollback_model(self):
+        with self._update_lock:
+            version = self.registry.rollback()
+            self.load_model(version)
+        return version
+
+    #aggiorna in O(1) le feature ritardate con il campione in ingest e lo restituisce arricchito
+    def update_streaming_features(self, sensor_data: dict):
+        if self.feature_state is None:
+            return sensor_data
+        enriched = dict(sensor_data)
+        enriched.update(self.feature_state.update(sensor_data))
+        return enriched
+
+    #vettore delle feature del modello; le feature ritardate mancanti vengono dallo stato streaming,
+    #che però esiste solo nel processo che riceve i campioni (nei worker web è vuoto): senza storico
+    #ritardi, medie ed EWMA sarebbero il valore corrente e la predizione non sarebbe quella del training
+    def _feature_vector(self, sensor_data: dict):
+        if self.feature_state is not None and any(col not in sensor_data for col in self.feature_state.names):
+            if not self.feature_state.samples_seen:
+                raise ValueError("Feature ritardate mancanti e nessun campione nello stato streaming: "
+                                 "calcolarle dallo storico (compute_feature_frame)")
+            sensor_data = dict(sensor_data)
+            for name, value in self.feature_state.preview(sensor_data).items():
+                sensor_data.setdefault(name, value)
 
         features = []
         for col in self.feature_columns:
             if col not in sensor_data:
                 raise ValueError(f"Feature mancante: {col}")
             features.append(float(sensor_data[col]))
+        return features
+
+    #avvia il modello selezionato come migliore
+    def predict_silica(self, sensor_data: dict):
+        if not self.is_ready():
+            raise RuntimeError("Il modello non è caricato o allenato")
+
+        X = np.array([self._feature_vector(sensor_data)])
+        key = None
+        if self.prediction_cache is not None:
+            #letta prima del modello: un cambio di modello durante il calcolo scarta il valore
+            generation = self.prediction_cache.generation
+            key = self._cache_key(X[0], "point")
+            cached = self.prediction_cache.get(key)
+            if cached is not None:
+                return cached
+
+        if self.flat_model is not None:
+            prediction = float(self.flat_model.predict(X)[0])
+        else:
+            prediction = float(self.model.predict(X)[0])
+        if key is not None:
+            self.prediction_cache.put(key, prediction, generation)
+        return prediction
+
+    #stima puntuale, percentili e probabilità di superamento soglia in un solo passaggio vettoriale.
+    #con una foresta si usa la dispersione degli alberi; per il boosting (alberi non indipendenti)
+    #si ricade su una normale centrata sulla stima con deviazione pari all'RMSE di test
+    def predict_interval(self, sensor_data, percentiles=DEFAULT_PERCENTILES, threshold=None):
+        if not self.is_ready():
+            raise RuntimeError("Il modello non è caricato o allenato")
+        percentiles = self._check_percentiles(percentiles)
+        samples = [sensor_data] if isinstance(sensor_data, dict) else list(sensor_data)
+        X = np.array([self._feature_vector(sample) for sample in samples])
+        #in cache solo le richieste singole, come quelle dell'ingest
+        key = None
+        if self.prediction_cache is not None and isinstance(sensor_data, dict):
+            generation = self.prediction_cache.generation
+            key = self._cache_key(X[0], "interval", tuple(percentiles), threshold)
+            cached = self.prediction_cache.get(key)
+            if cached is not None:
+                return dict(cached)
+
+        if self.flat_model is not None and self.flat_model.kind == FOREST:
+            per_tree = self.flat_model.predict_per_tree(X)[:, :, 0]
+            summary = self._summarize_tree_outputs(per_tree, percentiles, threshold)
+        else:
+            summary = self._summarize_residual_normal(self.predict_batch(X), percentiles, threshold)
+
+        results = [dict(self._interval_entry(summary, i), prediction=float(summary["prediction"][i]))
+                   for i in range(len(samples))]
+        if key is not None:
+            self.prediction_cache.put(key, results[0], generation)
+            return dict(results[0])
+        return results[0] if isinstance(sensor_data, dict) else results
+
+    #percentili nell'intervallo aperto (0, 100): agli estremi la normale dei residui darebbe ±inf
+    @staticmethod
+    def _check_percentiles(percentiles):
+        try:
+            values = tuple(float(q) for q in percentiles)
+        except (TypeError, ValueError):
+            raise ValueError(f"Percentili non validi: {percentiles}")
+        if not values or any(not 0 < q < 100 for q in values):
+            raise ValueError(f"I percentili devono essere compresi tra 0 e 100 esclusi: {percentiles}")
+        return values
 
-        X = np.array([features])
-        return float(self.model.predict(X)[0])
\ No newline at end of file
+    @staticmethod
+    def _summarize_tree_outputs(per_tree, percentiles, threshold):
+        summary = {
+            "method": "tree_spread",
+            "prediction": per_tree.mean(axis=0),
+            "std": per_tree.std(axis=0),
+            "percentiles": dict(zip(percentiles, np.percentile(per_tree, percentiles, axis=0)))
+        }
+        if threshold is not None:
+            summary["exceedance"] = (per_tree > threshold).mean(axis=0)
+        return summary
+
+    def _summarize_residual_normal(self, prediction, percentiles, threshold):
+        sigma = float(self.metrics.get("rmse") or 0.0) or 1e-9
+        summary = {
+            "method": "residual_normal",
+            "prediction": prediction,
+            "std": np.full(len(prediction), sigma),
+            "percentiles": {q: prediction + NormalDist().inv_cdf(q / 100) * sigma for q in percentiles}
+        }
+        if threshold is not None:
+            summary["exceedance"] = np.array([1 - NormalDist(mu, sigma).cdf(threshold) for mu in prediction])
+        return summary
+
+    #valori del campione i-esimo in formato serializzabile
+    @staticmethod
+    def _interval_entry(summary, i):
+        quantiles = {f"p{q:g}": float(values[i]) for q, values in summary["percentiles"].items()}
+        entry = {
+            "method": summary["method"],
+            "std": float(summary["std"][i]),
+            "percentiles": quantiles,
+            "lower": min(quantiles.values()),
+            "upper": max(quantiles.values())
+        }
+        if "exceedance" in summary:
+            entry["exceedance_probability"] = float(summary["exceedance"][i])
+        return entry
+
+    #predizione vettoriale su una matrice di feature (o DataFrame) in un'unica chiamata
+    def predict_batch(self, X):
+        if not self.is_ready():
+            raise RuntimeError("Il modello non è caricato o allenato")
+        if isinstance(X, pd.DataFrame):
+            X = X[self.feature_columns].to_numpy(dtype=np.float64)
+        X = np.asarray(X, dtype=np.float64)
+        if self.flat_model is not None:
+            return self.flat_model.predict(X)
+        return self.model.predict(X)
+
+    #what-if sui setpoint: griglia di 1 o 2 parametri valutata con una sola predizione batch.
+    #con steady_state il valore è considerato mantenuto nel tempo, quindi anche medie, EWMA
+    #e ritardi della colonna assumono il nuovo valore (deviazioni a zero)
+    def sweep_setpoints(self, state: dict, parameters, top_k=5, steady_state=True):
+        if not self.is_ready():
+            raise RuntimeError("Il modello non è caricato o allenato")
+        if not 1 <= len(parameters) <= 2:
+            raise ValueError("Indicare uno o due parametri da variare")
+
+        base = np.array(self._feature_vector(state), dtype=np.float64)
+        axes = []
+        for param in parameters:
+            column = param.get("column")
+            if column not in SETPOINT_COLUMNS or column not in self.base_feature_columns:
+                raise ValueError(f"Parametro non regolabile: {column}")
+            axes.append((column, self._sweep_values(column, param, base)))
+        n_points = int(np.prod([len(values) for _, values in axes]))
+        if n_points > MAX_SWEEP_POINTS:
+            raise ValueError(f"Griglia troppo grande: {n_points} punti (massimo {MAX_SWEEP_POINTS})")
+
+        grids = np.meshgrid(*[values for _, values in axes], indexing="ij")
+        X = np.tile(base, (n_points, 1))
+        for (column, _), grid in zip(axes, grids):
+            for index, value in self._setpoint_columns(column, steady_state):
+                X[:, index] = grid.ravel() if value is None else value
+        predictions = self.predict_batch(X)
+
+        best = np.argsort(predictions)[:top_k]
+        baseline = float(self.predict_batch(base.reshape(1, -1))[0])
+        return {
+            "model_version": self.model_version,
+            "steady_state": steady_state,
+            "parameters": [{"column": column, "values": values.tolist(), "current": float(state.get(column, np.nan))}
+                           for column, values in axes],
+            "surface": predictions.reshape([len(values) for _, values in axes]).tolist(),
+            "baseline_prediction": baseline,
+            "best": [{
+                "setpoints": {column: float(grid.ravel()[i]) for (column, _), grid in zip(axes, grids)},
+                "predicted_silica": float(predictions[i]),
+                "improvement": baseline - float(predictions[i])
+            } for i in best],
+            "points": n_points
+        }
+
+    #valori da provare: lista esplicita o intervallo min/max; di default il 10°-90° percentile del training
+    def _sweep_values(self, column, param, base):
+        if param.get("values") is not None:
+            return np.asarray(param["values"], dtype=np.float64)
+        low, high = param.get("min"), param.get("max")
+        if low is None or high is None:
+            index = self.feature_columns.index(column)
+            if self.drift_reference is not None:
+                edges = self.drift_reference["drift_edges"][index]
+                default_low, default_high = float(edges[0]), float(edges[-1])
+            else:
+                default_low, default_high = base[index] * 0.8, base[index] * 1.2
+            low = default_low if low is None else low
+            high = default_high if high is None else high
+        return np.linspace(float(low), float(high), int(param.get("steps", 25)))
+
+    #colonne del vettore toccate da un setpoint: (indice, None) = valore della griglia, altrimenti costante
+    def _setpoint_columns(self, column, steady_state):
+        result = [(self.feature_columns.index(column), None)]
+        if steady_state:
+            for index, name in enumerate(self.feature_columns):
+                if name.startswith(column + " "):
+                    result.append((index, 0.0 if " std" in name else None))
+        return result
+
+    #versione dei dati di storico: hash del file ricalcolato solo se cambiano mtime o dimensione
+    def get_data_version(self):
+        stat = os.stat(self.data_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if self._data_version is None or self._data_version[0] != signature:
+            self._data_version = (signature, compute_file_hash(self.data_path))
+        return self._data_version[1]
+
+    #errore del modello in funzione della distanza di predizione, sul tratto finale dello storico
+    #escluso dal training (split temporale), diviso in segmenti consecutivi
+    def evaluate_performance_by_time_gap(self, gaps=None, n_segments=5, max_samples=50000):
+        gaps = sorted(set(gaps or PERFORMANCE_GAPS))
+        data_version = self.get_data_version()
+        cache_name = f"backtest_{data_version[:16]}_{n_segments}_{max_samples}_{'-'.join(map(str, gaps))}.json"
+        cache_key = (self.model_version, cache_name)
+
+        with self._backtest_lock:
+            if cache_key in self._backtest_cache:
+                return dict(self._backtest_cache[cache_key], cached=True)
+            if self.model_version:
+                stored = self.registry.read_json(self.model_version, cache_name)
+                if stored is not None:
+                    self._backtest_cache = {cache_key: stored}
+                    return dict(stored, cached=True)
+
+            result = self._run_backtest(gaps, n_segments, max_samples)
+            result["data_version"] = data_version
+            if self.model_version:
+                self.registry.write_json(self.model_version, cache_name, result)
+            #si tiene solo il risultato della versione corrente
+            self._backtest_cache = {cache_key: result}
+            return dict(result, cached=False)
+
+    def _run_backtest(self, gaps, n_segments, max_samples):
+        start = datetime.now()
+        df = self.load_training_data()
+        warnings = []
+        #solo le righe mai viste in training; i modelli precedenti allo split temporale
+        #(test set casuale) non hanno un tratto escluso e il risultato è in-sample
+        holdout_start = self.metrics.get("holdout_start")
+        if holdout_start is None:
+            holdout_start = self._holdout_start(len(df))
+            warnings.append("modello senza split temporale: le righe valutate possono essere state usate in training")
+        elif self.training_data_hash and self.training_data_hash != self.get_data_version():
+            warnings.append("lo storico è cambiato dopo il training: il tratto escluso potrebbe non corrispondere")
+        if self.metrics.get("recent_samples"):
+            warnings.append(f"{self.metrics['recent_samples']} campioni di training ricevuti in ingest non sono nello storico e non vengono valutati")
+        if self.incremental_updates:
+            warnings.append(f"{self.incremental_updates} update incrementali: i campioni in streaming possono coincidere con lo storico")
+        df = df.iloc[holdout_start:].tail(max_samples)
+        y = df[self.target_column].to_numpy(dtype=np.float64)
+        #inferenza su tutto il tratto in un solo batch, poi confronto con il valore dopo gap passi
+        predictions = self.predict_batch(df)
+        direct = None
+        if self.horizon_model is not None:
+            direct = self.horizon_model.predict(df[self.feature_columns].to_numpy(dtype=np.float64)).reshape(len(df), -1)
+
+        results = []
+        for gap in gaps:
+            if gap >= len(y):
+                continue
+            y_pred = predictions[:-gap]
+            y_true = y[gap:]
+            overall = self._regression_metrics(y_true, y_pred)
+
+            #segmenti consecutivi del tratto escluso (stesso modello), per vedere la variabilità nel tempo
+            blocks = np.array_split(np.arange(len(y_true)), min(n_segments, len(y_true)))
+            block_mae = [float(np.mean(np.abs(y_true[b] - y_pred[b]))) for b in blocks if len(b)]
+
+            entry = {
+                "gap_steps": gap,
+                "gap_minutes": gap * SAMPLE_INTERVAL_SECONDS / 60,
+                "samples": int(len(y_true)),
+                "mae": overall["mae"],
+                "rmse": overall["rmse"],
+                "r2": overall["r2"],
+                "mae_by_segment": block_mae,
+                "mae_std_across_segments": float(np.std(block_mae))
+            }
+            #confronto con il modello diretto addestrato per questo orizzonte
+            if direct is not None and gap in self.forecast_horizons:
+                entry["direct_forecast"] = self._regression_metrics(y_true, direct[:-gap, self.forecast_horizons.index(gap)])
+            results.append(entry)
+
+        return {
+            "success": True,
+            "model_version": self.model_version,
+            "model_name": self.model_name,
+            "evaluation": "holdout" if self.metrics.get("holdout_start") is not None else "in_sample",
+            "holdout_start": int(holdout_start),
+            "samples": int(len(y)),
+            "sample_interval_seconds": SAMPLE_INTERVAL_SECONDS,
+            "n_segments": n_segments,
+            "gaps": results,
+            "warnings": warnings,
+            "computed_at": datetime.now().isoformat(),
+            "elapsed_ms": round((datetime.now() - start).total_seconds() * 1000, 1)
+        }
+
+    @staticmethod
+    def _regression_metrics(y_true, y_pred):
+        errors = y_true - y_pred
+        sse = float(np.sum(errors ** 2))
+        sst = float(np.sum((y_true - y_true.mean()) ** 2))
+        return {
+            "mae": float(np.mean(np.abs(errors))),
+            "rmse": float(np.sqrt(sse / len(errors))),
+            "r2": 1 - sse / sst if sst > 0 else 0.0
+        }
+
+    #accoda un campione etichettato ricevuto in ingest per il prossimo update incrementale
+    def add_training_sample(self, sensor_data: dict):
+        target = sensor_data.get(self.target_column)
+        if target is None:
+            return False
+        try:
+            features = self._feature_vector(sensor_data)
+            target = float(target)
+        except (KeyError, TypeError, ValueError):
+            return False
+        if np.isnan(target) or np.isnan(features).any():
+            return False
+        self.pending_samples.append((features, target))
+        self.recent_samples.append((features, target))
+        return True
+
+    #aggiorna il modello con il mini-batch dei soli nuovi campioni, senza rileggere lo storico
+    def partial_update(self, persist=True):
+        if not self.is_ready() or len(self.pending_samples) < self.incremental_batch_size:
+            return 0
+
+        with self._update_lock:
+            batch = [self.pending_samples.popleft() for _ in range(len(self.pending_samples))]
+            if not batch:
+                return 0
+            X = np.array([b[0] for b in batch])
+            y = np.array([b[1] for b in batch])
+
+            scaler = self.model.named_steps["scaler"]
+            regressor = self.model.named_steps["regressor"]
+            X_scaled = scaler.transform(X)
+
+            if hasattr(regressor, "partial_fit"):
+                #copia e sostituzione, così le predizioni concorrenti vedono sempre un modello coerente
+                new_model = copy.deepcopy(self.model)
+                new_model.named_steps["regressor"].partial_fit(X_scaled, y)
+                self._set_model(new_model)
+            elif isinstance(regressor, RandomForestRegressor):
+                new_model = copy.deepcopy(self.model)
+                self._add_forest_trees(new_model.named_steps["regressor"], X_scaled, y)
+                self._set_model(new_model)
+            elif isinstance(regressor, GradientBoostingRegressor):
+                #warm start: i nuovi stadi imparano i residui del modello attuale sul batch
+                new_model = copy.deepcopy(self.model)
+                booster = new_model.named_steps["regressor"]
+                self._cap_boosting_stages(booster)
+                booster.set_params(warm_start=True, n_estimators=booster.n_estimators_ + self.incremental_trees)
+                booster.fit(X_scaled, y)
+                self._set_model(new_model)
+            else:
+                print(f"Update incrementale non supportato per {type(regressor).__name__}")
+                return 0
+
+            self.incremental_updates += 1
+            self.incremental_samples += len(batch)
+            self.last_incremental_update = datetime.now().isoformat()
+            self.metrics["incremental_updates"] = self.incremental_updates
+            self.metrics["incremental_samples"] = self.incremental_samples
+            print(f"Update incrementale #{self.incremental_updates}: {len(batch)} nuovi campioni")
+
+            if persist:
+                self.save_model(kind="incremental")
+        return len(batch)
+
+    #oltre max_estimators il boosting riparte dagli stadi del training completo: gli stadi sono
+    #sequenziali (ognuno corregge i residui dei precedenti), quindi non si possono scartare i più
+    #vecchi tra quelli incrementali come per la foresta
+    def _cap_boosting_stages(self, booster):
+        base = self.metrics.get("base_estimators")
+        if base is None:
+            #modelli salvati senza il conteggio: si stimano gli stadi aggiunti dagli update
+            base = max(booster.n_estimators_ - self.incremental_updates * self.incremental_trees, 1)
+        if booster.n_estimators_ + self.incremental_trees <= max(self.max_estimators, base + self.incremental_trees):
+            return
+        booster.estimators_ = booster.estimators_[:base]
+        booster.train_score_ = booster.train_score_[:base]
+        if getattr(booster, "oob_improvement_", None) is not None:
+            booster.oob_improvement_ = booster.oob_improvement_[:base]
+            booster.oob_scores_ = booster.oob_scores_[:base]
+        booster.n_estimators_ = base
+        booster.n_estimators = base
+        print(f"Boosting oltre {self.max_estimators} stadi: si riparte dai {base} stadi del training completo")
+
+    #aggiunge alla foresta alberi allenati solo sul batch; gli alberi del training completo restano,
+    #oltre il limite si scartano i più vecchi tra quelli incrementali
+    def _add_forest_trees(self, forest, X_scaled, y):
+        params = forest.get_params()
+        params.update(n_estimators=self.incremental_trees, warm_start=False, n_jobs=1)
+        if params.get("random_state") is not None:
+            params["random_state"] = params["random_state"] + self.incremental_updates + 1
+        new_forest = RandomForestRegressor(**params)
+        new_forest.fit(X_scaled, y)
+
+        base = self.metrics.get("base_estimators")
+        if base is None:
+            #modelli salvati senza il conteggio: si stimano gli alberi aggiunti dagli update
+            base = max(len(forest.estimators_) - self.incremental_updates * self.incremental_trees, 0)
+        incremental = list(forest.estimators_[base:]) + list(new_forest.estimators_)
+        keep = max(self.max_estimators - base, self.incremental_trees)
+        estimators = list(forest.estimators_[:base]) + incremental[-keep:]
+        forest.estimators_ = estimators
+        forest.n_estimators = len(estimators)
+
+    #avvia gli update incrementali periodici in un thread separato
+    def start_incremental_updates(self, interval_seconds=600):
+        if self._update_thread and self._update_thread.is_alive():
+            return
+        self._stop_updates.clear()
+        self._update_thread = threading.Thread(target=self._incremental_update_loop,
+                                               args=(interval_seconds,), daemon=True)
+        self._update_thread.start()
+        print(f"Update incrementali del modello ogni {interval_seconds} secondi")
+
+    def stop_incremental_updates(self):
+        self._stop_updates.set()
+
+    def _incremental_update_loop(self, interval_seconds):
+        while not self._stop_updates.wait(interval_seconds):
+            try:
+                self.partial_update()
+            except Exception as e:
+                print(f"Errore update incrementale: {e}")
+
+    #sketch della distribuzione di training salvati insieme al modello
+    def _build_drift_reference(self, df):
+        self.drift_reference = build_reference_sketches(df, self.feature_columns)
+        self._reset_drift_monitor()
+
+    #il monitor riparte da zero quando cambia il riferimento (nuovo training o altra versione)
+    def _reset_drift_monitor(self):
+        if self.drift_reference is None:
+            self.drift_monitor = None
+            return
+        self.drift_monitor = DriftMonitor(self.feature_columns, self.drift_reference["drift_edges"],
+                                          self.drift_reference["drift_reference"], windows=self.drift_windows)
+
+    #aggiorna le finestre di deriva con il campione in ingest (già arricchito con le feature ritardate)
+    def update_drift(self, sensor_data: dict):
+        if self.drift_monitor is not None:
+            self.drift_monitor.update(sensor_data)
+
+    #punteggi grezzi del monitor, serializzabili (es. per lo stato condiviso con i worker web)
+    def get_drift_snapshot(self):
+        if self.drift_monitor is None:
+            return {"model_version": self.model_version, "windows": None}
+        return {
+            "model_version": self.model_version,
+            "windows": list(self.drift_monitor.windows),
+            "samples_seen": self.drift_monitor.samples_seen,
+            "scores": {str(w): features for w, features in self.drift_monitor.scores().items()}
+        }
+
+    def get_drift_report(self, psi_threshold=PSI_SIGNIFICANT, min_features=3):
+        return drift_report(self.get_drift_snapshot(), psi_threshold, min_features)
+
+    #importanza per permutazione della versione attiva, sul test set del training o sui campioni recenti
+    def compute_feature_importance(self, source="training", n_repeats=5, max_samples=5000, n_workers=None):
+        version = self.model_version
+        if version is None:
+            raise RuntimeError("Il modello non è pubblicato nel registro")
+        if source == "training":
+            df = self.load_training_data()
+            X = df[self.feature_columns].to_numpy(dtype=np.float64)
+            y = df[self.target_column].to_numpy(dtype=np.float64)
+            #stesso test set delle metriche: i campioni di training sovrastimerebbero l'importanza
+            holdout_start = self.metrics.get("holdout_start", self._holdout_start(len(y)))
+            X, y = X[holdout_start:], y[holdout_start:]
+        elif source == "recent":
+            samples = list(self.recent_samples)
+            if len(samples) < 50:
+                raise ValueError(f"Campioni recenti insufficienti: {len(samples)}")
+            X = np.array([s[0] for s in samples])
+            y = np.array([s[1] for s in samples])
+        else:
+            raise ValueError(f"Sorgente sconosciuta: {source}")
+        if len(X) > max_samples:
+            keep = np.sort(np.random.default_rng(42).choice(len(X), size=max_samples, replace=False))
+            X, y = X[keep], y[keep]
+
+        result = permutation_importance(self.registry.root, version, X, y, self.feature_columns,
+                                        n_repeats=n_repeats, n_workers=n_workers)
+        result.update(source=source, computed_on_version=version, computed_at=datetime.now().isoformat())
+        self.registry.write_json(version, f"importance_{source}.json", result)
+        self._importance_cache[(version, source)] = result
+        print(f"Importanza feature ({source}) calcolata per {version} in {result['elapsed_seconds']} s")
+        return result
+
+    #calcolo in un thread separato; False se è già in corso
+    def start_feature_importance(self, source="training", **kwargs):
+        if self._importance_thread is not None and self._importance_thread.is_alive():
+            return False
+
+        def run():
+            self.importance_error = None
+            try:
+                self.compute_feature_importance(source, **kwargs)
+            except Exception as e:
+                self.importance_error = str(e)
+                print(f"Errore calcolo importanza feature: {e}")
+
+        self._importance_thread = threading.Thread(target=run, daemon=True)
+        self._importance_thread.start()
+        return True
+
+    #le versioni degli update incrementali non ricalcolano l'importanza: si usa quella dell'ultima
+    #versione da cui discendono che la possiede (computed_on_version indica quale)
+    def get_feature_importance(self, source="training"):
+        version = self.model_version
+        if version is None:
+            return None
+        key = (version, source)
+        if key not in self._importance_cache:
+            result = self._find_feature_importance(version, source)
+            if result is None:
+                return None
+            self._importance_cache[key] = result
+        return self._importance_cache[key]
+
+    def _find_feature_importance(self, version, source):
+        while version is not None:
+            result = self.registry.read_json(version, f"importance_{source}.json")
+            if result is not None:
+                result.setdefault("computed_on_version", version)
+                return result
+            try:
+                manifest = self.registry.load_manifest(version)
+            except OSError:
+                return None
+            if manifest.get("kind") != "incremental":
+                return None
+            version = manifest.get("parent_version")
+        return None
+
+    #informazioni sul modello per API e log
+    def get_model_info(self):
+        if not self.is_ready():
+            return {"status": "NOT_TRAINED"}
+        return {
+            "status": "READY",
+            "model_name": self.model_name,
+            "version": self.model_version,
+            "available_versions": self.registry.list_versions(),
+            "last_full_version": self.registry.last_full_version(),
+            "training_data_hash": self.training_data_hash,
+            "metrics": self.metrics,
+            "features": self.feature_columns,
+            "base_features": self.base_feature_columns,
+            "feature_config": self.feature_config,
+            "target": self.target_column,
+            "forecast_horizons": self.forecast_horizons if self.horizon_model is not None else [],
+            "horizon_metrics": self.horizon_metrics,
+            "prediction_cache": self.prediction_cache.stats() if self.prediction_cache is not None else None,
+            "feature_importance": {
+                "training": self.get_feature_importance("training"),
+                "recent": self.get_feature_importance("recent"),
+                "running": self._importance_thread is not None and self._importance_thread.is_alive(),
+                "last_error": self.importance_error
+            },
+            "incremental": {
+                "updates": self.incremental_updates,
+                "samples": self.incremental_samples,
+                "pending_samples": len(self.pending_samples),
+                "batch_size": self.incremental_batch_size,
+                "last_update": self.last_incremental_update
+            }
+        }
+
+
+#report di deriva dai punteggi del monitor: il retrain è consigliato se nella finestra più lunga
+#almeno min_features feature superano la soglia PSI
+def drift_report(snapshot, psi_threshold=PSI_SIGNIFICANT, min_features=3):
+    if not snapshot or not snapshot.get("windows"):
+        return {"status": "NO_REFERENCE", "model_version": (snapshot or {}).get("model_version"),
+                "retrain_recommended": False}
+
+    windows = {}
+    for w in snapshot["windows"]:
+        features = snapshot["scores"][str(w)]
+        drifted = sorted((col for col, f in features.items() if f["psi"] >= psi_threshold),
+                         key=lambda col: features[col]["psi"], reverse=True)
+        windows[str(w)] = {
+            "window_samples": w,
+            "window_minutes": w * SAMPLE_INTERVAL_SECONDS / 60,
+            "max_psi": max((f["psi"] for f in features.values()), default=None),
+            "max_ks": max((f["ks"] for f in features.values()), default=None),
+            "drifted_features": drifted,
+            "features": features
+        }
+    longest = windows[str(snapshot["windows"][-1])]
+    return {
+        "status": "READY" if longest["features"] else "WARMING_UP",
+        "model_version": snapshot["model_version"],
+        "samples_seen": snapshot["samples_seen"],
+        "psi_threshold": psi_threshold,
+        "windows": windows,
+        "retrain_recommended": len(longest["drifted_features"]) >= min_features
+    }
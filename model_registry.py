@@ -0,0 +1,160 @@
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime
+import joblib
+import numpy as np
+
+#nome del file che punta alla versione attiva
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+
+#hash sha256 di un file letto a blocchi, usato per tracciare i dati di training
+def compute_file_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+#registro versionato dei modelli: una cartella per versione con manifest e artefatti
+class ModelRegistry:
+    def __init__(self, root="models/registry", keep_versions=5):
+        self.root = root
+        self.keep_versions = max(2, keep_versions)  #la versione precedente resta sempre per il rollback
+        os.makedirs(self.root, exist_ok=True)
+
+    def version_path(self, version):
+        return os.path.join(self.root, version)
+
+    #versioni pubblicate in ordine crescente
+    def list_versions(self):
+        versions = [d for d in os.listdir(self.root)
+                    if d.startswith("v") and os.path.isfile(os.path.join(self.root, d, MANIFEST_FILE))]
+        return sorted(versions)
+
+    def current_version(self):
+        current_file = os.path.join(self.root, CURRENT_FILE)
+        if not os.path.exists(current_file):
+            return None
+        with open(current_file) as f:
+            version = f.read().strip()
+        return version if os.path.isdir(self.version_path(version)) else None
+
+    #cambia la versione attiva in modo atomico
+    def activate(self, version):
+        if version not in self.list_versions():
+            raise ValueError(f"Versione modello inesistente: {version}")
+        tmp_file = os.path.join(self.root, CURRENT_FILE + ".tmp")
+        with open(tmp_file, "w") as f:
+            f.write(version)
+        os.replace(tmp_file, os.path.join(self.root, CURRENT_FILE))
+
+    #salva gli artefatti in una nuova cartella versionata e la rende attiva;
+    #gli array vanno in .npy separati per poterli mappare in memoria al caricamento
+    def publish(self, artifacts: dict, manifest: dict, arrays: dict = None):
+        versions = self.list_versions()
+        last_number = int(versions[-1][1:]) if versions else 0
+        version = f"v{last_number + 1:04d}"
+        tmp_dir = self.version_path(version + ".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        files = {}
+        for name, obj in artifacts.items():
+            filename = f"{name}.joblib"
+            joblib.dump(obj, os.path.join(tmp_dir, filename))
+            files[name] = filename
+
+        array_files = {}
+        if arrays:
+            os.makedirs(os.path.join(tmp_dir, "arrays"))
+            for name, array in arrays.items():
+                filename = os.path.join("arrays", f"{name}.npy")
+                np.save(os.path.join(tmp_dir, filename), np.ascontiguousarray(array))
+                array_files[name] = filename
+
+        manifest = dict(manifest)
+        manifest.update({
+            "version": version,
+            "parent_version": self.current_version(),
+            "created_at": datetime.now().isoformat(),
+            "artifacts": files,
+            "arrays": array_files
+        })
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+
+        os.rename(tmp_dir, self.version_path(version))
+        self.activate(version)
+        self.prune()
+        return version
+
+    def load_manifest(self, version=None):
+        version = version or self.current_version()
+        if version is None:
+            return None
+        with open(os.path.join(self.version_path(version), MANIFEST_FILE)) as f:
+            return json.load(f)
+
+    #carica un artefatto serializzato con joblib
+    def load_artifact(self, name, version=None, mmap=False):
+        manifest = self.load_manifest(version)
+        if manifest is None or name not in manifest["artifacts"]:
+            raise FileNotFoundError(f"Artefatto {name} non presente nel registro")
+        path = os.path.join(self.version_path(manifest["version"]), manifest["artifacts"][name])
+        return joblib.load(path, mmap_mode="r" if mmap else None)
+
+    #carica gli array mappati in sola lettura: le pagine sono condivise tra i processi
+    def load_arrays(self, version=None):
+        manifest = self.load_manifest(version)
+        if manifest is None:
+            return {}
+        base = self.version_path(manifest["version"])
+        return {name: np.load(os.path.join(base, filename), mmap_mode="r")
+                for name, filename in manifest.get("arrays", {}).items()}
+
+    #risultati derivati (es. backtest) salvati accanto agli artefatti della versione
+    def write_json(self, version, name, data):
+        path = os.path.join(self.version_path(version), name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, default=str)
+        os.replace(tmp_path, path)
+
+    def read_json(self, version, name):
+        path = os.path.join(self.version_path(version), name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    #torna alla versione precedente a quella attiva
+    def rollback(self):
+        versions = self.list_versions()
+        current = self.current_version()
+        if current not in versions or versions.index(current) == 0:
+            raise ValueError("Nessuna versione precedente disponibile per il rollback")
+        previous = versions[versions.index(current) - 1]
+        self.activate(previous)
+        return previous
+
+    #ultima versione da training completo (le versioni senza "kind" sono precedenti agli update incrementali)
+    def last_full_version(self, versions=None):
+        for version in reversed(versions or self.list_versions()):
+            manifest = self.load_manifest(version)
+            if manifest.get("kind", "full") != "incremental":
+                return version
+        return None
+
+    #elimina le versioni più vecchie mantenendo sempre l'attiva, la precedente e l'ultimo
+    #training completo, così il rollback può sempre tornare a un modello non incrementale
+    def prune(self):
+        versions = self.list_versions()
+        keep = {self.current_version(), self.last_full_version(versions)}
+        for version in versions[:-self.keep_versions]:
+            if version not in keep:
+                shutil.rmtree(self.version_path(version), ignore_errors=True)
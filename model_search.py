@@ -0,0 +1,155 @@
+import time
+import math
+import itertools
+import multiprocessing
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.preprocessing import StandardScaler
+from sklearn.pipeline import Pipeline
+from sklearn.metrics import r2_score
+
+#spazio dei parametri di default per ogni candidato; sovrascrivibile da settings o dalla richiesta
+DEFAULT_SEARCH_SPACE = {
+    'RandomForest': {
+        'n_estimators': [50, 100, 200],
+        'max_depth': [None, 12, 20],
+        'min_samples_leaf': [1, 3, 10],
+        'max_features': [1.0, 0.5, 'sqrt']
+    },
+    'GradientBoosting': {
+        'n_estimators': [100, 200, 400],
+        'learning_rate': [0.03, 0.1, 0.2],
+        'max_depth': [2, 3, 5],
+        'subsample': [0.7, 1.0]
+    }
+}
+
+REGRESSORS = {
+    'RandomForest': RandomForestRegressor,
+    'GradientBoosting': GradientBoostingRegressor
+}
+
+
+#stessa struttura delle pipeline allenate da SilicaPredictor
+def build_pipeline(candidate, params, random_state=42):
+    if candidate not in REGRESSORS:
+        raise ValueError(f"Candidato sconosciuto: {candidate}")
+    params = dict(params)
+    if candidate == 'RandomForest':
+        params.setdefault('n_jobs', 1)  #il parallelismo è già dato dal pool di processi
+    return Pipeline([
+        ("scaler", StandardScaler()),
+        ("regressor", REGRESSORS[candidate](random_state=random_state, **params))
+    ])
+
+
+#estrae n configurazioni distinte (candidato, parametri) dallo spazio di ricerca
+def sample_configurations(search_space, n_configs, random_state=42):
+    rng = np.random.default_rng(random_state)
+    grid = []
+    for candidate, space in search_space.items():
+        names = sorted(space)
+        for values in itertools.product(*(space[name] for name in names)):
+            grid.append((candidate, dict(zip(names, values))))
+    if len(grid) <= n_configs:
+        return grid
+    chosen = rng.choice(len(grid), size=n_configs, replace=False)
+    return [grid[i] for i in sorted(chosen)]
+
+
+#dati condivisi con i processi worker, passati una sola volta all'avvio del pool
+_WORKER_DATA = {}
+
+
+def _init_worker(X_train, y_train, X_val, y_val):
+    _WORKER_DATA.update(X_train=X_train, y_train=y_train, X_val=X_val, y_val=y_val)
+
+
+def _evaluate_config(candidate, params, n_samples, random_state):
+    start = time.time()
+    pipeline = build_pipeline(candidate, params, random_state)
+    pipeline.fit(_WORKER_DATA['X_train'][:n_samples], _WORKER_DATA['y_train'][:n_samples])
+    score = r2_score(_WORKER_DATA['y_val'], pipeline.predict(_WORKER_DATA['X_val']))
+    return float(score), time.time() - start
+
+
+#successive halving: tutte le configurazioni su pochi dati, le migliori 1/eta su sempre più dati.
+#il budget è un limite rigido: allo scadere il pool viene terminato e vince chi è arrivato più
+#avanti (anche nel turno interrotto). il budget copre solo la ricerca, non il riallenamento finale
+def successive_halving(X_train, y_train, X_val, y_val, search_space=None, n_configs=27, eta=3,
+                       min_samples=1000, time_budget=600, n_workers=None, random_state=42):
+    start = time.time()
+    deadline = start + time_budget
+    configs = sample_configurations(search_space or DEFAULT_SEARCH_SPACE, n_configs, random_state)
+    # dati già mescolati: i sottoinsiemi crescenti sono prefissi
+    order = np.random.default_rng(random_state).permutation(len(X_train))
+    X_train, y_train = np.asarray(X_train)[order], np.asarray(y_train)[order]
+
+    n_total = len(X_train)
+    n_rungs = max(1, int(math.ceil(math.log(max(len(configs), 1), eta))) + 1)
+    leaderboard = [{'candidate': c, 'params': p, 'rungs': [], 'status': 'running'} for c, p in configs]
+    alive = list(range(len(configs)))
+    timed_out = False
+
+    pool = multiprocessing.Pool(processes=n_workers or multiprocessing.cpu_count(),
+                                initializer=_init_worker, initargs=(X_train, y_train, X_val, y_val))
+    try:
+        for rung in range(n_rungs):
+            is_last = rung == n_rungs - 1
+            n_samples = n_total if is_last else min(n_total, min_samples * eta ** rung)
+            jobs = {i: pool.apply_async(_evaluate_config, (configs[i][0], configs[i][1], n_samples, random_state))
+                    for i in alive}
+
+            for i, job in jobs.items():
+                #a budget scaduto si raccolgono comunque i job del turno già terminati
+                if timed_out and not job.ready():
+                    continue
+                remaining = deadline - time.time()
+                try:
+                    score, seconds = job.get(timeout=max(remaining, 0.001))
+                except multiprocessing.TimeoutError:
+                    timed_out = True
+                    continue
+                except Exception as e:
+                    leaderboard[i]['status'] = 'failed'
+                    leaderboard[i]['error'] = str(e)
+                    continue
+                leaderboard[i]['rungs'].append({'rung': rung, 'samples': int(n_samples),
+                                                'r2': score, 'fit_seconds': round(seconds, 2)})
+            if timed_out:
+                break
+
+            completed = [i for i in alive if leaderboard[i]['rungs'] and leaderboard[i]['rungs'][-1]['rung'] == rung]
+            completed.sort(key=lambda i: leaderboard[i]['rungs'][-1]['r2'], reverse=True)
+            if is_last or n_samples >= n_total:
+                alive = completed
+                break
+            keep = max(1, len(completed) // eta)
+            for i in completed[keep:]:
+                leaderboard[i]['status'] = 'eliminated'
+            alive = completed[:keep]
+    finally:
+        pool.terminate()
+        pool.join()
+
+    for entry in leaderboard:
+        if entry['status'] == 'running':
+            entry['status'] = 'timeout' if timed_out and not entry['rungs'] else 'finalist'
+        last = entry['rungs'][-1] if entry['rungs'] else None
+        entry['best_rung'] = last['rung'] if last else -1
+        entry['r2'] = last['r2'] if last else None
+
+    #ordinamento: prima chi è arrivato più avanti, poi per punteggio
+    leaderboard.sort(key=lambda e: (e['best_rung'], e['r2'] if e['r2'] is not None else float('-inf')), reverse=True)
+    if leaderboard and leaderboard[0]['r2'] is not None:
+        leaderboard[0]['status'] = 'winner'
+
+    return {
+        'leaderboard': leaderboard,
+        'eta': eta,
+        'n_configs': len(configs),
+        'rungs_planned': n_rungs,
+        'timed_out': timed_out,
+        'time_budget_seconds': time_budget,
+        'elapsed_seconds': round(time.time() - start, 2)
+    }
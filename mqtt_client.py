@@ -61,6 +61,8 @@ class MiningDataClient:
         
         #pubblica su MQTT
         topic = "mining/sensor_data"
+        #contesto di traccia: il server misura da qui la latenza di ogni fase
+        message['trace'] = {'published_at': time.time()}
         payload = json.dumps(message)
         
         try:
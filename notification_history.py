@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+from metrics import REGISTRY
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    subject TEXT,
+    recipient_count INTEGER NOT NULL DEFAULT 0,
+    details TEXT
+);
+CREATE TABLE IF NOT EXISTS event_recipients (
+    event_id INTEGER NOT NULL,
+    recipient TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS idx_events_type ON events (type, id);
+CREATE INDEX IF NOT EXISTS idx_events_status ON events (status, id);
+CREATE INDEX IF NOT EXISTS idx_recipients ON event_recipients (recipient, event_id);
+CREATE INDEX IF NOT EXISTS idx_recipients_event ON event_recipients (event_id);
+"""
+
+
+#storico append-only di allerte, digest e invii email su SQLite. Le scritture passano da una coda
+#e un thread dedicato le salva a blocchi, così ingest e notifiche non aspettano mai il disco
+class NotificationHistory:
+    def __init__(self, db_path="data/notification_history.db", max_queue_size=10000, batch_size=500,
+                 flush_interval=1.0):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.close()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped_count = 0
+        self.written_count = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        REGISTRY.gauge('mining_history_queue_depth', 'Eventi dello storico notifiche in attesa di scrittura',
+                       function=self._queue.qsize)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    #registra un evento senza bloccare; se la coda è piena l'evento viene contato come perso
+    def record(self, event_type, status, subject=None, recipients=(), details=None):
+        event = (time.time(), event_type, status, subject, list(recipients or []), details)
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.dropped_count += 1
+            return False
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            #raccoglie quanto arriva nel frattempo per un'unica transazione
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(conn, batch)
+                self.written_count += len(batch)
+            except sqlite3.Error as e:
+                print(f"Errore scrittura storico notifiche: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, conn, batch):
+        with conn:
+            for ts, event_type, status, subject, recipients, details in batch:
+                cursor = conn.execute(
+                    "INSERT INTO events (ts, type, status, subject, recipient_count, details) VALUES (?, ?, ?, ?, ?, ?)",
+                    (ts, event_type, status, subject, len(recipients), json.dumps(details, default=str) if details else None))
+                if recipients:
+                    conn.executemany("INSERT INTO event_recipients (event_id, recipient, ts) VALUES (?, ?, ?)",
+                                     [(cursor.lastrowid, r, ts) for r in recipients])
+
+    #attende che gli eventi in coda siano scritti
+    def flush(self, timeout=10):
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+        return self._queue.unfinished_tasks == 0
+
+    #paginazione keyset sull'id (decrescente): il costo non dipende dalla profondità della pagina
+    def query(self, event_type=None, status=None, recipient=None, since=None, until=None, before_id=None, limit=50):
+        limit = max(1, min(int(limit), 500))
+        conditions, params = [], []
+        #con il filtro per destinatario si parte dall'indice (recipient, event_id)
+        source, id_column = "events e", "e.id"
+        if recipient:
+            source, id_column = "event_recipients r JOIN events e ON e.id = r.event_id", "r.event_id"
+            conditions.append("r.recipient = ?")
+            params.append(recipient)
+        if event_type:
+            conditions.append("e.type = ?")
+            params.append(event_type)
+        if status:
+            conditions.append("e.status = ?")
+            params.append(status)
+        if since is not None:
+            conditions.append("e.ts >= ?")
+            params.append(_timestamp(since))
+        if until is not None:
+            conditions.append("e.ts < ?")
+            params.append(_timestamp(until))
+        if before_id is not None:
+            conditions.append(f"{id_column} < ?")
+            params.append(int(before_id))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT e.id, e.ts, e.type, e.status, e.subject, e.recipient_count, e.details "
+                f"FROM {source} {where} ORDER BY {id_column} DESC LIMIT ?", params + [limit + 1]).fetchall()
+            entries = [self._entry(conn, row) for row in rows[:limit]]
+        finally:
+            conn.close()
+        return {
+            'history': entries,
+            'next_cursor': entries[-1]['id'] if len(rows) > limit else None
+        }
+
+    def _entry(self, conn, row):
+        event_id, ts, event_type, status, subject, recipient_count, details = row
+        recipients = [r[0] for r in conn.execute(
+            "SELECT recipient FROM event_recipients WHERE event_id = ?", (event_id,))]
+        return {
+            'id': event_id,
+            'timestamp': datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'),
+            'type': event_type,
+            'status': status,
+            'subject': subject,
+            'recipients': recipients,
+            'recipient_count': recipient_count,
+            'details': json.loads(details) if details else None
+        }
+
+    def get_statistics(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'written_count': self.written_count,
+            'dropped_count': self.dropped_count
+        }
+
+
+#accetta timestamp unix o stringhe ISO
+def _timestamp(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
@@ -0,0 +1,84 @@
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+#risoluzione di default delle feature: valori che differiscono meno di così sono la stessa lettura
+DEFAULT_RESOLUTION = 0.01
+
+
+#cache LRU delle predizioni con scadenza: la chiave è il vettore di feature quantizzato
+#alla risoluzione dei sensori, così letture ripetute o quasi identiche non rieseguono il modello.
+#ogni clear() apre una nuova generazione: i valori calcolati prima (con il modello sostituito)
+#e salvati dopo vengono scartati
+class PredictionCache:
+    def __init__(self, max_size=4096, ttl_seconds=300, resolution=DEFAULT_RESOLUTION):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.resolution = resolution
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+        self.generation = 0
+
+    #risoluzione per feature (scalare o vettore allineato alle colonne del modello)
+    def set_resolution(self, resolution):
+        with self._lock:
+            self.resolution = resolution
+            self._entries.clear()
+            self.generation += 1
+
+    def key(self, vector, *extra):
+        quantized = np.round(np.asarray(vector, dtype=np.float64) / self.resolution).astype(np.int64)
+        return (quantized.tobytes(),) + extra
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    #generation: valore di self.generation letto prima di usare il modello
+    def put(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                self.stale_puts += 1
+                return False
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    #da chiamare a ogni cambio di modello: le predizioni salvate non sono più valide
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts
+            }
@@ -0,0 +1,178 @@
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import random
+import pstats
+import cProfile
+import threading
+from datetime import datetime
+from collections import Counter
+
+#impostazioni di default (settings['profiling']): frazione di richieste profilate con cProfile e
+#soglia oltre la quale una richiesta viene salvata con gli stack campionati (0 = disattivato)
+DEFAULT_PROFILING_SETTINGS = {
+    'sample_rate': 0.0,
+    'slow_request_seconds': 5.0
+}
+#periodo di campionamento degli stack delle richieste in corso
+SAMPLE_INTERVAL = 0.01
+MAX_STACK_DEPTH = 100
+
+
+#profilazione delle richieste HTTP. Due modalità:
+# - cProfile (statistiche complete per funzione) su richiesta esplicita o per una frazione casuale
+#   delle richieste; un solo cProfile alla volta per processo, le altre richieste non vengono profilate
+# - campionamento degli stack: un thread legge ogni SAMPLE_INTERVAL lo stack dei thread che servono
+#   una richiesta; se la richiesta supera la soglia gli stack vengono salvati, altrimenti scartati
+#i profili sono file in directory (condivisa tra i worker) con accanto i metadati della richiesta
+class RequestProfiler:
+    def __init__(self, settings_provider, directory='data/profiles', max_profiles=200, sample_interval=SAMPLE_INTERVAL):
+        self.settings_provider = settings_provider  #restituisce settings['profiling']
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.sample_interval = sample_interval
+        os.makedirs(directory, exist_ok=True)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._cprofile_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+        self._sampler.start()
+
+    def _settings(self):
+        return dict(DEFAULT_PROFILING_SETTINGS, **(self.settings_provider() or {}))
+
+    #inizio richiesta: request_info sono i parametri salvati col profilo (metodo, path, argomenti...)
+    def start(self, request_info, requested=False):
+        settings = self._settings()
+        token = {'info': request_info, 'started': time.perf_counter(), 'profile': None, 'reason': None}
+        if requested or random.random() < float(settings['sample_rate']):
+            if self._cprofile_lock.acquire(blocking=False):
+                token['profile'] = cProfile.Profile()
+                token['reason'] = 'requested' if requested else 'sampled'
+                token['profile'].enable()
+        slow_seconds = float(settings['slow_request_seconds'] or 0)
+        if slow_seconds > 0 and token['profile'] is None:
+            token['slow_seconds'] = slow_seconds
+            token['thread'] = threading.get_ident()
+            token['stacks'] = Counter()
+            with self._lock:
+                self._active[token['thread']] = token
+            self._wake.set()
+        return token
+
+    #fine richiesta: restituisce l'id del profilo salvato o None
+    def stop(self, token, status=None):
+        duration = time.perf_counter() - token['started']
+        if token['profile'] is not None:
+            token['profile'].disable()
+            self._cprofile_lock.release()
+            return self._save(token, duration, status, 'cprofile')
+        if 'thread' in token:
+            with self._lock:
+                self._active.pop(token['thread'], None)
+            if duration >= token['slow_seconds'] and token['stacks']:
+                token['reason'] = 'slow'
+                return self._save(token, duration, status, 'stacks')
+        return None
+
+    def _sample_loop(self):
+        while True:
+            self._wake.wait()
+            #sotto lock: una richiesta terminata non riceve più campioni mentre viene salvata
+            with self._lock:
+                if not self._active:
+                    self._wake.clear()
+                    continue
+                frames = sys._current_frames()
+                for thread_id, token in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        token['stacks'][self._stack(frame)] += 1
+                del frames
+            time.sleep(self.sample_interval)
+
+    #stack dalla radice alla funzione corrente, nel formato "collapsed" dei flame graph
+    @staticmethod
+    def _stack(frame):
+        names = []
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _save(self, token, duration, status, kind):
+        profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        metadata = dict(token['info'], id=profile_id, created_at=datetime.now().isoformat(), kind=kind,
+                        reason=token['reason'], status=status, duration_seconds=round(duration, 4))
+        try:
+            if kind == 'cprofile':
+                token['profile'].dump_stats(self._path(profile_id, 'prof'))
+            else:
+                metadata['samples'] = sum(token['stacks'].values())
+                metadata['sample_interval'] = self.sample_interval
+                with open(self._path(profile_id, 'txt'), 'w') as f:
+                    for stack, count in token['stacks'].most_common():
+                        f.write(f"{stack} {count}\n")
+            with open(self._path(profile_id, 'json'), 'w') as f:
+                json.dump(metadata, f, default=str)
+        except OSError as e:
+            print(f"Errore salvataggio profilo: {e}")
+            return None
+        print(f"Profilo {profile_id} salvato ({metadata['reason']}, {duration:.2f} s): {metadata.get('path')}")
+        self._prune()
+        return profile_id
+
+    def _path(self, profile_id, extension):
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    #conserva solo gli ultimi max_profiles profili
+    def _prune(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        for name in names[:max(len(names) - self.max_profiles, 0)]:
+            profile_id = name[:-5]
+            for extension in ('json', 'prof', 'txt'):
+                try:
+                    os.remove(self._path(profile_id, extension))
+                except OSError:
+                    pass
+
+    def list_profiles(self, limit=50, path=None):
+        profiles = []
+        for name in sorted((n for n in os.listdir(self.directory) if n.endswith('.json')), reverse=True):
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if path and not str(metadata.get('path', '')).startswith(path):
+                continue
+            profiles.append(metadata)
+            if len(profiles) >= limit:
+                break
+        return profiles
+
+    #(percorso del file, metadati) di un profilo, None se non esiste
+    def get_profile(self, profile_id):
+        #l'id arriva dall'URL: niente separatori di percorso
+        if os.path.basename(profile_id) != profile_id:
+            return None
+        try:
+            with open(self._path(profile_id, 'json')) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+        file_path = self._path(profile_id, 'prof' if metadata['kind'] == 'cprofile' else 'txt')
+        return (file_path, metadata) if os.path.exists(file_path) else None
+
+    #report testuale di un profilo cProfile, ordinato per tempo cumulativo
+    @staticmethod
+    def text_report(file_path, limit=60):
+        output = io.StringIO()
+        stats = pstats.Stats(file_path, stream=output)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
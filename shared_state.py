@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    name TEXT NOT NULL,
+    args TEXT,
+    requested_by TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    completed_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_commands_status ON commands (status, id);
+"""
+
+
+#stato condiviso tra il processo di ingest e i worker web su SQLite locale (WAL): l'ingest pubblica
+#istantanee (contatori, allerte, ultimo campione, info modello) che i worker leggono senza bloccarlo;
+#le operazioni che spettano all'ingest (retrain, reset contatori, digest) passano dalla tabella comandi
+class SharedState:
+    def __init__(self, db_path="data/shared_state.db"):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.close()
+        #una connessione per thread; gli oggetti ricostruiti restano in cache finché la chiave non cambia
+        self._local = threading.local()
+        self._objects = {}
+        self._objects_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    #pubblica più chiavi nella stessa transazione, eliminando eventualmente quelle in delete
+    def publish(self, items, delete=()):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO state (key, value, updated_at) VALUES (?, ?, ?)",
+                             [(key, json.dumps(value, default=str), now) for key, value in items.items()])
+            if delete:
+                conn.executemany("DELETE FROM state WHERE key = ?", [(key,) for key in delete])
+
+    def get(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def updated_at(self, key):
+        row = self._conn().execute("SELECT updated_at FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    #tutte le chiavi con un prefisso (es. le metriche pubblicate dai vari processi);
+    #con with_time i valori sono coppie (updated_at, valore)
+    def items(self, prefix, with_time=False):
+        rows = self._conn().execute("SELECT key, value, updated_at FROM state WHERE key >= ? AND key < ?",
+                                    (prefix, prefix + '\uffff')).fetchall()
+        if with_time:
+            return {key: (updated_at, json.loads(value)) for key, value, updated_at in rows}
+        return {key: json.loads(value) for key, value, _ in rows}
+    
+    #oggetto costruito dal valore pubblicato, ricostruito solo quando la chiave viene aggiornata
+    def get_object(self, key, build, default=None):
+        updated_at = self.updated_at(key)
+        if updated_at is None:
+            return default
+        with self._objects_lock:
+            cached = self._objects.get(key)
+            if cached and cached[0] == updated_at:
+                return cached[1]
+        obj = build(self.get(key))
+        with self._objects_lock:
+            self._objects[key] = (updated_at, obj)
+        return obj
+
+    def send_command(self, name, args=None, requested_by=None):
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute("INSERT INTO commands (ts, name, args, requested_by) VALUES (?, ?, ?, ?)",
+                                  (time.time(), name, json.dumps(args or {}), requested_by))
+        return cursor.lastrowid
+
+    #comandi in attesa, marcati come in esecuzione (un solo processo di ingest li consuma)
+    def take_commands(self):
+        conn = self._conn()
+        with conn:
+            rows = conn.execute("SELECT id, name, args, requested_by FROM commands WHERE status = 'pending' ORDER BY id").fetchall()
+            if rows:
+                conn.executemany("UPDATE commands SET status = 'running' WHERE id = ?", [(row[0],) for row in rows])
+        return [{'id': row[0], 'name': row[1], 'args': json.loads(row[2] or '{}'), 'requested_by': row[3]} for row in rows]
+
+    def complete_command(self, command_id, status, result=None):
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE commands SET status = ?, result = ?, completed_at = ? WHERE id = ?",
+                         (status, json.dumps(result, default=str) if result is not None else None, time.time(), command_id))
+
+    def get_command(self, command_id):
+        row = self._conn().execute("SELECT id, ts, name, status, result, completed_at FROM commands WHERE id = ?",
+                                   (command_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'ts': row[1],
+            'name': row[2],
+            'status': row[3],
+            'result': json.loads(row[4]) if row[4] else None,
+            'completed_at': row[5]
+        }
@@ -0,0 +1,86 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from model_registry import compute_file_hash
+
+MATRIX_FILE = "matrix.npy"
+META_FILE = "meta.json"
+
+
+#cache del dataset di training già preprocessato: solo le colonne usate, float32, senza NaN.
+#la matrice è salvata per colonne (ordine Fortran) e caricata mappata in memoria
+class TrainingDataCache:
+    def __init__(self, cache_dir="data/cache"):
+        self.cache_dir = cache_dir
+
+    #una cartella per file sorgente e insieme di colonne
+    def entry_path(self, source_path, columns):
+        digest = hashlib.sha1("\n".join(columns).encode("utf-8")).hexdigest()[:12]
+        name = os.path.splitext(os.path.basename(source_path))[0]
+        return os.path.join(self.cache_dir, f"{name}-{digest}")
+
+    #valida se mtime e dimensione coincidono; altrimenti si confronta l'hash del contenuto
+    def _is_valid(self, meta, source_path, columns):
+        if meta.get("columns") != list(columns):
+            return False
+        stat = os.stat(source_path)
+        if meta.get("mtime_ns") == stat.st_mtime_ns and meta.get("size") == stat.st_size:
+            return True
+        if meta.get("size") != stat.st_size or meta.get("sha256") != compute_file_hash(source_path):
+            return False
+        #file toccato ma identico: si aggiorna solo la firma
+        meta["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+    #restituisce il DataFrame in cache o None se assente/non valida
+    def load(self, source_path, columns):
+        entry = self.entry_path(source_path, columns)
+        meta_path = os.path.join(entry, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            mtime_before = meta.get("mtime_ns")
+            if not self._is_valid(meta, source_path, columns):
+                return None
+            if meta["mtime_ns"] != mtime_before:
+                self._write_meta(entry, meta)
+            matrix = np.load(os.path.join(entry, MATRIX_FILE), mmap_mode="r")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Cache training non leggibile, verrà ricostruita: {e}")
+            return None
+        return pd.DataFrame(matrix, columns=meta["columns"], copy=False)
+
+    #salva le colonne richieste in float32 scartando le righe incomplete
+    def store(self, source_path, columns, df):
+        entry = self.entry_path(source_path, columns)
+        tmp_entry = entry + ".tmp"
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        os.makedirs(tmp_entry)
+
+        frame = df[list(columns)].dropna()
+        matrix = np.asfortranarray(frame.to_numpy(dtype=np.float32))
+        np.save(os.path.join(tmp_entry, MATRIX_FILE), matrix)
+
+        stat = os.stat(source_path)
+        self._write_meta(tmp_entry, {
+            "source_path": source_path,
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": compute_file_hash(source_path),
+            "columns": list(columns),
+            "rows": int(matrix.shape[0])
+        })
+        shutil.rmtree(entry, ignore_errors=True)
+        os.rename(tmp_entry, entry)
+        print(f"Cache training aggiornata: {matrix.shape[0]} righe, {matrix.shape[1]} colonne in {entry}")
+
+    def _write_meta(self, entry, meta):
+        tmp_path = os.path.join(entry, META_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(entry, META_FILE))
@@ -0,0 +1,187 @@
+import math
+import threading
+
+#finestre temporali mantenute dall'indice, in secondi (None = tutto lo storico conservato)
+DEFAULT_WINDOWS = {'1h': 3600, '24h': 86400, '7d': 7 * 86400}
+
+
+#albero di Fenwick sui conteggi per bin: aggiornamento e somma prefissa in O(log bin)
+class FenwickTree:
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0] * (size + 1)
+        self.total = 0
+
+    def add(self, index, delta=1):
+        self.total += delta
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    #somma dei bin 0..index compresi
+    def prefix(self, index):
+        if index < 0:
+            return 0
+        result = 0
+        i = min(index, self.size - 1) + 1
+        while i > 0:
+            result += self.tree[i]
+            i -= i & -i
+        return result
+
+    #conteggi per bin, ricavati dall'albero in O(bin)
+    def counts(self):
+        counts = list(self.tree)
+        for i in range(self.size, 0, -1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                counts[parent] -= counts[i]
+        return counts[1:]
+
+    @classmethod
+    def from_counts(cls, counts):
+        tree = cls(len(counts))
+        tree.tree[1:] = list(counts)
+        for i in range(1, tree.size + 1):
+            parent = i + (i & -i)
+            if parent <= tree.size:
+                tree.tree[parent] += tree.tree[i]
+        tree.total = sum(counts)
+        return tree
+
+
+#istogramma fine dei valori (es. % Silica) aggiornato in ingest: per qualsiasi soglia la
+#quota di campioni sopra è una somma prefissa, per lo storico completo e per finestre mobili.
+#lo "storico completo" non scade: contiene lo storico caricato all'avvio (load_history) e tutti
+#i campioni ricevuti da allora, a partire da all_since; per periodi definiti si usano le finestre
+class ValueIndex:
+    def __init__(self, min_value=0.0, max_value=10.0, resolution=0.001, windows=None):
+        self.min_value = min_value
+        self.resolution = resolution
+        #un bin per ogni passo di risoluzione più due bin di overflow agli estremi
+        self.n_bins = int(round((max_value - min_value) / resolution)) + 3
+        self.windows = dict(DEFAULT_WINDOWS if windows is None else windows)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._all = FenwickTree(self.n_bins)
+            self.all_since = None
+            self._window_trees = {name: FenwickTree(self.n_bins) for name in self.windows}
+            #campioni in ordine di arrivo, per togliere dalle finestre quelli scaduti;
+            #per ogni finestra la posizione del campione più vecchio ancora incluso
+            self._samples = []
+            self._window_start = {name: 0 for name in self.windows}
+
+    #il bin k contiene i valori in (min + (k-2)*risoluzione, min + (k-1)*risoluzione], così
+    #"valore > soglia" sono esattamente i bin dopo quello della soglia (per soglie multiple della
+    #risoluzione; altrimenti si escludono i valori tra la soglia e il bordo superiore del suo bin).
+    #il bin 0 raccoglie quelli sotto il minimo; la tolleranza assorbe gli errori di virgola mobile
+    def _bin(self, value):
+        position = int(math.ceil((value - self.min_value) / self.resolution - 1e-9)) + 1
+        return min(max(position, 0), self.n_bins - 1)
+
+    def add(self, ts, value):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return
+        index = self._bin(float(value))
+        with self._lock:
+            self._all.add(index)
+            if self.all_since is None:
+                self.all_since = ts
+            for tree in self._window_trees.values():
+                tree.add(index)
+            self._samples.append((ts, index))
+            self._expire(ts)
+
+    #carica lo storico già salvato, precedente ai campioni ricevuti in diretta
+    def load_history(self, samples):
+        with self._lock:
+            first = self._samples[0][0] if self._samples else None
+            history = sorted((ts, self._bin(float(value))) for ts, value in samples
+                             if value is not None and not (isinstance(value, float) and math.isnan(value))
+                             and (first is None or ts < first))
+            for _, index in history:
+                self._all.add(index)
+            if history:
+                self.all_since = history[0][0]
+            for name, tree in self._window_trees.items():
+                #se la finestra ha già scartato campioni, quelli storici sono comunque fuori
+                if self._window_start[name]:
+                    self._window_start[name] += len(history)
+                else:
+                    for _, index in history:
+                        tree.add(index)
+            self._samples = history + self._samples
+            if self._samples:
+                self._expire(self._samples[-1][0])
+            return len(history)
+
+    #conteggi per bin (solo quelli non vuoti) dello storico e di ogni finestra, per lo stato condiviso.
+    #un indice ricostruito da questo stato risponde alle query ma non fa scadere le finestre
+    def get_state(self, now=None):
+        with self._lock:
+            if now is not None:
+                self._expire(now)
+            trees = dict(self._window_trees, **{'': self._all})
+            return {
+                'min_value': self.min_value,
+                'resolution': self.resolution,
+                'n_bins': self.n_bins,
+                'all_since': self.all_since,
+                'trees': {name: [(i, c) for i, c in enumerate(tree.counts()) if c] for name, tree in trees.items()}
+            }
+
+    @classmethod
+    def from_state(cls, state):
+        index = cls(state['min_value'], resolution=state['resolution'], windows={})
+        index.n_bins = state['n_bins']
+        trees = {}
+        for name, sparse in state['trees'].items():
+            counts = [0] * index.n_bins
+            for i, c in sparse:
+                counts[i] = c
+            trees[name] = FenwickTree.from_counts(counts)
+        index._all = trees.pop('')
+        index.all_since = state.get('all_since')
+        index._window_trees = trees
+        index.windows = {name: None for name in trees}
+        index._window_start = {name: 0 for name in trees}
+        return index
+
+    #toglie dalle finestre i campioni più vecchi della loro durata (costo ammortizzato O(log bin))
+    def _expire(self, now):
+        if not self.windows:
+            self._samples.clear()
+            return
+        for name, seconds in self.windows.items():
+            if seconds is None:
+                continue
+            tree = self._window_trees[name]
+            position = self._window_start[name]
+            while position < len(self._samples) and self._samples[position][0] <= now - seconds:
+                tree.add(self._samples[position][1], -1)
+                position += 1
+            self._window_start[name] = position
+        #compattazione quando metà della lista è ormai fuori da tutte le finestre
+        oldest = min(self._window_start.values())
+        if oldest > 1024 and oldest * 2 > len(self._samples):
+            del self._samples[:oldest]
+            for name in self._window_start:
+                self._window_start[name] -= oldest
+
+    #(campioni sopra soglia, campioni totali) per lo storico o una delle finestre
+    def count_above(self, threshold, window=None, now=None):
+        with self._lock:
+            if window is None:
+                tree = self._all
+            else:
+                if window not in self._window_trees:
+                    raise KeyError(window)
+                if now is not None:
+                    self._expire(now)
+                tree = self._window_trees[window]
+            #value > soglia: si escludono tutti i bin fino a quello della soglia compreso
+            return tree.total - tree.prefix(self._bin(threshold)), tree.total